@@ -0,0 +1,176 @@
+from portfolio_optimizer_webapp.pricestore import get_price_store, to_pandas
+import polars as pl
+import pandas as pd
+import numpy as np
+import time
+
+# Whole share allocation of continuous weights for an investment amount.
+#   largest_remainder - the floor of each target, then one more share of the names with the
+#                       largest fractional remainders while the cash lasts, in vectorized
+#                       passes rather than a loop per share. No name goes past its target
+#                       rounded up
+#   exact             - each name gets its floor or floor + 1 shares, whichever choice has the
+#                       least total absolute deviation from the target values. That is a 0/1
+#                       knapsack over the leftover cash, solved by branch and bound within a
+#                       time budget. Unfinished searches return the best choice found, which is
+#                       never worse than the greedy one it starts from
+
+METHODS = ['largest_remainder', 'exact']
+TIME_BUDGET = 1.0
+
+
+def latest_closes(symbols):
+    # Last close of each symbol from the price store, NaN without prices
+    df = get_price_store().load(symbols).filter(pl.col('close').is_finite())\
+        .group_by('symbol', maintain_order=True).agg(pl.col('close').last())
+    return to_pandas(df).set_index('symbol').close.reindex(list(symbols)).astype(float)
+
+
+def floor_shares(target, prices):
+    # Whole shares below each target value, zero for names without a price
+    valid = np.isfinite(prices) & (prices > 0) & (target > 0)
+    shares = np.zeros(len(target))
+    shares[valid] = np.floor(target[valid] / prices[valid])
+    return shares, valid
+
+
+def largest_remainder(target, prices, budget):
+    """
+    Whole shares of the target values (in currency) at prices, spending at most budget.
+    """
+    target, prices = np.asarray(target, dtype=float), np.asarray(prices, dtype=float)
+    shares, valid = floor_shares(target, prices)
+    cash = budget - shares[valid] @ prices[valid]
+
+    # Each pass buys one share of the affordable names still below their target, in order of
+    # remainder until the cash runs out, the next only considers names cheaper than what's left
+    while True:
+        candidates = np.flatnonzero(valid & (prices <= cash) & (shares * prices < target))
+        if len(candidates) == 0:
+            break
+        remainder = target[candidates] / prices[candidates] - shares[candidates]
+        order = candidates[np.argsort(-remainder, kind='stable')]
+        take = order[np.cumsum(prices[order]) <= cash]
+        shares[take] += 1
+        cash -= prices[take].sum()
+
+    return shares.astype(int)
+
+
+def knapsack(values, weights, capacity, time_budget=None):
+    """
+    0/1 knapsack by depth-first branch and bound over the items in decreasing value per
+    weight, pruned with the fractional (Dantzig) bound. Returns a boolean mask of the chosen
+    items and whether the search finished (the choice is optimal) within time_budget seconds.
+    """
+    n = len(values)
+    order = np.argsort(-values / weights, kind='stable')
+    v, w = values[order], weights[order]
+    density = v / w
+    cum_v = np.concatenate([[0.0], np.cumsum(v)])
+    cum_w = np.concatenate([[0.0], np.cumsum(w)])
+
+    def bound(k, cap):
+        # Items from k on in order, the first one that doesn't fit taken fractionally
+        j = np.searchsorted(cum_w, cum_w[k] + cap, 'right') - 1
+        extra = cum_v[j] - cum_v[k]
+        if j < n:
+            extra += (cap - (cum_w[j] - cum_w[k])) * density[j]
+        return extra
+
+    # Greedy incumbent
+    best_value, best_path, cap = 0.0, None, capacity
+    for k in range(n):
+        if w[k] <= cap:
+            cap -= w[k]
+            best_value += v[k]
+            best_path = (k, best_path)
+
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    finished = True
+    # Nodes: (next item, capacity left, value, chosen items as a linked list)
+    stack = [(0, capacity, 0.0, None)]
+    nodes = 0
+    while stack:
+        nodes += 1
+        if deadline is not None and nodes % 1024 == 0 and time.perf_counter() > deadline:
+            finished = False
+            break
+
+        k, cap, value, path = stack.pop()
+        if value > best_value:
+            best_value, best_path = value, path
+        while k < n and w[k] > cap:
+            k += 1
+        if k == n or value + bound(k, cap) <= best_value + 1e-9:
+            continue
+        stack.append((k + 1, cap, value, path))
+        stack.append((k + 1, cap - w[k], value + v[k], (k, path)))
+
+    chosen = np.zeros(n, dtype=bool)
+    while best_path is not None:
+        k, best_path = best_path
+        chosen[order[k]] = True
+    return chosen, finished
+
+
+def exact(target, prices, budget, time_budget=TIME_BUDGET):
+    """
+    Whole shares of the target values at prices within budget, floor or floor + 1 of each,
+    minimizing the total absolute deviation from the targets. Returns the shares and whether
+    the choice is proven optimal.
+    """
+    target, prices = np.asarray(target, dtype=float), np.asarray(prices, dtype=float)
+    shares, valid = floor_shares(target, prices)
+    cash = budget - shares[valid] @ prices[valid]
+
+    # One more share turns a deviation of r into price - r
+    gain = np.zeros(len(target))
+    gain[valid] = 2 * (target[valid] - shares[valid] * prices[valid]) - prices[valid]
+    items = np.flatnonzero(valid & (gain > 0) & (prices <= cash))
+    if len(items) == 0:
+        return shares.astype(int), True
+
+    chosen, optimal = knapsack(gain[items], prices[items], cash, time_budget)
+    shares[items[chosen]] += 1
+    return shares.astype(int), optimal
+
+
+def allocate(weights, amount, method='largest_remainder', prices=None, cov=None, time_budget=TIME_BUDGET):
+    """
+    Whole shares of weights (a Series by symbol) for an investment amount, at prices or else
+    the latest closes in the price store. Returns a dict of
+      shares         - Series of whole shares
+      weights        - Series of the weights those shares make up
+      leftover       - cash left over
+      deviation      - total absolute difference between the target and held values
+      tracking_error - volatility of the difference from the target weights under cov (the
+                       annualized covariance of the symbols), None without cov
+      optimal        - whether exact proved its choice optimal, None for largest_remainder
+    """
+    if method not in METHODS:
+        raise ValueError(f'method must be one of {", ".join(METHODS)}')
+
+    if prices is None:
+        prices = latest_closes(weights.index)
+    prices = pd.Series(prices, index=weights.index, dtype=float).to_numpy()
+    target = amount * weights.to_numpy(dtype=float)
+
+    optimal = None
+    if method == 'exact':
+        shares, optimal = exact(target, prices, amount, time_budget)
+    else:
+        shares = largest_remainder(target, prices, amount)
+
+    held = shares * np.nan_to_num(prices)
+    diff = held / amount - weights.to_numpy(dtype=float)
+    tracking_error = None if cov is None else float(np.sqrt(max(diff @ cov @ diff, 0)))
+
+    return {
+        'shares': pd.Series(shares, index=weights.index),
+        'weights': pd.Series(held / amount, index=weights.index),
+        'leftover': float(amount - held.sum()),
+        'deviation': float(np.abs(target - held).sum()),
+        'tracking_error': tracking_error,
+        'optimal': optimal,
+    }
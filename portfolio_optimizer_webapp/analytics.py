@@ -0,0 +1,202 @@
+from portfolio_optimizer_webapp.app_settings import cache_dir, get_setting, temp_path
+from portfolio_optimizer_webapp.models import Fundamentals, Portfolio, PriceRollup, Scores, SecurityList
+from portfolio_optimizer_webapp.pricestore import to_pandas
+from portfolio_optimizer_webapp.rendercache import get_data_version
+from django.core.exceptions import ImproperlyConfigured
+import polars as pl
+import os
+
+# Lazy polars plans for the analytics tables, used instead of the pandas builds when
+#   PORTFOLIO_OPTIMIZER_ANALYTICS_BACKEND = 'polars'
+# Tables are scanned from a Parquet snapshot written once per data version, so a plan only
+# reads the columns it selects and the row groups its filters keep, and runs as one fused,
+# multi-threaded query. With
+#   PORTFOLIO_OPTIMIZER_ANALYTICS_SOURCE = 'connectorx'
+# they are read straight from PORTFOLIO_OPTIMIZER_ANALYTICS_DATABASE_URI instead (needs
+# connectorx and pyarrow installed), selecting only the plan's columns and rows. That read is
+# eager, only the parquet source is lazy end to end.
+
+BACKENDS = ['pandas', 'polars']
+SOURCES = ['parquet', 'connectorx']
+CHUNK_SIZE = 50_000
+
+# Dashboard score table formats, shared with DashboardView.build_score_table
+CASH_FORMAT = '${:.2f}m'
+ALLOCATION_FORMAT = '{:.2f}%'
+
+DTYPES = {
+    'FloatField': pl.Float64,
+    'IntegerField': pl.Int64,
+    'BigIntegerField': pl.Int64,
+    'SmallIntegerField': pl.Int64,
+    'AutoField': pl.Int64,
+    'BigAutoField': pl.Int64,
+    'BooleanField': pl.Boolean,
+    'DateField': pl.Date,
+    'DateTimeField': pl.Datetime('us', 'UTC'),
+}
+
+
+def get_backend():
+    backend = get_setting('ANALYTICS_BACKEND', 'pandas')
+    if backend not in BACKENDS:
+        raise ImproperlyConfigured(f'PORTFOLIO_OPTIMIZER_ANALYTICS_BACKEND must be one of {", ".join(BACKENDS)}')
+    return backend
+
+
+def table_schema(model):
+    # Polars dtype of each column of a model's table, foreign keys typed as their target
+    schema = {}
+    for field in model._meta.concrete_fields:
+        target = field.target_field if field.is_relation else field
+        schema[field.column] = DTYPES.get(target.get_internal_type(), pl.String)
+    return schema
+
+
+def snapshot(model):
+    """
+    Path of a Parquet copy of the model's table for the current data version, written on
+    first use. Snapshots of older versions are removed, bar the previous one in case a
+    plan is still reading it.
+    """
+    root = cache_dir('analytics')
+    table = model._meta.db_table
+    path = root / f'{table}-{get_data_version()}.parquet'
+    if path.exists():
+        return path
+
+    schema = table_schema(model)
+    rows = model.objects.order_by().values_list(*[field.attname for field in model._meta.concrete_fields])
+    frames, chunk = [], []
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            frames.append(pl.DataFrame(chunk, schema=schema, orient='row'))
+            chunk = []
+    frames.append(pl.DataFrame(chunk, schema=schema, orient='row'))
+
+    tmp_path = temp_path(path)
+    pl.concat(frames).write_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+    old = sorted(root.glob(f'{table}-*.parquet'), key=lambda x: x.stat().st_mtime)
+    for stale in old[:-2]:
+        stale.unlink(missing_ok=True)
+    return path
+
+
+def sql_literal(value):
+    # A filter value as SQL, for the internal constants the plans filter on
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    raise TypeError(f'Unsupported filter value {value!r}')
+
+
+def scan(model, columns, **filters):
+    """
+    LazyFrame of the columns of a model's table from the configured source, only the rows
+    whose columns equal the filters. Parquet scans are lazy, the plan's later filters still
+    skip row groups. connectorx runs one query per scan, with the columns and these filters
+    in its SQL and everything else (joins, sorts) done in polars once the rows are read.
+    """
+    source = get_setting('ANALYTICS_SOURCE', 'parquet')
+    if source == 'parquet':
+        lf = pl.scan_parquet(snapshot(model))
+        for column, value in filters.items():
+            lf = lf.filter(pl.col(column) == value)
+        return lf.select(columns)
+    if source == 'connectorx':
+        uri = get_setting('ANALYTICS_DATABASE_URI')
+        if not uri:
+            raise ImproperlyConfigured('PORTFOLIO_OPTIMIZER_ANALYTICS_DATABASE_URI is required for the connectorx source')
+        schema = table_schema(model)
+        query = f'SELECT {", ".join(columns)} FROM {model._meta.db_table}'
+        if filters:
+            query += ' WHERE ' + ' AND '.join(f'{x} = {sql_literal(y)}' for x, y in filters.items())
+        df = pl.read_database_uri(query, uri, engine='connectorx')
+        return df.lazy().cast({x: schema[x] for x in columns})
+    raise ImproperlyConfigured(f'PORTFOLIO_OPTIMIZER_ANALYTICS_SOURCE must be one of {", ".join(SOURCES)}')
+
+
+def yearly_rollup_plan():
+    # Yearly close statistics per symbol, as rollup.yearly_rollup
+    count = pl.col('count')
+    return scan(PriceRollup, ['symbol', 'period_start', 'last_close', 'mean', 'm2', 'count'], period='Y')\
+        .select('symbol',
+                pl.col('period_start').dt.year().cast(pl.Int64).alias('year'),
+                pl.col('last_close').alias('yearly_close'),
+                'mean',
+                pl.when(count > 1).then(pl.col('m2') / (count - 1)).alias('variance'))
+
+
+def analysis_plan():
+    # Scores with their report's date, year and ratios and the year's price statistics
+    fundamentals = scan(Fundamentals, ['id', 'as_of_date', 'year', 'pe_ratio', 'cash_and_cash_equivalents'])\
+        .rename({'id': 'fundamentals_id', 'as_of_date': 'date', 'cash_and_cash_equivalents': 'cash'})
+    scores = scan(Scores, ['symbol', 'fundamentals_id', 'pf_score', 'pf_score_weighted', 'eps', 'roa', 'cash_ratio',
+                           'delta_cash', 'delta_roa', 'accruals', 'delta_long_lev_ratio', 'delta_current_lev_ratio',
+                           'delta_shares', 'delta_gross_margin', 'delta_asset_turnover'])
+
+    return scores.join(fundamentals, on='fundamentals_id')\
+        .join(yearly_rollup_plan(), on=['symbol', 'year'])\
+        .select('symbol', 'fundamentals_id', 'date', 'year', 'pe_ratio', 'cash',
+                pl.exclude('symbol', 'fundamentals_id', 'date', 'year', 'pe_ratio', 'cash'))\
+        .sort('symbol', 'date')
+
+
+def get_analysis_data():
+    # The same frame as plots.get_analysis_data: dates converted by pandas (as the pandas build
+    # does, so the resolution matches) and columns without a value as object None, not NaN
+    import pandas as pd
+
+    df = analysis_plan().collect()
+    empty = [x for x in df.columns if len(df) and df[x].null_count() == len(df)]
+    df = to_pandas(df)
+    df['date'] = pd.to_datetime(df['date'])
+    for col in empty:
+        df[col] = pd.Series([None] * len(df), dtype=object)
+    return df
+
+
+def score_table_plan(scenario=None):
+    # Latest scores per symbol with the scenario's holdings, ordered for the dashboard
+    fundamentals = scan(Fundamentals, ['id', 'as_of_date', 'cash_and_cash_equivalents'])\
+        .rename({'id': 'fundamentals_id', 'as_of_date': 'date', 'cash_and_cash_equivalents': 'cash'})
+    scores = scan(Scores, ['symbol', 'fundamentals_id', 'pf_score', 'pf_score_weighted', 'eps', 'roa', 'delta_cash',
+                           'delta_roa', 'accruals', 'delta_long_lev_ratio', 'delta_current_lev_ratio',
+                           'delta_shares', 'delta_gross_margin', 'delta_asset_turnover'])
+    summaries = scan(SecurityList, ['symbol', 'business_summary'])
+
+    # The scenario's holdings are a few rows written per optimization, read from the ORM
+    holdings = Portfolio.objects.filter(scenario=scenario).values_list('fundamentals_id', 'allocation', 'shares')
+    # (shares as float, as pandas makes them once the unheld symbols are null)
+    holdings = pl.LazyFrame(list(holdings), schema={'fundamentals_id': pl.Int64, 'allocation': pl.Float64,
+                                                    'shares': pl.Float64}, orient='row')
+
+    latest = scores.join(fundamentals, on='fundamentals_id')\
+        .sort('date').unique('symbol', keep='last')
+
+    return latest.join(summaries, on='symbol', how='left')\
+        .join(holdings, on='fundamentals_id', how='left')\
+        .with_columns(pl.col('allocation').fill_null(0))\
+        .sort(['allocation', 'symbol', 'date', 'pf_score'], descending=True, nulls_last=True)\
+        .select('symbol', 'date', 'cash', 'business_summary', 'shares', 'allocation',
+                pl.exclude('symbol', 'fundamentals_id', 'date', 'cash', 'business_summary', 'shares', 'allocation'))
+
+
+def score_table(scenario=None):
+    # Template records of the dashboard score table, as DashboardView.build_score_table
+    # Money and percentages with the formats of the pandas build, polars' own float to
+    # string conversion differs from Python's for small and large values
+    float_fields = pl.selectors.float() - pl.selectors.by_name('allocation', 'cash', 'shares')
+    df = score_table_plan(scenario)\
+        .with_columns(float_fields.fill_nan(None).round(3),
+                      (100 * pl.col('allocation')).map_elements(ALLOCATION_FORMAT.format, return_dtype=pl.String)
+                      .alias('allocation'),
+                      (pl.col('cash') / 1e6).map_elements(CASH_FORMAT.format, return_dtype=pl.String).alias('cash'),
+                      pl.col('date').dt.strftime('%Y-%m-%d'))\
+        .with_row_index('index', offset=1)\
+        .collect()
+    return df.to_dicts()
@@ -0,0 +1,297 @@
+from django.core.exceptions import BadRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.generic.base import View
+
+from portfolio_optimizer_webapp.models import DataSettings, Scores, SecurityList, SecurityPrice
+from portfolio_optimizer_webapp.queries import latest_per_symbol, with_holdings
+from portfolio_optimizer_webapp.rendercache import get_generation, get_last_modified
+
+import itertools
+import hashlib
+import base64
+import json
+import csv
+
+# JSON API over the scores, screens, tickers and price history. Lists are keyset paginated: the next
+# URL carries an opaque cursor with the last row's sort key, so every page is an index range
+# scan rather than an OFFSET that reads all earlier rows again. Price exports stream NDJSON
+# or CSV from a database cursor, so memory stays flat however much history is requested.
+# Responses carry an ETag and Last-Modified tied to the data generation, conditional
+# requests get a 304 until the data changes.
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+
+
+def etag(request, *args, **kwargs):
+    # One tag per data generation, scenario owner and query
+    owner = getattr(scenario_owner(request), 'pk', None)
+    return hashlib.sha1(f'{get_generation()}|{owner}|{request.get_full_path()}'.encode()).hexdigest()
+
+
+def last_modified(request, *args, **kwargs):
+    return get_last_modified()
+
+
+conditional = method_decorator(condition(etag_func=etag, last_modified_func=last_modified), name='get')
+
+
+def encode_cursor(values):
+    text = json.dumps(values, cls=DjangoJSONEncoder)
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+def decode_cursor(text):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(text.encode()))
+    except ValueError:
+        raise BadRequest('Invalid cursor')
+    if not isinstance(values, list) or len(values) != 2:
+        raise BadRequest('Invalid cursor')
+    return values
+
+
+def keyset(qry, sort, tiebreak, cursor=None):
+    """
+    Order qry by sort (a lookup, '-' prefixed for descending, nulls last) then the unique
+    tiebreak lookup, keeping only the rows after cursor, the (sort, tiebreak) values of the
+    last row of the previous page.
+    """
+    descending = sort.startswith('-')
+    field = sort.lstrip('-')
+    order = F(field).desc(nulls_last=True) if descending else F(field).asc(nulls_last=True)
+    qry = qry.order_by(order, tiebreak)
+    if cursor is None:
+        return qry
+
+    value, key = cursor
+    if value is None:
+        return qry.filter(**{f'{field}__isnull': True, f'{tiebreak}__gt': key})
+    after = Q(**{f'{field}__{"lt" if descending else "gt"}': value})
+    return qry.filter(after | Q(**{field: value, f'{tiebreak}__gt': key}) | Q(**{f'{field}__isnull': True}))
+
+
+def int_param(request, name, default=None):
+    value = request.GET.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f'{name} must be an integer')
+
+
+def date_param(request, name):
+    value = request.GET.get(name)
+    if value is None:
+        return None
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date is None:
+        raise BadRequest(f'{name} must be a date (YYYY-MM-DD)')
+    return date
+
+
+def scenario_owner(request):
+    # Signed in users have their own scenarios, everyone else shares those without a user
+    user = getattr(request, 'user', None)
+    return user if user is not None and user.is_authenticated else None
+
+
+def user_scenarios(request):
+    return DataSettings.objects.filter(user=scenario_owner(request)).order_by('pk')
+
+
+def get_scenario(request):
+    # The owner's scenario picked with ?scenario=<id>, else their first, None for ?scenario=new
+    scenarios = user_scenarios(request)
+    pk = request.GET.get('scenario')
+    if pk == 'new':
+        return None
+    if pk is None:
+        return scenarios.first()
+    scenario = scenarios.filter(pk=pk).first() if pk.isdigit() else None
+    if scenario is None:
+        raise Http404('No such scenario')
+    return scenario
+
+
+class KeysetListView(View):
+    """
+    Paginated list of the rows of get_queryset(). fields maps lookups to the output names,
+    sorts maps the accepted sort parameters to lookups and tiebreak is a unique lookup.
+    """
+    fields = {}
+    sorts = {}
+    default_sort = None
+    tiebreak = 'pk'
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        sort = request.GET.get('sort', self.default_sort)
+        if sort.lstrip('-') not in self.sorts:
+            raise BadRequest(f'sort must be one of {", ".join(self.sorts)}, optionally prefixed with -')
+        sort_field = sort[:len(sort) - len(sort.lstrip('-'))] + self.sorts[sort.lstrip('-')]
+
+        limit = min(max(int_param(request, 'limit', PAGE_SIZE), 1), MAX_PAGE_SIZE)
+        cursor = decode_cursor(request.GET['cursor']) if 'cursor' in request.GET else None
+
+        lookups = list(dict.fromkeys([*self.fields, sort_field.lstrip('-'), self.tiebreak]))
+        rows = list(keyset(self.get_queryset(), sort_field, self.tiebreak, cursor).values(*lookups)[:limit + 1])
+
+        next_url = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            query = request.GET.copy()
+            query['cursor'] = encode_cursor([rows[-1][sort_field.lstrip('-')], rows[-1][self.tiebreak]])
+            next_url = f'{request.path}?{query.urlencode()}'
+
+        results = [{name: row[lookup] for lookup, name in self.fields.items()} for row in rows]
+        return JsonResponse({'results': results, 'next': next_url})
+
+
+@conditional
+class ScoresAPIView(KeysetListView):
+    # Latest scores per symbol with a scenario's allocation, e.g. ?sector=Energy&min_score=7&sort=-pf_score&scenario=2
+    fields = {'symbol_id': 'symbol',
+              'symbol__name': 'name',
+              'symbol__sector': 'sector',
+              'fundamentals__as_of_date': 'date',
+              'allocation': 'allocation',
+              **{x: x for x in ['pf_score', 'pf_score_weighted', 'eps', 'roa', 'cash_ratio', 'delta_cash',
+                                'delta_roa', 'accruals', 'delta_long_lev_ratio', 'delta_current_lev_ratio',
+                                'delta_shares', 'delta_gross_margin', 'delta_asset_turnover']}}
+    sorts = {'symbol': 'symbol_id', 'sector': 'symbol__sector', 'date': 'fundamentals__as_of_date',
+             'pf_score': 'pf_score', 'pf_score_weighted': 'pf_score_weighted',
+             'allocation': 'allocation'}
+    default_sort = '-pf_score'
+    tiebreak = 'symbol_id'
+
+    def get_queryset(self):
+        qry = with_holdings(latest_per_symbol(Scores.objects.all()), get_scenario(self.request), ['allocation'])
+        if 'sector' in self.request.GET:
+            qry = qry.filter(symbol__sector__in=self.request.GET.getlist('sector'))
+        min_score = int_param(self.request, 'min_score')
+        if min_score is not None:
+            qry = qry.filter(pf_score__gte=min_score)
+        return qry
+
+
+@conditional
+class TickersAPIView(KeysetListView):
+    fields = {x: x for x in ['symbol', 'name', 'sector', 'industry', 'country', 'last_updated']}
+    sorts = {x: x for x in ['symbol', 'name', 'sector', 'last_updated']}
+    default_sort = 'symbol'
+    tiebreak = 'symbol'
+
+    def get_queryset(self):
+        qry = SecurityList.objects.all()
+        if 'sector' in self.request.GET:
+            qry = qry.filter(sector__in=self.request.GET.getlist('sector'))
+        return qry
+
+
+@conditional
+class ScreensAPIView(View):
+    # Symbols passing each screen, e.g. ?screen={"threshold": 7, "sectors": ["Energy"], "pe_ratio": [null, 20]}
+    # with one screen parameter per screen, all evaluated together
+
+    def get(self, request):
+        from portfolio_optimizer_webapp.screening import run_screens
+
+        try:
+            screens = [json.loads(x) for x in request.GET.getlist('screen')] or [{}]
+        except ValueError:
+            raise BadRequest('screen must be a JSON object')
+        if not all(isinstance(x, dict) for x in screens):
+            raise BadRequest('screen must be a JSON object')
+
+        try:
+            results = run_screens(screens)
+        except (TypeError, ValueError) as e:
+            raise BadRequest(f'Invalid screen: {e}')
+        return JsonResponse({'results': [{'screen': screen, 'count': len(symbols), 'symbols': symbols}
+                                         for screen, symbols in zip(screens, results)]})
+
+
+PRICE_FIELDS = {'symbol_id': 'symbol', 'date': 'date',
+                **{x: x for x in ['open', 'high', 'low', 'close', 'adjclose', 'volume', 'dividends', 'splits']}}
+
+
+def price_queryset(request):
+    # ?symbol=AAPL&symbol=MSFT&start=2020-01-01&end=2020-12-31, all optional
+    qry = SecurityPrice.objects.all()
+    if 'symbol' in request.GET:
+        qry = qry.filter(symbol_id__in=[x.upper() for x in request.GET.getlist('symbol')])
+    start, end = date_param(request, 'start'), date_param(request, 'end')
+    if start is not None:
+        qry = qry.filter(date__gte=start)
+    if end is not None:
+        qry = qry.filter(date__lte=end)
+    return qry
+
+
+@conditional
+class PricesAPIView(KeysetListView):
+    # Pages in (symbol, date) order, the unique index's order
+    fields = PRICE_FIELDS
+    sorts = {'symbol': 'symbol_id'}
+    default_sort = 'symbol'
+    tiebreak = 'date'
+
+    def get_queryset(self):
+        return price_queryset(self.request)
+
+
+class Echo:
+    # File-like for csv.writer that hands back each line instead of buffering it
+    def write(self, value):
+        return value
+
+
+def export_lines(rows, fmt):
+    names = list(PRICE_FIELDS.values())
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(names)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        encoder = DjangoJSONEncoder()
+        for row in rows:
+            yield encoder.encode(dict(zip(names, row))) + '\n'
+
+
+def export_chunks(rows, fmt, chunk_size=EXPORT_CHUNK_SIZE):
+    # Lines are joined into chunks, one write per chunk rather than per row
+    lines = export_lines(rows, fmt)
+    while chunk := ''.join(itertools.islice(lines, chunk_size)):
+        yield chunk
+
+
+@conditional
+class PriceExportView(View):
+    # Whole price history for the filters as ?format=ndjson (default) or ?format=csv
+
+    content_types = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def get(self, request):
+        fmt = request.GET.get('format', 'ndjson')
+        if fmt not in self.content_types:
+            raise BadRequest(f'format must be one of {", ".join(self.content_types)}')
+
+        rows = price_queryset(request).order_by('symbol_id', 'date').values_list(*PRICE_FIELDS)\
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        response = StreamingHttpResponse(export_chunks(rows, fmt), content_type=self.content_types[fmt])
+        response['Content-Disposition'] = f'attachment; filename="prices.{fmt}"'
+        return response
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from pathlib import Path
+import threading
+import tempfile
+import os
+
+# App level settings, all overridable from the project settings with a
+# PORTFOLIO_OPTIMIZER_ prefix, e.g. PORTFOLIO_OPTIMIZER_CACHE_DIR = '/var/cache/optimizer'
+
+
+def get_setting(name, default=None):
+    return getattr(settings, f'PORTFOLIO_OPTIMIZER_{name}', default)
+
+
+def default_cache_root():
+    # Without PORTFOLIO_OPTIMIZER_CACHE_DIR, a directory of this user's in the temp dir, only
+    # accessible to them. The temp dir is shared, so one created (or replaced by a link) by
+    # another user is refused rather than read from
+    root = Path(tempfile.gettempdir()) / 'portfolio_optimizer'
+    root.mkdir(mode=0o700, exist_ok=True)
+    stat = root.lstat()
+    if hasattr(os, 'getuid'):
+        if root.is_symlink() or stat.st_uid != os.getuid():
+            raise ImproperlyConfigured(f'{root} is not owned by this user, set PORTFOLIO_OPTIMIZER_CACHE_DIR')
+        if stat.st_mode & 0o077:
+            root.chmod(0o700)
+    return root
+
+
+def cache_dir(*parts):
+    # Root directory for the on-disk analytics caches (price store etc.)
+    root = get_setting('CACHE_DIR') or default_cache_root()
+    path = Path(root).joinpath(*parts)
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    return path
+
+
+def temp_path(path, suffix='.tmp'):
+    # Scratch file next to path for write-then-os.replace, unique per process and thread so
+    # concurrent job workers never write to the same one
+    path = Path(path)
+    return path.with_name(f'{path.stem}.{os.getpid()}-{threading.get_ident()}{suffix}')
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PortfolioOptimizerWebappConfig(AppConfig):
     name = 'portfolio_optimizer_webapp'
+
+    def ready(self):
+        from portfolio_optimizer_webapp import instrumentation, signals  # noqa: F401
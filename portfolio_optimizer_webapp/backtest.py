@@ -0,0 +1,231 @@
+from portfolio_optimizer_webapp.allocation import largest_remainder
+from portfolio_optimizer_webapp.covariance import ESTIMATORS, TRADING_DAYS, ewma_covariance, ewma_moments
+from portfolio_optimizer_webapp.models import Scores, SecurityList
+from portfolio_optimizer_webapp.optimizer import RISK_FREE_RATE, CovarianceModel, clean_weights, solve
+from portfolio_optimizer_webapp.rendercache import get_data_version
+from portfolio_optimizer_webapp.returns import ffill_index, get_returns_matrix
+from portfolio_optimizer_webapp.worker import init_worker, run_backtest
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import functools
+import os
+import pandas as pd
+import numpy as np
+
+# Walk-forward backtest of the F-score filtered, optimized portfolio. At each rebalance date
+# only reports published by then pass the FScore_threshold filter, expected returns and the
+# covariance come from the trailing window, and the optimizer's weights are bought in whole
+# shares net of transaction costs. Holdings are constant between rebalances, so the daily
+# portfolio value is a single product of the held shares with the close matrix.
+
+REPORT_LAG = 90
+LOOKBACK = TRADING_DAYS
+COST_BPS = 10
+REBALANCE_MONTHS = {'M': 1, 'Q': 3, 'Y': 12}
+BENCHMARK = '^GSPC'
+
+# Objectives that use risk_aversion, the others run once per threshold
+RISK_AVERSE_OBJECTIVES = ['max_quadratic_utility']
+
+GRID = {
+    'thresholds': [5, 6, 7, 8],
+    'objectives': ['max_sharpe', 'min_volatility', 'max_quadratic_utility'],
+    'risk_aversions': [0.25, 0.5, 1.0],
+}
+
+
+@functools.lru_cache(maxsize=2)
+def load_inputs(start=None, data_version=None):
+    """
+    Close and returns matrices of every symbol and the F-score history, loaded once per
+    process and data version so every run of a grid shares them.
+    """
+    symbols = list(SecurityList.objects.values_list('symbol', flat=True))
+    returns_matrix = get_returns_matrix()
+    returns_matrix.update(symbols)
+    close = returns_matrix.frame('close', symbols, start)
+    simple = returns_matrix.frame('simple', symbols, start)
+
+    symbols = close.columns[1:]
+    values = close.select(symbols).to_numpy().astype(float)
+    # Last known price for valuing holdings on days a symbol didn't trade
+    idx = ffill_index(values)
+    prices = np.where(idx >= 0, values[np.maximum(idx, 0), np.arange(len(symbols))], np.nan)
+
+    scores = pd.DataFrame(Scores.objects.values_list('symbol_id', 'fundamentals__as_of_date', 'pf_score'),
+                          columns=['symbol', 'as_of_date', 'pf_score'])
+    scores['published'] = pd.to_datetime(scores.as_of_date) + pd.Timedelta(days=REPORT_LAG)
+
+    return {
+        'dates': close['date'].to_numpy().astype('datetime64[D]'),
+        'symbols': list(symbols),
+        'prices': prices,
+        'returns': simple.select(symbols).to_numpy().astype(float),
+        'scores': scores.sort_values('published'),
+    }
+
+
+def rebalance_rows(dates, rebalance='Q', lookback=LOOKBACK):
+    # First trading day of each period, once there is a full lookback window behind it
+    period = dates.astype('datetime64[M]').astype(int) // REBALANCE_MONTHS[rebalance]
+    first = np.r_[True, period[1:] != period[:-1]]
+    rows = np.nonzero(first)[0]
+    return rows[rows >= lookback]
+
+
+def passing_symbols(scores, date, threshold):
+    # Latest published F-score of each symbol as of date
+    published = scores[scores.published <= pd.Timestamp(date)]
+    latest = published.groupby('symbol').pf_score.last()
+    return set(latest.index[latest >= threshold])
+
+
+def window_covariance(window, method):
+    if method == 'ewma':
+        return ewma_covariance(ewma_moments(window))
+    return ESTIMATORS[method](window)
+
+
+def target_weights(inputs, row, threshold, objective, risk_aversion, l2_gamma, method, lookback, w0):
+    passing = passing_symbols(inputs['scores'], inputs['dates'][row], threshold)
+    window = inputs['returns'][row - lookback + 1:row + 1]
+
+    # Tradable today with at least half a window of history
+    cols = [i for i, x in enumerate(inputs['symbols']) if x in passing and x != BENCHMARK]
+    cols = [i for i in cols if np.isfinite(inputs['prices'][row, i])
+            and np.isfinite(window[:, i]).sum() >= lookback // 2]
+    if not cols:
+        return np.array([], dtype=int), np.array([])
+
+    window = window[:, cols]
+    mu = np.nanmean(window, axis=0) * TRADING_DAYS
+    model = CovarianceModel([inputs['symbols'][i] for i in cols], window_covariance(window, method) * TRADING_DAYS)
+    w0 = None if w0 is None else w0[cols]
+    w0 = w0 / w0.sum() if w0 is not None and w0.sum() > 0 else None
+
+    w = solve(mu, model, objective=objective, risk_aversion=risk_aversion, l2_gamma=l2_gamma, w0=w0)
+    return np.array(cols), clean_weights(w)
+
+
+def summarize(values, dates):
+    returns = values[1:] / values[:-1] - 1
+    years = max((dates[-1] - dates[0]).astype(int) / 365.25, 1 / 365.25)
+    vol = returns.std(ddof=1) * np.sqrt(TRADING_DAYS) if len(returns) > 1 else np.nan
+    return {
+        'total_return': values[-1] / values[0] - 1,
+        'cagr': (values[-1] / values[0]) ** (1 / years) - 1,
+        'volatility': vol,
+        'sharpe': (returns.mean() * TRADING_DAYS - RISK_FREE_RATE) / vol if vol > 0 else np.nan,
+        'max_drawdown': (values / np.maximum.accumulate(values) - 1).min(),
+    }
+
+
+def backtest(threshold=6, objective='max_sharpe', risk_aversion=1.0, l2_gamma=0.0, method='ledoit_wolf',
+             investment_amount=10000, start=None, rebalance='Q', lookback=LOOKBACK, cost_bps=COST_BPS):
+    """
+    Run one walk-forward backtest. Returns the metrics and the daily portfolio value as a
+    Series, or None if there is not enough history for a single rebalance.
+    """
+    inputs = load_inputs(start, get_data_version())
+    dates, prices = inputs['dates'], inputs['prices']
+    rows = rebalance_rows(dates, rebalance, lookback)
+    if len(rows) == 0:
+        return None
+
+    n_cols = len(inputs['symbols'])
+    cost_rate = cost_bps / 1e4
+    shares = np.zeros((len(rows), n_cols))
+    cash = np.zeros(len(rows))
+    held, held_cash, w = np.zeros(n_cols), float(investment_amount), None
+    traded, costs = 0.0, 0.0
+
+    # Only the rebalances loop, each solves one optimization and trades whole shares
+    for k, row in enumerate(rows):
+        price = np.nan_to_num(prices[row])
+        value = held_cash + held @ price
+        cols, weights = target_weights(inputs, row, threshold, objective, risk_aversion, l2_gamma,
+                                       method, lookback, w)
+
+        target = np.zeros(n_cols)
+        if len(cols):
+            # Costs are at most cost_rate of the old plus new holdings, keep that much in cash
+            budget = value * (1 - 2 * cost_rate)
+            target[cols] = largest_remainder(budget * weights, price[cols], budget)
+            w = np.zeros(n_cols)
+            w[cols] = weights
+
+        trade_value = np.abs(target - held) @ price
+        held_cash = value - target @ price - cost_rate * trade_value
+        held = target
+        shares[k], cash[k] = held, held_cash
+        traded += trade_value / value if value > 0 else 0
+        costs += cost_rate * trade_value
+
+    # Daily value, holdings carried forward from the last rebalance at or before each day
+    days = np.arange(rows[0], len(dates))
+    segment = np.searchsorted(rows, days, side='right') - 1
+    active = np.flatnonzero(shares.any(axis=0))
+    values = (np.nan_to_num(prices[days][:, active]) * shares[segment][:, active]).sum(axis=1) + cash[segment]
+
+    metrics = summarize(values, dates[days])
+    metrics.update({'turnover': traded / len(rows), 'costs': costs, 'rebalances': len(rows)})
+    return {'metrics': metrics, 'values': pd.Series(values, index=pd.DatetimeIndex(dates[days]))}
+
+
+def benchmark_metrics(start=None, rebalance='Q', lookback=LOOKBACK):
+    # Buy and hold of the benchmark index over the same span as the backtests
+    inputs = load_inputs(start, get_data_version())
+    if BENCHMARK not in inputs['symbols']:
+        return None
+
+    rows = rebalance_rows(inputs['dates'], rebalance, lookback)
+    prices = inputs['prices'][:, inputs['symbols'].index(BENCHMARK)]
+    days = np.arange(rows[0], len(inputs['dates'])) if len(rows) else []
+    days = [x for x in days if np.isfinite(prices[x])]
+    if len(days) < 2:
+        return None
+    return summarize(prices[days], inputs['dates'][days])
+
+
+def grid_params(thresholds=None, objectives=None, risk_aversions=None, **common):
+    params = []
+    for threshold in thresholds or GRID['thresholds']:
+        for objective in objectives or GRID['objectives']:
+            for risk_aversion in (risk_aversions or GRID['risk_aversions']) \
+                    if objective in RISK_AVERSE_OBJECTIVES else [None]:
+                params.append({'threshold': threshold, 'objective': objective,
+                               'risk_aversion': risk_aversion, **common})
+    return params
+
+
+def run_params(params):
+    result = backtest(**params)
+    return {**params, **(result['metrics'] if result else {})}
+
+
+def run_grid(thresholds=None, objectives=None, risk_aversions=None, workers=None, **common):
+    """
+    Backtest every threshold x objective x risk_aversion combination, in parallel across
+    processes, and return one row of parameters and metrics per run, best Sharpe first.
+    The benchmark's buy and hold is added as a row with objective 'benchmark'.
+    """
+    params = grid_params(thresholds, objectives, risk_aversions, **common)
+    workers = min(workers or os.cpu_count() or 1, len(params))
+
+    if workers > 1:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker) as pool:
+            rows = list(pool.map(run_backtest, params))
+    else:
+        rows = [run_params(x) for x in params]
+
+    table = pd.DataFrame(rows)
+    if 'sharpe' in table:
+        table = table.sort_values('sharpe', ascending=False, na_position='last')
+
+    benchmark = benchmark_metrics(common.get('start'), common.get('rebalance', 'Q'),
+                                  common.get('lookback', LOOKBACK))
+    if benchmark is not None:
+        table = pd.concat([table, pd.DataFrame([{'objective': 'benchmark', **benchmark}])], ignore_index=True)
+
+    return table.reset_index(drop=True)
@@ -0,0 +1,14 @@
+from portfolio_optimizer_webapp.benchmarks.settings import ROOT
+from django.core.management import execute_from_command_line
+import os
+import sys
+
+
+def main():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'portfolio_optimizer_webapp.benchmarks.settings')
+    ROOT.mkdir(parents=True, exist_ok=True)
+    execute_from_command_line([sys.argv[0], 'run_benchmarks', *sys.argv[1:]])
+
+
+if __name__ == '__main__':
+    main()
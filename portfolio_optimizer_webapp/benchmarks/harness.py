@@ -0,0 +1,192 @@
+from portfolio_optimizer_webapp.backtest import load_inputs
+from portfolio_optimizer_webapp.benchmarks import synthetic
+from portfolio_optimizer_webapp.estimation import model_cache
+from portfolio_optimizer_webapp.frontier import frontier_cache
+from portfolio_optimizer_webapp.models import DataSettings
+from portfolio_optimizer_webapp.optimizer import covariance_cache
+from portfolio_optimizer_webapp.plots import series_cache
+from portfolio_optimizer_webapp.pricestore import get_price_store
+from portfolio_optimizer_webapp.rendercache import bump_generation
+from portfolio_optimizer_webapp.returns import get_returns_matrix
+from portfolio_optimizer_webapp.screening import index_cache, run_screens, screen_cache
+from portfolio_optimizer_webapp.shared import fingerprint_cache, get_shared_cache
+from portfolio_optimizer_webapp.views import DashboardView
+from portfolio_optimizer_webapp import plots
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from contextlib import contextmanager
+import statistics
+import functools
+import tracemalloc
+import platform
+import datetime
+import tempfile
+import shutil
+import time
+
+# Timings of the analytics hot paths on synthetic universes. Each scale is generated into
+# a throwaway test database with its own cache directory and render cache, then every case
+# is timed
+#   cold - process, on-disk and render caches cleared before each run
+#   warm - after one untimed run, as on a loaded dashboard
+# and run once more under tracemalloc for its peak Python heap. numpy buffers are traced,
+# polars' Rust allocations are not, so peaks are a lower bound for the polars paths.
+
+SCALES = [(10, 3), (50, 5), (200, 10)]
+MODES = ['cold', 'warm']
+THRESHOLD = 1.25
+
+
+def render_dashboard():
+    request = RequestFactory().get('/dashboard/')
+    return DashboardView.as_view()(request).render()
+
+
+# Every threshold against every sector, with and without a P/E cap
+SCREENS = [{'threshold': t, 'sectors': [sector], 'pe_ratio': pe}
+           for t in range(10) for sector in synthetic.SECTORS for pe in [None, [None, 20]]]
+
+
+def scenario():
+    # The shared scenario the synthetic universe was optimized for
+    return DataSettings.objects.order_by('pk').first()
+
+
+def polars_backend(func):
+    # func run with the lazy polars analytics backend
+    return override_settings(PORTFOLIO_OPTIMIZER_ANALYTICS_BACKEND='polars')(func)
+
+
+CASES = {
+    'compare_ytd': lambda: plots.compare_ytd(scenario()),
+    'get_analysis_data': plots.get_analysis_data,
+    'get_analysis_data_polars': polars_backend(plots.get_analysis_data),
+    'score_table': lambda: DashboardView().build_score_table(scenario()),
+    'score_table_polars': polars_backend(lambda: DashboardView().build_score_table(scenario())),
+    'dashboard': render_dashboard,
+    'screens': lambda: run_screens(SCREENS),
+}
+
+
+def clear_caches(root):
+    # Everything a cold run would have to rebuild, root is the isolated cache directory
+    get_price_store.cache_clear()
+    get_returns_matrix.cache_clear()
+    load_inputs.cache_clear()
+    get_shared_cache.cache_clear()
+    for cache in [covariance_cache, model_cache, frontier_cache, series_cache, fingerprint_cache,
+                  index_cache, screen_cache]:
+        cache.clear()
+
+    shutil.rmtree(root, ignore_errors=True)
+    bump_generation()
+
+
+def measure(func, setup=None, repeat=5):
+    if setup is None:
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'min_s': round(min(timings), 5),
+        'median_s': round(statistics.median(timings), 5),
+        'peak_mb': round(peak / 2 ** 20, 2),
+    }
+
+
+@contextmanager
+def isolated():
+    # Test database, cache directory and render cache of their own, removed afterwards
+    root = tempfile.mkdtemp(prefix='portfolio_optimizer_benchmark_')
+    caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}}
+    old_name = connection.settings_dict['NAME']
+
+    with override_settings(PORTFOLIO_OPTIMIZER_CACHE_DIR=root, PORTFOLIO_OPTIMIZER_RENDER_CACHE='default',
+                           CACHES=caches):
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield root
+        finally:
+            clear_caches(root)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def environment():
+    import django, numpy, pandas, polars
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'database': connection.vendor,
+        'versions': {x.__name__: x.__version__ for x in [django, numpy, pandas, polars]},
+    }
+
+
+def run(scales=SCALES, cases=tuple(CASES), modes=MODES, repeat=5, log=None):
+    """
+    Time each case at each (symbols, years) scale. Returns the baseline document, the
+    environment under 'meta' and one record per case, mode and scale under 'results'.
+    """
+    log = log or (lambda message: None)
+    meta, results = environment(), []
+
+    with isolated() as root:
+        cold = functools.partial(clear_caches, root)
+        for n_symbols, n_years in scales:
+            call_command('flush', interactive=False, verbosity=0)
+            cold()
+
+            start = time.perf_counter()
+            rows = synthetic.generate(n_symbols, n_years)
+            log(f'{n_symbols} symbols x {n_years} years: {rows["prices"]} price rows, '
+                f'generated in {time.perf_counter() - start:.1f}s')
+
+            for case in cases:
+                for mode in modes:
+                    timing = measure(CASES[case], cold if mode == 'cold' else None, repeat)
+                    results.append({'case': case, 'mode': mode, 'symbols': n_symbols, 'years': n_years,
+                                    'price_rows': rows['prices'], **timing})
+                    log(f'  {case} [{mode}] {timing["median_s"]:.4f}s, {timing["peak_mb"]} MB')
+
+    return {'meta': meta, 'results': results}
+
+
+def result_key(result):
+    return result['case'], result['mode'], result['symbols'], result['years']
+
+
+def compare(current, baseline, threshold=THRESHOLD):
+    """
+    Match results to the baseline on case, mode and scale. Returns one record per match
+    with the median time ratio, flagged as a regression above threshold.
+    """
+    before = {result_key(x): x for x in baseline['results']}
+    rows = []
+    for result in current['results']:
+        old = before.get(result_key(result))
+        if old is None:
+            continue
+        ratio = result['median_s'] / old['median_s'] if old['median_s'] else float('inf')
+        rows.append({**dict(zip(['case', 'mode', 'symbols', 'years'], result_key(result))),
+                     'baseline_s': old['median_s'], 'current_s': result['median_s'],
+                     'ratio': round(ratio, 3), 'regression': ratio > threshold})
+    return rows
@@ -0,0 +1,78 @@
+from django.conf import settings
+import statistics
+import subprocess
+import time
+import sys
+import os
+
+# Cold start benchmark: a fresh interpreter sets up Django and imports the URLconf under
+# python -X importtime, as a worker boots. Reports the total import time, which packages
+# it went to and whether any of the heavy analytics stack was imported on the way.
+
+HEAVY = ['pandas', 'polars', 'numpy', 'plotly', 'markdown']
+THRESHOLD = 1.25
+
+SCRIPT = ('import django; django.setup(); '
+          'from django.conf import settings; from importlib import import_module; '
+          'import_module(settings.ROOT_URLCONF)')
+
+
+def parse(stderr):
+    # (self us, cumulative us, module, depth) per line of -X importtime output
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        if not own.strip().isdigit():
+            continue
+        name = name[1:]
+        module = name.lstrip()
+        rows.append((int(own), int(cumulative), module, (len(name) - len(module)) // 2))
+    return rows
+
+
+def import_once(script=SCRIPT):
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(x for x in sys.path if x)}
+    env.setdefault('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], env=env,
+                            capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, parse(result.stderr)
+
+
+def run(repeat=5, top=10):
+    """
+    Import the URLconf in repeat fresh interpreters. Returns the median total import and
+    process wall time, the top packages by their modules' own import time (of the median
+    run) and the heavy packages imported.
+    """
+    runs = []
+    for _ in range(repeat):
+        wall, rows = import_once()
+        runs.append((sum(x[1] for x in rows if x[3] == 0), wall, rows))
+    runs.sort(key=lambda x: x[0])
+    total, _, rows = runs[len(runs) // 2]
+
+    packages = {}
+    for own, _, module, _ in rows:
+        package = module.split('.')[0]
+        packages[package] = packages.get(package, 0) + own
+    modules = {x[2] for x in rows}
+
+    return {
+        'urlconf': settings.ROOT_URLCONF,
+        'import_ms': round(total / 1000, 1),
+        'wall_s': round(statistics.median(x[1] for x in runs), 4),
+        'modules': len(rows),
+        'packages': [{'package': name, 'import_ms': round(us / 1000, 1)}
+                     for name, us in sorted(packages.items(), key=lambda x: -x[1])[:top]],
+        'heavy': [x for x in HEAVY if x in modules],
+    }
+
+
+def compare(current, baseline, threshold=THRESHOLD):
+    # Median import time ratio over the baseline, a regression above threshold
+    ratio = current['import_ms'] / baseline['import_ms'] if baseline['import_ms'] else float('inf')
+    return {'baseline_ms': baseline['import_ms'], 'current_ms': current['import_ms'],
+            'ratio': round(ratio, 3), 'regression': ratio > threshold}
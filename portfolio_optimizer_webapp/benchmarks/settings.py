@@ -0,0 +1,29 @@
+# Standalone settings to run the benchmarks without a project, on a local SQLite database:
+#   python -m portfolio_optimizer_webapp.benchmarks --json baseline.json
+
+from pathlib import Path
+import tempfile
+
+ROOT = Path(tempfile.gettempdir()) / 'portfolio_optimizer_benchmark'
+
+SECRET_KEY = 'benchmark'
+DEBUG = False
+USE_TZ = True
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.staticfiles',
+    'portfolio_optimizer_webapp',
+]
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ROOT / 'db.sqlite3',
+        # On disk rather than in memory, as a deployment would read it
+        'TEST': {'NAME': ROOT / 'test.sqlite3'},
+    }
+}
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+ROOT_URLCONF = 'portfolio_optimizer_webapp.urls'
+TEMPLATES = [{'BACKEND': 'django.template.backends.django.DjangoTemplates', 'APP_DIRS': True}]
+STATIC_URL = '/static/'
@@ -0,0 +1,99 @@
+from portfolio_optimizer_webapp.models import PriceField
+from portfolio_optimizer_webapp.sources import FixtureSource
+from django.db import DatabaseError, connection, models
+from django.test.utils import override_settings
+import pandas as pd
+import functools
+import time
+
+# Storage benchmark for the price columns. The same fixture universe is written to one
+# table per layout and read back the way the analytics do (ORM values_list to a float
+# DataFrame), reporting on-disk bytes per row and load time:
+#   decimal - DecimalField(16, 6), the layout before migration 0006
+#   float   - double precision PriceField
+#   compact - single precision PriceField (PORTFOLIO_OPTIMIZER_COMPACT_PRICES), REAL on
+#             PostgreSQL, identical to float on SQLite
+
+PRICE_FIELDS = ['open', 'high', 'low', 'close', 'adjclose']
+
+LAYOUTS = {
+    'decimal': lambda: models.DecimalField(max_digits=16, decimal_places=6, null=True),
+    'float': lambda: PriceField(null=True),
+    'compact': lambda: PriceField(null=True),
+}
+
+
+@functools.cache
+def layout_model(layout):
+    meta = type('Meta', (), {'app_label': 'portfolio_optimizer_webapp', 'managed': False,
+                             'db_table': f'benchmark_price_{layout}'})
+    fields = {'symbol': models.CharField(max_length=12), 'date': models.DateField(),
+              'volume': models.BigIntegerField(null=True)}
+    fields.update({x: LAYOUTS[layout]() for x in PRICE_FIELDS})
+    return type(f'BenchmarkPrice{layout.title()}', (models.Model,), {'__module__': __name__, 'Meta': meta, **fields})
+
+
+def table_bytes(table):
+    with connection.cursor() as cursor:
+        try:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT pg_relation_size(%s)', [table])
+            elif connection.vendor == 'sqlite':
+                cursor.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = %s', [table])
+            else:
+                return None
+        except DatabaseError:
+            # SQLite built without the dbstat table
+            return None
+        return cursor.fetchone()[0]
+
+
+def load_frame(model):
+    rows = model.objects.order_by('symbol', 'date').values_list('symbol', 'date', *PRICE_FIELDS)
+    df = pd.DataFrame(list(rows), columns=['symbol', 'date', *PRICE_FIELDS])
+    # Decimal columns come back as objects, the analytics need floats
+    return df.astype({x: float for x in PRICE_FIELDS})
+
+
+def fixture_rows(n_symbols):
+    source = FixtureSource()
+    prices = pd.concat([source.prices(x) for x in source.symbols()[:n_symbols]])
+    return prices[['symbol', 'date', 'volume', *PRICE_FIELDS]].to_dict('records')
+
+
+def benchmark_layout(layout, rows, repeat=3):
+    model = layout_model(layout)
+    with override_settings(PORTFOLIO_OPTIMIZER_COMPACT_PRICES=layout == 'compact'):
+        with connection.schema_editor() as editor:
+            editor.create_model(model)
+    try:
+        start = time.perf_counter()
+        model.objects.bulk_create([model(**x) for x in rows], batch_size=5000)
+        insert_seconds = time.perf_counter() - start
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            load_frame(model)
+            timings.append(time.perf_counter() - start)
+
+        size = table_bytes(model._meta.db_table)
+        return {
+            'layout': layout,
+            'rows': len(rows),
+            'bytes_per_row': None if size is None else round(size / len(rows), 1),
+            'insert_seconds': round(insert_seconds, 3),
+            'load_seconds': round(min(timings), 3),
+        }
+    finally:
+        with connection.schema_editor() as editor:
+            editor.delete_model(model)
+
+
+def run(n_symbols=50, layouts=tuple(LAYOUTS), repeat=3):
+    """
+    Benchmark each layout on the first n_symbols of the fixture universe in the default
+    database. The tables are dropped afterwards.
+    """
+    rows = fixture_rows(n_symbols)
+    return [benchmark_layout(x, rows, repeat) for x in layouts]
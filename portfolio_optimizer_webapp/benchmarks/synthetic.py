@@ -0,0 +1,49 @@
+from portfolio_optimizer_webapp.estimation import estimate_returns
+from portfolio_optimizer_webapp.ingest import ingest_fundamentals, ingest_prices
+from portfolio_optimizer_webapp.models import DataSettings, SecurityList
+from portfolio_optimizer_webapp.optimizer import optimize
+from portfolio_optimizer_webapp.sources import FixtureSource
+import datetime
+
+# Synthetic universes for the benchmarks: N symbols x M years of prices and yearly
+# reports, generated by the fixture source's seeded walks so every scale is reproducible,
+# plus the ^GSPC benchmark the dashboard compares against.
+
+BENCHMARK = '^GSPC'
+SECTORS = ['Technology', 'Healthcare', 'Financial Services', 'Energy', 'Industrials',
+           'Consumer Cyclical', 'Utilities', 'Real Estate']
+
+
+class SyntheticSource(FixtureSource):
+    name = 'synthetic'
+
+    def __init__(self, n_symbols, n_years, latency=0.0):
+        super().__init__(latency=latency)
+        self.n_symbols = n_symbols
+        self.ORIGIN = datetime.date(datetime.date.today().year - n_years, 1, 1)
+
+    def symbols(self):
+        return [f'SYN{i:05d}' for i in range(self.n_symbols)]
+
+
+def generate(n_symbols, n_years, optimize_portfolio=True):
+    """
+    Load n_symbols x n_years of synthetic prices and fundamentals into the database, score
+    them and, unless optimize_portfolio is False, estimate returns and optimize a portfolio
+    so the dashboard has everything to render. Returns the row counts loaded.
+    """
+    source = SyntheticSource(n_symbols, n_years)
+    symbols = source.symbols()
+
+    prices = ingest_prices(source.prices(x) for x in [*symbols, BENCHMARK])
+    fundamentals = ingest_fundamentals([source.fundamentals(x) for x in symbols])
+
+    securities = [SecurityList(symbol=x, sector=SECTORS[i % len(SECTORS)]) for i, x in enumerate(symbols)]
+    SecurityList.objects.bulk_update(securities, ['sector'], batch_size=1000)
+
+    if optimize_portfolio:
+        data_settings = DataSettings.objects.first() or DataSettings.objects.create()
+        estimate_returns(data_settings)
+        optimize(data_settings)
+
+    return {'prices': prices[0], 'fundamentals': fundamentals[0]}
@@ -0,0 +1,204 @@
+from portfolio_optimizer_webapp.app_settings import cache_dir, temp_path
+from portfolio_optimizer_webapp.returns import get_returns_matrix
+import numpy as np
+import hashlib
+import os
+
+# Covariance estimators over the date x symbol returns matrix. Missing prices (ragged
+# histories) are handled with pairwise complete observations, so every entry uses all the
+# days both symbols traded. Estimates are annualized and persisted to disk, keyed by the
+# universe, estimator and window, so each symbol's variance under a scenario's estimator is
+# the diagonal of that entry rather than a value stored on the shared ExpectedReturns rows.
+# Each key keeps one file, for a digest of the returns it was computed from, so new days
+# or backfilled history replace it rather than adding another.
+
+TRADING_DAYS = 252
+EWMA_DECAY = 0.94
+N_FACTORS = 10
+
+
+def pairwise_moments(returns):
+    """
+    Pairwise complete co-moments of a T x N returns matrix with NaN for missing days.
+    Returns (n, sum_i, cross) where n[i, j] counts the days both traded, sum_i[i, j] sums
+    symbol i's returns over those days and cross[i, j] sums the products.
+    """
+    mask = ~np.isnan(returns)
+    x = np.where(mask, returns, 0.0)
+    m = mask.astype(float)
+    return m.T @ m, x.T @ m, x.T @ x
+
+
+def sample_covariance(returns):
+    n, sums, cross = pairwise_moments(returns)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = (cross - sums * sums.T / n) / (n - 1)
+    return np.where(n > 1, cov, 0.0)
+
+
+def nearest_psd(cov, floor=1e-10):
+    # Pairwise estimates need not be positive semi-definite, clip the spectrum
+    eigvals, eigvecs = np.linalg.eigh((cov + cov.T) / 2)
+    return (eigvecs * np.maximum(eigvals, floor)) @ eigvecs.T
+
+
+def ledoit_wolf(returns):
+    """
+    Ledoit-Wolf shrinkage towards a scaled identity (Ledoit & Wolf, 2004). Missing
+    observations are mean imputed for the shrinkage intensity.
+    """
+    cov = sample_covariance(returns)
+    n_obs, n_cols = returns.shape
+
+    x = returns - np.nanmean(returns, axis=0)
+    x = np.where(np.isnan(x), 0.0, x)
+
+    mu = np.trace(cov) / n_cols
+    target = mu * np.eye(n_cols)
+    d2 = np.sum((cov - target) ** 2) / n_cols
+
+    # Mean over days of ||x_t x_t' - S||^2, expanded so no N x N matrix per day is formed
+    sq_norms = np.sum(x ** 2, axis=1)
+    quad = ((x @ cov) * x).sum(axis=1)
+    b2_bar = np.sum(sq_norms ** 2 - 2 * quad + np.sum(cov ** 2)) / n_obs ** 2 / n_cols
+    b2 = min(b2_bar, d2)
+
+    shrinkage = b2 / d2 if d2 > 0 else 1.0
+    return shrinkage * target + (1 - shrinkage) * cov
+
+
+def ewma_moments(returns, decay=EWMA_DECAY, state=None):
+    """
+    Exponentially weighted (zero mean, RiskMetrics) co-moments. The weighted sums of
+    products and of weights are carried in state, so new days are folded in without
+    revisiting history: state' = decay^k * state + sum of the k new days.
+    """
+    n_obs = returns.shape[0]
+    weights = decay ** np.arange(n_obs - 1, -1, -1)
+    mask = ~np.isnan(returns)
+    x = np.where(mask, returns, 0.0) * np.sqrt(weights)[:, None]
+    m = mask * np.sqrt(weights)[:, None]
+
+    cross, norm = x.T @ x, m.T @ m
+    if state is not None:
+        cross += decay ** n_obs * state['cross']
+        norm += decay ** n_obs * state['norm']
+    return {'cross': cross, 'norm': norm}
+
+
+def history_digest(dates, values):
+    # Digest of the dates and returns an estimate (or EWMA state) covers
+    digest = hashlib.sha1(np.asarray(dates, dtype='datetime64[D]').tobytes())
+    digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+
+def ewma_covariance(state):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = state['cross'] / state['norm']
+    return np.where(state['norm'] > 0, cov, 0.0)
+
+
+def factor_covariance(returns, n_factors=N_FACTORS):
+    # Low rank plus diagonal: top principal components of the sample covariance, with the
+    # residual variance kept on the diagonal
+    cov = sample_covariance(returns)
+    n_factors = max(1, min(n_factors, cov.shape[0] - 1))
+    eigvals, eigvecs = np.linalg.eigh(cov)
+    loadings = eigvecs[:, -n_factors:] * np.sqrt(np.maximum(eigvals[-n_factors:], 0))
+    systematic = loadings @ loadings.T
+    residual = np.maximum(np.diag(cov) - np.diag(systematic), 1e-10)
+    return systematic + np.diag(residual)
+
+
+ESTIMATORS = {
+    'sample': lambda returns: nearest_psd(sample_covariance(returns)),
+    'ledoit_wolf': ledoit_wolf,
+    'factor': factor_covariance,
+}
+
+
+class CovarianceStore:
+
+    def __init__(self, root=None):
+        self.root = root or cache_dir('covariance')
+
+    def key(self, symbols, method, start):
+        text = '|'.join([method, str(start), *symbols])
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def path(self, key, version=None):
+        return self.root / (f'{key}.npz' if version is None else f'{key}-{version}.npz')
+
+    def load(self, key, version=None):
+        path = self.path(key, version)
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            return dict(data)
+
+    def save(self, key, version=None, **arrays):
+        # A new version of a key evicts the older ones
+        path = self.path(key, version)
+        tmp_path = temp_path(path, '.tmp.npz')
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        if version is not None:
+            for stale in self.root.glob(f'{key}-*.npz'):
+                if stale != path and not stale.name.endswith('.tmp.npz'):
+                    stale.unlink(missing_ok=True)
+
+    def get(self, symbols, method='ledoit_wolf', start=None):
+        """
+        Annualized covariance of the symbols' daily returns since start, up to the last
+        materialized date. EWMA state is extended day by day from the last stored date.
+        """
+        symbols = list(symbols)
+        returns_matrix = get_returns_matrix()
+        returns_matrix.update(symbols)
+        returns = returns_matrix.frame('simple', symbols, start)
+        # Symbols without prices get no rows, reindex back to the requested universe
+        returns = returns.select('date', *[x for x in symbols if x in returns.columns])
+        dates = returns['date'].to_numpy()
+
+        values = np.full((len(returns), len(symbols)), np.nan)
+        present = [i for i, x in enumerate(symbols) if x in returns.columns]
+        values[:, present] = returns.drop('date').to_numpy()
+
+        key, version = self.key(symbols, method, start), history_digest(dates, values)
+        cached = self.load(key, version)
+        if cached is not None:
+            return cached['cov']
+
+        if method == 'ewma':
+            cov = self._ewma(symbols, start, dates, values)
+        else:
+            cov = ESTIMATORS[method](values)
+
+        cov = cov * TRADING_DAYS
+        self.save(key, version, cov=cov)
+        return cov
+
+    def _ewma(self, symbols, start, dates, values):
+        # The running state is stored per universe and window start, with the last date and
+        # a digest of the history it covers. Only new days are folded in, and the state is
+        # rebuilt if anything up to its last date changed (e.g. backfilled prices)
+        state_key = self.key(symbols, 'ewma_state', start)
+        state = self.load(state_key)
+        if state is not None:
+            old_days = dates <= np.datetime64(state['last_date'][()], 'D')
+            if 'history' in state and str(state['history']) == history_digest(dates[old_days], values[old_days]):
+                state = ewma_moments(values[~old_days], state=state)
+            else:
+                state = None
+        if state is None:
+            state = ewma_moments(values)
+
+        self.save(state_key, last_date=np.datetime64(dates.max(), 'D'), history=history_digest(dates, values),
+                  **state)
+        return ewma_covariance(state)
+
+
+def get_covariance(symbols, method='ledoit_wolf', start=None):
+    return CovarianceStore().get(symbols, method, start)
+
@@ -0,0 +1,108 @@
+import numpy as np
+
+# Downsampling of long series for charts. Both methods take a shared x (T,) and the series
+# as columns of Y (T, S) and return the row indices to keep per series, (n, S), so series
+# with gaps (NaN) still share one pass over the dates.
+#   lttb   - Largest-Triangle-Three-Buckets, keeps the visual shape of a few lines
+#   minmax - the extremes of each bucket, fully vectorized, for many lines at once
+
+POINTS = 1000
+MAX_POINTS = 20_000
+MIN_POINTS = 32
+
+
+def lttb(x, Y, n):
+    """
+    Row indices of n points per column of Y picked by Largest-Triangle-Three-Buckets. The
+    first and last rows are always kept, each bucket in between keeps the point forming
+    the largest triangle with the previous pick and the next bucket's average.
+    """
+    T, S = Y.shape
+    if n >= T or n < 3:
+        return np.repeat(np.arange(T)[:, None], S, axis=1)
+
+    x = np.asarray(x, dtype=float)
+    edges = np.linspace(1, T - 1, n - 1).astype(int)
+    out = np.empty((n, S), dtype=int)
+    out[0], out[-1] = 0, T - 1
+    cols = np.arange(S)
+    a = np.zeros(S, dtype=int)
+
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = (edges[i + 1], edges[i + 2]) if i < n - 3 else (T - 1, T)
+
+        # Average of the next bucket, NaN where a column has no values in it
+        block = Y[next_lo:next_hi]
+        count = np.isfinite(block).sum(axis=0)
+        avg_y = np.where(count > 0, np.nansum(block, axis=0) / np.maximum(count, 1), np.nan)
+        avg_x = x[next_lo:next_hi].mean()
+
+        ax, ay = x[a], Y[a, cols]
+        area = np.abs((ax - avg_x) * (Y[lo:hi] - ay) - (ax - x[lo:hi, None]) * (avg_y - ay))
+        # Points next to gaps still win over missing values
+        area = np.where(np.isnan(area), np.where(np.isnan(Y[lo:hi]), -2, -1), area)
+        a = lo + area.argmax(axis=0)
+        out[i + 1] = a
+
+    return out
+
+
+def minmax(Y, n):
+    """
+    Row indices of the minimum and maximum of each column of Y in n // 2 equal buckets,
+    in row order.
+    """
+    T, S = Y.shape
+    n_buckets = max(n // 2, 1)
+    if 2 * n_buckets >= T:
+        return np.repeat(np.arange(T)[:, None], S, axis=1)
+
+    width = -(-T // n_buckets)
+    n_buckets = -(-T // width)
+    padded = np.full((n_buckets * width, S), np.nan)
+    padded[:T] = Y
+    blocks = padded.reshape(n_buckets, width, S)
+
+    starts = np.arange(n_buckets)[:, None] * width
+    lo = starts + np.where(np.isnan(blocks), np.inf, blocks).argmin(axis=1)
+    hi = starts + np.where(np.isnan(blocks), -np.inf, blocks).argmax(axis=1)
+    # The last bucket is shorter, all NaN columns land on padding
+    lo, hi = np.minimum(lo, T - 1), np.minimum(hi, T - 1)
+
+    out = np.empty((2 * n_buckets, S), dtype=int)
+    out[0::2], out[1::2] = np.minimum(lo, hi), np.maximum(lo, hi)
+    return out
+
+
+def series_points(n_series, points=POINTS):
+    # Points per series, the total is capped so many-line charts stay small
+    return int(min(points, max(MIN_POINTS, MAX_POINTS // max(n_series, 1))))
+
+
+def traces(dates, names, Y, start=None, end=None, points=POINTS, method='lttb', digits=4):
+    """
+    Downsampled {'name', 'x', 'y'} traces of the columns of Y between start and end (dates,
+    inclusive), with ISO date strings and y rounded to digits decimals.
+    """
+    dates = np.asarray(dates).astype('datetime64[D]')
+    rows = np.ones(len(dates), dtype=bool)
+    if start is not None:
+        rows &= dates >= np.datetime64(start, 'D')
+    if end is not None:
+        rows &= dates <= np.datetime64(end, 'D')
+    dates, Y = dates[rows], np.asarray(Y, dtype=float)[rows]
+
+    n = series_points(Y.shape[1], points)
+    index = lttb(dates.astype(int), Y, n) if method == 'lttb' else minmax(Y, n)
+
+    result = []
+    for j, name in enumerate(names):
+        keep = np.unique(index[:, j])
+        keep = keep[np.isfinite(Y[keep, j])]
+        result.append({
+            'name': name,
+            'x': np.datetime_as_string(dates[keep]).tolist(),
+            'y': np.round(Y[keep, j], digits).tolist(),
+        })
+    return result
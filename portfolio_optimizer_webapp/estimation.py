@@ -0,0 +1,277 @@
+from portfolio_optimizer_webapp.app_settings import cache_dir, temp_path
+from portfolio_optimizer_webapp.models import DataSettings, ExpectedReturns
+from portfolio_optimizer_webapp.optimizer import LRUCache
+from portfolio_optimizer_webapp.pricestore import get_price_store
+from portfolio_optimizer_webapp.rendercache import bump_generation
+from portfolio_optimizer_webapp.shared import get_shared_cache
+from portfolio_optimizer_webapp import plots
+import polars as pl
+import pandas as pd
+import numpy as np
+import hashlib
+import os
+
+# Expected return estimation. A model is trained on the analysis frame (F-score components
+# plus yearly price aggregates) to forecast next year's close, then all symbols are
+# predicted in one batch. Fitted models are saved to disk as their arrays (.npz, never
+# pickled), keyed by a hash of the training data and the model settings, so a refresh on
+# unchanged data never retrains. The last few models per method are kept.
+
+FEATURES = ['pf_score', 'pf_score_weighted', 'roa', 'cash_ratio', 'delta_cash', 'delta_roa',
+            'accruals', 'delta_long_lev_ratio', 'delta_current_lev_ratio', 'delta_shares',
+            'delta_gross_margin', 'delta_asset_turnover', 'pe_ratio', 'log_close', 'cv_close']
+
+
+class Standardizer:
+
+    def fit(self, X):
+        self.mean = np.nanmean(X, axis=0)
+        self.std = np.nanstd(X, axis=0)
+        self.std[~(self.std > 0)] = 1.0
+        self.mean[np.isnan(self.mean)] = 0.0
+        return self
+
+    def transform(self, X):
+        # Missing features are imputed with the training mean, i.e. 0 once standardized
+        return np.nan_to_num((X - self.mean) / self.std)
+
+
+class LinearModel:
+    """
+    Ridge regression solved in closed form, the intercept is not penalized.
+    """
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+
+    def params(self):
+        return {'alpha': self.alpha}
+
+    def fit(self, X, y):
+        self.scaler = Standardizer().fit(X)
+        Z = np.column_stack([np.ones(len(X)), self.scaler.transform(X)])
+        penalty = self.alpha * np.eye(Z.shape[1])
+        penalty[0, 0] = 0
+        self.coef = np.linalg.solve(Z.T @ Z + penalty, Z.T @ y)
+        return self
+
+    def predict(self, X):
+        Z = np.column_stack([np.ones(len(X)), self.scaler.transform(X)])
+        return Z @ self.coef
+
+
+class NeuralNet:
+    """
+    One hidden layer tanh network trained full batch with Adam, on CPU in NumPy.
+    """
+
+    def __init__(self, hidden=32, epochs=500, learning_rate=0.01, alpha=1e-3, seed=0):
+        self.hidden, self.epochs, self.learning_rate = hidden, epochs, learning_rate
+        self.alpha, self.seed = alpha, seed
+
+    def params(self):
+        return {'hidden': self.hidden, 'epochs': self.epochs, 'learning_rate': self.learning_rate,
+                'alpha': self.alpha, 'seed': self.seed}
+
+    def forward(self, Z):
+        h = np.tanh(Z @ self.W1 + self.b1)
+        return h, h @ self.W2 + self.b2
+
+    def fit(self, X, y):
+        rng = np.random.default_rng(self.seed)
+        self.scaler = Standardizer().fit(X)
+        Z = self.scaler.transform(X)
+        self.y_mean, self.y_std = y.mean(), y.std() or 1.0
+        target = (y - self.y_mean) / self.y_std
+
+        n_features = Z.shape[1]
+        self.W1 = rng.normal(0, 1 / np.sqrt(n_features), (n_features, self.hidden))
+        self.b1 = np.zeros(self.hidden)
+        self.W2 = rng.normal(0, 1 / np.sqrt(self.hidden), self.hidden)
+        self.b2 = 0.0
+
+        params = [self.W1, self.b1, self.W2]
+        moments = [(np.zeros_like(p), np.zeros_like(p)) for p in params]
+        b2_moments = [0.0, 0.0]
+        beta1, beta2, eps = 0.9, 0.999, 1e-8
+
+        for t in range(1, self.epochs + 1):
+            h, out = self.forward(Z)
+            err = (out - target) / len(Z)
+            dh = np.outer(err, self.W2) * (1 - h ** 2)
+            grads = [Z.T @ dh + self.alpha * self.W1, dh.sum(axis=0), h.T @ err + self.alpha * self.W2]
+
+            for p, g, (m, v) in zip(params, grads, moments):
+                m *= beta1
+                m += (1 - beta1) * g
+                v *= beta2
+                v += (1 - beta2) * g ** 2
+                p -= self.learning_rate * (m / (1 - beta1 ** t)) / (np.sqrt(v / (1 - beta2 ** t)) + eps)
+
+            g = err.sum()
+            b2_moments[0] = beta1 * b2_moments[0] + (1 - beta1) * g
+            b2_moments[1] = beta2 * b2_moments[1] + (1 - beta2) * g ** 2
+            self.b2 -= self.learning_rate * (b2_moments[0] / (1 - beta1 ** t)) \
+                / (np.sqrt(b2_moments[1] / (1 - beta2 ** t)) + eps)
+
+        return self
+
+    def predict(self, X):
+        _, out = self.forward(self.scaler.transform(X))
+        return out * self.y_std + self.y_mean
+
+
+ESTIMATORS = {
+    'lm': LinearModel,
+    'nn': NeuralNet,
+}
+
+model_cache = LRUCache(maxsize=8)
+MODELS_KEPT = 4
+
+
+def build_features(df):
+    """
+    Feature matrix rows per (symbol, fiscal year) and the target, the log change from this
+    year's close to next year's. The target is NaN for each symbol's latest year.
+    """
+    df = df.sort_values(['symbol', 'year']).reset_index(drop=True)
+    df['log_close'] = np.log(df.yearly_close)
+    df['cv_close'] = np.sqrt(df.variance) / df['mean']
+    next_close = df.groupby('symbol').yearly_close.shift(-1)
+    df['target'] = np.log(next_close / df.yearly_close)
+    return df
+
+
+def data_hash(X, y, method, params):
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(X, dtype=float).tobytes())
+    digest.update(np.ascontiguousarray(y, dtype=float).tobytes())
+    digest.update(repr((method, sorted(params.items()))).encode())
+    return digest.hexdigest()
+
+
+def save_model(model, path):
+    # The fitted attributes as arrays, the scaler's as scaler.mean and scaler.std
+    arrays = {}
+    for name, value in vars(model).items():
+        if isinstance(value, Standardizer):
+            arrays.update({f'{name}.{x}': y for x, y in vars(value).items()})
+        else:
+            arrays[name] = np.asarray(value)
+    tmp_path = temp_path(path)
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_model(method, path):
+    model = ESTIMATORS.get(method, LinearModel)()
+    with np.load(path, allow_pickle=False) as arrays:
+        for name in arrays.files:
+            value = arrays[name]
+            value = value.item() if value.ndim == 0 else value
+            if '.' in name:
+                name, field = name.split('.')
+                if not hasattr(model, name):
+                    setattr(model, name, Standardizer())
+                setattr(getattr(model, name), field, value)
+            else:
+                setattr(model, name, value)
+    return model
+
+
+def get_model(method, X, y):
+    # Fitted model from memory, then disk, and only then trained
+    estimator = ESTIMATORS.get(method, LinearModel)()
+    key = data_hash(X, y, method, estimator.params())
+
+    model = model_cache.get(key)
+    if model is not None:
+        return model
+
+    root = cache_dir('models')
+    path = root / f'{method}-{key}.npz'
+    if path.exists():
+        return model_cache.put(key, load_model(method, path))
+
+    model = estimator.fit(X, y)
+    save_model(model, path)
+    old = sorted(root.glob(f'{method}-*.npz'), key=lambda x: x.stat().st_mtime)
+    for stale in old[:-MODELS_KEPT]:
+        stale.unlink(missing_ok=True)
+    return model_cache.put(key, model)
+
+
+def latest_closes(symbols):
+    prices = get_price_store().load(symbols, columns=['close'])
+    last = prices.sort('symbol', 'date').group_by('symbol').agg(pl.col('close').drop_nulls().last())
+    return dict(zip(last['symbol'].to_list(), last['close'].to_list()))
+
+
+def estimate_returns(data_settings=None, save=True):
+    """
+    Forecast each symbol's close a year ahead from its latest report and store the
+    expected return against the latest close in ExpectedReturns.
+    """
+    if data_settings is None:
+        data_settings = DataSettings.objects.first() or DataSettings()
+
+    df = plots.get_analysis_data()
+    if df.empty:
+        return pd.DataFrame()
+
+    df = build_features(df)
+    train = df[df.target.notna() & np.isfinite(df.target)]
+    latest = df.groupby('symbol').tail(1)
+    if train.empty:
+        return pd.DataFrame()
+
+    model = get_model(data_settings.estimation_method, train[FEATURES].to_numpy(float), train.target.to_numpy())
+
+    # One batch prediction for the whole universe
+    predicted = model.predict(latest[FEATURES].to_numpy(float))
+    closes = latest_closes(latest.symbol.to_list())
+
+    result = pd.DataFrame({
+        'symbol_id': latest.symbol.to_numpy(),
+        'fundamentals_id': latest.fundamentals_id.to_numpy(),
+        'last_close': latest.symbol.map(closes).fillna(latest.yearly_close).to_numpy(),
+        'forecasted_close': latest.yearly_close.to_numpy() * np.exp(predicted),
+    })
+    result['expected_return'] = result.forecasted_close / result.last_close - 1
+    result = result[np.isfinite(result.expected_return)]
+
+    if save:
+        save_expected_returns(result)
+
+    return result
+
+
+def get_expected_returns(method, estimate=True):
+    """
+    Expected returns for an estimation method, shared by every scenario. They are estimated,
+    and saved to ExpectedReturns, once per state of the data by the optimize job. With
+    estimate=False (the request path) None until a job has produced them.
+    """
+    cache = get_shared_cache()
+    if not estimate:
+        return cache.peek('expected_returns', method=method)
+    data_settings = DataSettings(estimation_method=method)
+    return cache.get('expected_returns', lambda: estimate_returns(data_settings), method=method)
+
+
+def save_expected_returns(df):
+    objs = [
+        ExpectedReturns(symbol_id=x.symbol_id, fundamentals_id=x.fundamentals_id,
+                        last_close=round(x.last_close, 6), forecasted_close=round(x.forecasted_close, 6),
+                        expected_return=round(x.expected_return, 6))
+        for x in df.itertuples()
+    ]
+    ExpectedReturns.objects.bulk_create(
+        objs,
+        update_conflicts=True,
+        unique_fields=['fundamentals'],
+        update_fields=['symbol', 'last_close', 'forecasted_close', 'expected_return'],
+    )
+    bump_generation(data=False)
@@ -0,0 +1,156 @@
+from portfolio_optimizer_webapp.app_settings import get_setting
+import threading
+import asyncio
+import random
+import queue
+import time
+
+# Concurrent fetching from a data source. Requests run as asyncio tasks bounded by a
+# semaphore and a token bucket rate limit, transient failures are retried with jittered
+# exponential backoff, and results are handed over as they complete. The event loop runs
+# in a background thread, so the (sync) bulk ingestion consumes results while later
+# symbols are still being fetched.
+
+RETRIES = 3
+BACKOFF = 0.5
+TIMEOUT = 60
+PUT_TIMEOUT = 0.1
+DONE = object()
+
+
+class SourceError(Exception):
+    pass
+
+
+class TransientSourceError(SourceError):
+    # Timeouts, throttling, 5xx and the like, retried with backoff
+    pass
+
+
+RETRYABLE = (TransientSourceError, OSError, asyncio.TimeoutError)
+
+
+class RateLimiter:
+    """
+    Token bucket allowing rate requests per second on average with bursts up to burst.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def fetch_options(source):
+    # Per-source defaults, overridable in the settings, e.g.
+    #   PORTFOLIO_OPTIMIZER_FETCH_CONCURRENCY = 16
+    #   PORTFOLIO_OPTIMIZER_RATE_LIMITS = {'file': None, 'yahoo': 2}
+    rate_limits = get_setting('RATE_LIMITS', {})
+    return {
+        'concurrency': get_setting('FETCH_CONCURRENCY', source.concurrency),
+        'rate_limit': rate_limits.get(source.name, source.rate_limit),
+    }
+
+
+async def call(func, *args, limiter=None, retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT):
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            await limiter.acquire()
+        try:
+            return await asyncio.wait_for(func(*args), timeout)
+        except RETRYABLE:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(backoff * 2 ** attempt * (1 + random.random()))
+
+
+async def fetch_all(source, requests, emit, concurrency=8, rate_limit=None, **kwargs):
+    """
+    Run (kind, symbol, args) requests against source's async methods, calling
+    emit(kind, symbol, result_or_exception) as each finishes.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate_limit) if rate_limit else None
+    methods = {'prices': source.aprices, 'fundamentals': source.afundamentals}
+
+    async def run(kind, symbol, args):
+        async with semaphore:
+            try:
+                result = await call(methods[kind], symbol, *args, limiter=limiter, **kwargs)
+            except Exception as e:
+                result = e
+        await emit(kind, symbol, result)
+
+    await asyncio.gather(*[run(*x) for x in requests])
+
+
+def stream(source, requests, maxsize=64, **options):
+    """
+    Yield (kind, symbol, DataFrame or exception) in completion order while the fetch runs
+    in a background event loop. The bounded queue applies backpressure, so at most about
+    maxsize results are held in memory if ingestion falls behind. If the consumer stops
+    early (an error, a break), the pending requests are cancelled and the thread exits.
+    """
+    options = {**fetch_options(source), **options}
+    results = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    cancel = {}
+
+    def put(item):
+        # Blocks while the queue is full, gives up once the consumer has stopped
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+
+    async def emit(*item):
+        await asyncio.to_thread(put, item)
+
+    async def main():
+        task, loop = asyncio.current_task(), asyncio.get_running_loop()
+        cancel['task'] = lambda: loop.call_soon_threadsafe(task.cancel)
+        if not stop.is_set():
+            await fetch_all(source, requests, emit, **options)
+
+    def run():
+        try:
+            asyncio.run(main())
+        except asyncio.CancelledError:
+            pass
+        except BaseException as e:
+            put(e)
+        finally:
+            put(DONE)
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while True:
+            item = results.get()
+            if item is DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        if 'task' in cancel:
+            try:
+                cancel['task']()
+            except RuntimeError:
+                # The loop already finished
+                pass
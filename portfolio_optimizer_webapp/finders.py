@@ -0,0 +1,35 @@
+from django.contrib.staticfiles.finders import BaseFinder
+from django.core.files.storage import FileSystemStorage
+from pathlib import Path
+import plotly
+
+# Serves the plotly.js bundle shipped with the plotly package as the static file
+# js/plotly.min.js, so figures are rendered without inlining the library. Enable with
+#   STATICFILES_FINDERS = [..., 'portfolio_optimizer_webapp.finders.PlotlyJSFinder']
+
+PLOTLY_JS = 'js/plotly.min.js'
+
+
+class PlotlyJSStorage(FileSystemStorage):
+
+    def path(self, name):
+        return str(Path(self.location) / 'plotly.min.js')
+
+
+class PlotlyJSFinder(BaseFinder):
+
+    def __init__(self, *args, **kwargs):
+        self.storage = PlotlyJSStorage(location=Path(plotly.__file__).parent / 'package_data')
+
+    def check(self, **kwargs):
+        return []
+
+    def find(self, path, find_all=False, **kwargs):
+        find_all = kwargs.get('all', find_all)
+        if path != PLOTLY_JS:
+            return []
+        match = self.storage.path(path)
+        return [match] if find_all else match
+
+    def list(self, ignore_patterns):
+        yield PLOTLY_JS, self.storage
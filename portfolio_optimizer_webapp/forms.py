@@ -38,13 +38,24 @@ class CommaSeparatedCharField(forms.Field):
 class OptimizeForm(forms.ModelForm):
     class Meta:
         model = DataSettings
-        fields = ['investment_amount',
+        fields = ['name',
+                  'investment_amount',
                   'FScore_threshold',
                   'objective',
                   'estimation_method',
+                  'covariance_method',
+                  'allocation_method',
                   'l2_gamma',
                   'risk_aversion']
 
+    def clean_name(self):
+        # Scenario names are unique per user, or among the shared scenarios
+        name = self.cleaned_data['name']
+        others = DataSettings.objects.filter(user=self.instance.user, name=name).exclude(pk=self.instance.pk)
+        if others.exists():
+            raise forms.ValidationError('A scenario with this name already exists.')
+        return name
+
 
 class MultipleForm(forms.Form):
     action = forms.CharField(max_length=60, widget=forms.HiddenInput())
@@ -0,0 +1,120 @@
+from portfolio_optimizer_webapp.optimizer import LRUCache, get_covariance_model, get_universe
+from portfolio_optimizer_webapp.returns import get_returns_matrix
+import pandas as pd
+import numpy as np
+
+# Long-only efficient frontier. All points are solved together: the quadratic utility
+# problem for N risk aversions is one batched FISTA run, so each iteration is a single
+# N x n by n x n product with the shared covariance instead of N matrix-vector products.
+# A coarse pass over log-spaced risk aversions maps out the return range, then each evenly
+# spaced target return is solved at the interpolated risk aversion, warm-started from the
+# coarse point nearest to it.
+
+N_POINTS = 50
+LOG_DELTA_RANGE = (-3, 4)
+
+frontier_cache = LRUCache(maxsize=16)
+
+
+def project_simplex_rows(V):
+    # Row-wise Euclidean projection onto the simplex, project_simplex for a batch
+    n = V.shape[1]
+    U = -np.sort(-V, axis=1)
+    css = np.cumsum(U, axis=1) - 1
+    positive = U * np.arange(1, n + 1) > css
+    rho = n - 1 - np.argmax(positive[:, ::-1], axis=1)
+    theta = css[np.arange(len(V)), rho] / (rho + 1)
+    return np.maximum(V - theta[:, None], 0)
+
+
+def solve_batch(mu, model, deltas, l2_gamma=0.0, W0=None, tol=1e-7, max_iter=5000):
+    """
+    Maximize mu'w - (delta / 2) w'Cw - l2_gamma ||w||^2 on the simplex for every delta at
+    once, by FISTA with per-row step sizes and restarts. Converged rows are frozen, so the
+    work shrinks as the batch converges. Returns the N x n weights.
+    """
+    deltas = np.asarray(deltas, dtype=float)
+    n_rows, n = len(deltas), len(mu)
+    cov = model.cov
+    steps = 1 / (deltas * model.max_eigval + 2 * l2_gamma + 1e-12)
+
+    W = project_simplex_rows(np.full((n_rows, n), 1 / n) if W0 is None else np.asarray(W0, dtype=float))
+    Y, t = W.copy(), np.ones(n_rows)
+    active = np.arange(n_rows)
+
+    for _ in range(max_iter):
+        y = Y[active]
+        grad = deltas[active, None] * (y @ cov) - mu + 2 * l2_gamma * y
+        w_next = project_simplex_rows(y - steps[active, None] * grad)
+        w = W[active]
+
+        converged = np.abs(w_next - w).max(axis=1) < tol
+        restart = np.einsum('ij,ij->i', y - w_next, w_next - w) > 0
+        t_active = np.where(restart, 1.0, t[active])
+        t_next = (1 + np.sqrt(1 + 4 * t_active ** 2)) / 2
+
+        W[active] = w_next
+        Y[active] = w_next + ((t_active - 1) / t_next)[:, None] * (w_next - w)
+        t[active] = t_next
+
+        active = active[~converged]
+        if len(active) == 0:
+            break
+
+    return W
+
+
+def efficient_frontier(mu, model, n_points=N_POINTS, l2_gamma=0.0):
+    """
+    n_points frontier portfolios at (approximately) evenly spaced expected returns, from about
+    the minimum volatility portfolio to the maximum return one. Returns (returns,
+    volatilities, weights).
+    """
+    mu = np.asarray(mu, dtype=float)
+
+    # Coarse pass, returns fall monotonically with risk aversion
+    coarse_deltas = np.logspace(*LOG_DELTA_RANGE, n_points)
+    coarse = solve_batch(mu, model, coarse_deltas, l2_gamma)
+    coarse_returns = coarse @ mu
+
+    # Risk aversion for each target by interpolation in log space, the coarse point closest
+    # in return is the warm start
+    targets = np.linspace(coarse_returns.min(), coarse_returns.max(), n_points)
+    order = np.argsort(coarse_returns)
+    log_deltas = np.interp(targets, coarse_returns[order], np.log10(coarse_deltas)[order])
+    nearest = np.abs(coarse_returns[None, :] - targets[:, None]).argmin(axis=1)
+
+    weights = solve_batch(mu, model, 10 ** log_deltas, l2_gamma, W0=coarse[nearest])
+    returns = weights @ mu
+    volatilities = np.sqrt(np.maximum(np.einsum('ij,jk,ik->i', weights, model.cov, weights), 0))
+    return returns, volatilities, weights
+
+
+def get_frontier(data_settings, n_points=N_POINTS):
+    """
+    Frontier of the optimizer's universe for the data settings, cached per universe,
+    covariance estimator, window and last price date. None until the optimize job has
+    estimated the expected returns, so a page view never trains an estimator.
+    """
+    universe = get_universe(data_settings, estimate=False)
+    if universe.empty:
+        return None
+
+    symbols = universe.index.to_list()
+    model = get_covariance_model(symbols, start=data_settings.start_date, method=data_settings.covariance_method)
+    close = get_returns_matrix().read('close')
+    last_date = None if close is None else close['date'].max()
+
+    mu = universe.expected_return.to_numpy()
+    key = (tuple(symbols), data_settings.covariance_method, data_settings.start_date, last_date,
+           n_points, data_settings.l2_gamma, mu.tobytes())
+    frontier = frontier_cache.get(key)
+    if frontier is None:
+        returns, volatilities, weights = efficient_frontier(mu, model, n_points, data_settings.l2_gamma)
+        frontier = frontier_cache.put(key, {
+            'points': pd.DataFrame({'return': returns, 'volatility': volatilities}),
+            'weights': pd.DataFrame(weights, columns=symbols),
+            'assets': pd.DataFrame({'return': mu, 'volatility': np.sqrt(np.diag(model.cov))}, index=symbols),
+            'cov': model.cov,
+        })
+    return frontier
@@ -0,0 +1,346 @@
+from portfolio_optimizer_webapp.fetch import stream
+from portfolio_optimizer_webapp.models import Fundamentals, SecurityList, SecurityPrice, fiscal_years
+from portfolio_optimizer_webapp.pricestore import get_price_store, to_pandas
+from portfolio_optimizer_webapp.rendercache import bump_generation
+from portfolio_optimizer_webapp.returns import get_returns_matrix
+from portfolio_optimizer_webapp.rollup import update_rollups
+from portfolio_optimizer_webapp.scoring import update_scores
+from django.db import connection, transaction
+from django.utils import timezone
+from pathlib import Path
+from io import StringIO
+import polars as pl
+import pandas as pd
+import datetime
+import re
+
+# Streaming ingestion for SecurityPrice and Fundamentals. Sources are read in chunks,
+# validated vectorized and upserted in bounded batches, with bulk_create(update_conflicts=True)
+# or PostgreSQL COPY into a staging table when that backend is in use.
+
+CHUNK_SIZE = 50_000
+BATCH_SIZE = 5_000
+COPY_NULL = r'\N'
+
+PRICE_FLOATS = ['open', 'high', 'low', 'close', 'adjclose', 'dividends']
+PRICE_INTS = ['splits', 'volume']
+PRICE_KEYS = ['symbol', 'date']
+
+FUNDAMENTAL_KEYS = ['symbol', 'as_of_date', 'period_type', 'currency_code']
+FUNDAMENTAL_FLOATS = ['enterprises_value_ebitda_ratio', 'enterprises_value_revenue_ratio', 'forward_pe_ratio',
+                      'pb_ratio', 'pe_ratio', 'peg_ratio', 'ps_ratio']
+FUNDAMENTAL_INTS = ['year', 'quarter', 'net_income', 'net_income_common_stockholders',
+                    'total_liabilities_net_minority_interest', 'total_assets', 'current_assets',
+                    'current_liabilities', 'capital_stock', 'cash_and_cash_equivalents', 'gross_profit',
+                    'total_revenue', 'enterprise_value', 'market_cap']
+
+
+def read_chunks(source, chunksize=CHUNK_SIZE):
+    """
+    Yield pandas DataFrame chunks from a DataFrame, a CSV/Parquet path or an iterable of
+    DataFrames (e.g., a generator streaming from a data source).
+    """
+    if isinstance(source, pl.DataFrame):
+        source = to_pandas(source)
+
+    if isinstance(source, pd.DataFrame):
+        for i in range(0, len(source), chunksize):
+            yield source.iloc[i:i + chunksize]
+
+    elif isinstance(source, (str, Path)):
+        path = Path(source)
+        if path.suffix == '.parquet':
+            lf = pl.scan_parquet(path)
+            n_rows = lf.select(pl.len()).collect().item()
+            for i in range(0, n_rows, chunksize):
+                yield to_pandas(lf.slice(i, chunksize).collect())
+        else:
+            yield from pd.read_csv(path, chunksize=chunksize)
+
+    else:
+        for chunk in source:
+            yield from read_chunks(chunk, chunksize)
+
+
+COLUMN_ALIASES = {
+    'ticker': 'symbol',
+    'adj_close': 'adjclose',
+    'stock_splits': 'splits',
+}
+
+
+def snake_case(name):
+    name = re.sub(r'(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])', '_', str(name).strip())
+    return re.sub(r'[\s_]+', '_', name).lower()
+
+
+def normalize_columns(df):
+    # Accept 'Adj Close', 'asOfDate', 'NetIncome', 'Stock Splits', etc.
+    columns = [snake_case(x) for x in df.columns]
+    return df.set_axis([COLUMN_ALIASES.get(x, x) for x in columns], axis=1)
+
+
+def coerce_numeric(df, floats, ints):
+    for col in floats:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype(float) if col in df else float('nan')
+    for col in ints:
+        values = pd.to_numeric(df[col], errors='coerce') if col in df else pd.Series(float('nan'), index=df.index)
+        df[col] = values.astype(float).round().astype('Int64')
+    return df
+
+
+def validate_prices(df):
+    """
+    Clean a chunk of price rows. Rows without symbol/date or with no positive close
+    are rejected, duplicates keep the last row. Returns (clean frame, number rejected).
+    """
+    df = normalize_columns(df.copy())
+    missing = {'symbol', 'date', 'close'} - set(df.columns)
+    if missing:
+        raise ValueError(f'Price data is missing columns: {sorted(missing)}')
+
+    df['symbol'] = df.symbol.astype('string').str.strip().str.upper()
+    df['date'] = pd.to_datetime(df.date, errors='coerce').dt.date
+    df = coerce_numeric(df, PRICE_FLOATS, PRICE_INTS)
+
+    # Negative prices are bad data, not a market event
+    prices = df[PRICE_FLOATS[:5]]
+    df[PRICE_FLOATS[:5]] = prices.where(prices >= 0)
+
+    valid = df.symbol.notna() & (df.symbol != '') & df.date.notna() & (df.close > 0)
+    clean = df.loc[valid, PRICE_KEYS + PRICE_FLOATS + PRICE_INTS].drop_duplicates(PRICE_KEYS, keep='last')
+
+    return clean, len(df) - len(clean)
+
+
+def assign_fiscal_years(df):
+    # One vectorized pass, using each company's fiscal year end month (December if unknown)
+    end_months = dict(SecurityList.objects.filter(symbol__in=df.symbol.unique())
+                      .values_list('symbol', 'fiscal_year_end_month'))
+    months = df.symbol.map(end_months).fillna(12).astype(int).to_numpy()
+    return df.assign(year=fiscal_years(df.as_of_date, months) if len(df) else [])
+
+
+def validate_fundamentals(df):
+    df = normalize_columns(df.copy())
+    missing = {'symbol', 'as_of_date', 'period_type'} - set(df.columns)
+    if missing:
+        raise ValueError(f'Fundamentals data is missing columns: {sorted(missing)}')
+
+    df['symbol'] = df.symbol.astype('string').str.strip().str.upper()
+    df['as_of_date'] = pd.to_datetime(df.as_of_date, errors='coerce').dt.date
+    # currency_code is part of the upsert key and NULLs never conflict, so a missing
+    # currency is stored as '' for re-ingested reports to update rather than duplicate
+    if 'currency_code' not in df:
+        df['currency_code'] = ''
+    df['currency_code'] = df.currency_code.astype('string').str.strip().str.upper().fillna('')
+
+    valid = df.symbol.notna() & (df.symbol != '') & df.as_of_date.notna() & df.period_type.notna()
+    df = df.loc[valid]
+
+    df = assign_fiscal_years(df)
+    df = coerce_numeric(df, FUNDAMENTAL_FLOATS, FUNDAMENTAL_INTS)
+
+    clean = df[FUNDAMENTAL_KEYS + FUNDAMENTAL_FLOATS + FUNDAMENTAL_INTS]\
+        .drop_duplicates(FUNDAMENTAL_KEYS, keep='last')
+
+    return clean, int((~valid).sum()) + len(df) - len(clean)
+
+
+def use_copy():
+    return connection.vendor == 'postgresql'
+
+
+def to_records(df):
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def bulk_upsert(model, df, unique_fields, batch_size=BATCH_SIZE):
+    # symbol is the FK column, ORM objects take it as symbol_id
+    df = df.rename(columns={'symbol': 'symbol_id'})
+    update_fields = [x for x in df.columns if x not in ('symbol_id', *unique_fields)]
+
+    for i in range(0, len(df), batch_size):
+        objs = [model(**x) for x in to_records(df.iloc[i:i + batch_size])]
+        model.objects.bulk_create(
+            objs,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=update_fields,
+        )
+
+
+def copy_buffer(df):
+    # CSV rows for COPY with NULL written as \N: COPY's CSV default reads an unquoted empty
+    # field as NULL, which would turn the '' of a blank currency into NULL
+    buffer = StringIO()
+    df.to_csv(buffer, header=False, index=False, na_rep=COPY_NULL)
+    buffer.seek(0)
+    return buffer
+
+
+def copy_statement(table, col_sql):
+    return f"COPY {table} ({col_sql}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+
+
+def copy_upsert(model, df, unique_fields):
+    # COPY the chunk into a staging table, then merge it with a single INSERT .. ON CONFLICT
+    table = model._meta.db_table
+    columns = [model._meta.get_field(x).column for x in df.columns]
+    keys = [model._meta.get_field(x).column for x in unique_fields]
+    qn = connection.ops.quote_name
+
+    col_sql = ', '.join(qn(x) for x in columns)
+    update_sql = ', '.join(f'{qn(x)} = EXCLUDED.{qn(x)}' for x in columns if x not in keys)
+    staging = qn(f'{table}_staging')
+
+    buffer = copy_buffer(df)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {col_sql} FROM {qn(table)} WITH NO DATA')
+        copy_sql = copy_statement(staging, col_sql)
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, 'copy'):  # psycopg 3
+            with raw_cursor.copy(copy_sql) as copy:
+                copy.write(buffer.read())
+        else:  # psycopg2
+            raw_cursor.copy_expert(copy_sql, buffer)
+
+        cursor.execute(
+            f'INSERT INTO {qn(table)} ({col_sql}) SELECT {col_sql} FROM {staging} '
+            f'ON CONFLICT ({", ".join(qn(x) for x in keys)}) DO UPDATE SET {update_sql}'
+        )
+
+
+def upsert(model, df, unique_fields, batch_size=BATCH_SIZE):
+    if use_copy():
+        copy_upsert(model, df, unique_fields)
+    else:
+        bulk_upsert(model, df, unique_fields, batch_size)
+
+
+def ensure_securities(symbols):
+    SecurityList.objects.bulk_create([SecurityList(symbol=x) for x in symbols], ignore_conflicts=True)
+
+
+def stamp_last_updated(last_dates):
+    # last_updated follows the latest price date loaded, never moving backwards
+    current = dict(SecurityList.objects.filter(symbol__in=list(last_dates)).values_list('symbol', 'last_updated'))
+    objs = []
+    for symbol, last_date in last_dates.items():
+        stamp = datetime.datetime.combine(last_date, datetime.time(), tzinfo=datetime.timezone.utc)
+        if current.get(symbol) is None or current[symbol] < stamp:
+            objs.append(SecurityList(symbol=symbol, last_updated=stamp))
+    SecurityList.objects.bulk_update(objs, ['last_updated'], batch_size=BATCH_SIZE)
+
+
+def sync_price_caches(first_dates):
+    # Rows inside an already cached range invalidate it, rows after it are read lazily
+    store, returns_matrix = get_price_store(), get_returns_matrix()
+    for symbol, first_date in first_dates.items():
+        last_cached = store.last_date(symbol)
+        if last_cached is not None and first_date <= last_cached:
+            store.invalidate(symbol)
+            returns_matrix.invalidate(symbol)
+
+
+def ingest_prices(source, chunksize=CHUNK_SIZE, batch_size=BATCH_SIZE):
+    """
+    Stream price rows from source into SecurityPrice. Returns (rows loaded, rows rejected).
+    """
+    n_loaded, n_rejected = 0, 0
+    first_dates, last_dates = {}, {}
+
+    for chunk in read_chunks(source, chunksize):
+        df, rejected = validate_prices(chunk)
+        n_rejected += rejected
+        if df.empty:
+            continue
+
+        ensure_securities(df.symbol.unique())
+        upsert(SecurityPrice, df, PRICE_KEYS, batch_size)
+        update_rollups(df)
+        n_loaded += len(df)
+
+        bounds = df.groupby('symbol').date.agg(['min', 'max'])
+        for symbol, row in bounds.iterrows():
+            first_dates[symbol] = min(row['min'], first_dates.get(symbol, row['min']))
+            last_dates[symbol] = max(row['max'], last_dates.get(symbol, row['max']))
+
+    stamp_last_updated(last_dates)
+    sync_price_caches(first_dates)
+    if n_loaded:
+        bump_generation()
+
+    return n_loaded, n_rejected
+
+
+def ingest_fundamentals(source, chunksize=CHUNK_SIZE, batch_size=BATCH_SIZE, score=True):
+    """
+    Stream fundamentals rows from source into Fundamentals, then rescore the affected reports.
+    Returns (rows loaded, rows rejected).
+    """
+    n_loaded, n_rejected = 0, 0
+    loaded = []
+
+    for chunk in read_chunks(source, chunksize):
+        df, rejected = validate_fundamentals(chunk)
+        n_rejected += rejected
+        if df.empty:
+            continue
+
+        ensure_securities(df.symbol.unique())
+        upsert(Fundamentals, df, FUNDAMENTAL_KEYS, batch_size)
+        n_loaded += len(df)
+        loaded.append(df[['symbol', 'as_of_date']])
+
+    if n_loaded:
+        bump_generation()
+
+    if score and loaded:
+        keys = pd.concat(loaded)
+        ids = Fundamentals.objects.filter(symbol_id__in=keys.symbol.unique(), as_of_date__in=keys.as_of_date.unique())\
+            .values_list('id', flat=True)
+        update_scores(ids)
+
+    return n_loaded, n_rejected
+
+
+def refresh(source, symbols=None, **options):
+    """
+    Pull price deltas since each symbol's last_updated, plus fundamentals, from a data source.
+    Symbols are fetched concurrently (see fetch.stream, options override the source's
+    concurrency and rate limit) and ingested as they arrive. Symbols that still fail after
+    retries are reported under 'failed' and keep their last_updated for the next refresh.
+    """
+    securities = SecurityList.objects.all()
+    if symbols is not None:
+        ensure_securities(symbols)
+        securities = securities.filter(symbol__in=symbols)
+    since = dict(securities.values_list('symbol', 'last_updated'))
+
+    today = timezone.now().date()
+    requests = []
+    for symbol, last_updated in since.items():
+        start = last_updated.date() + datetime.timedelta(days=1) if last_updated else None
+        if start is None or start <= today:
+            requests.append(('prices', symbol, (start, today)))
+        requests.append(('fundamentals', symbol, ()))
+
+    # Fundamentals are few rows per symbol, they are held back and ingested after the prices
+    fundamentals, failed = [], {}
+
+    def price_chunks():
+        for kind, symbol, result in stream(source, requests, **options):
+            if isinstance(result, Exception):
+                failed[symbol] = f'{kind}: {result!r}'
+            elif kind == 'fundamentals':
+                fundamentals.append(result)
+            else:
+                yield result
+
+    return {
+        'prices': ingest_prices(price_chunks()),
+        'fundamentals': ingest_fundamentals(fundamentals),
+        'failed': failed,
+    }
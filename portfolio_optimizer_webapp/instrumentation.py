@@ -0,0 +1,264 @@
+from portfolio_optimizer_webapp.app_settings import cache_dir, get_setting
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db.backends.signals import connection_created
+from contextlib import contextmanager, nullcontext
+import contextvars
+import threading
+import cProfile
+import time
+
+# Opt-in request instrumentation (PORTFOLIO_OPTIMIZER_INSTRUMENT = True). Views and analytics
+# mark their stages with span(), each span records its wall time, the queries run inside it
+# and any DataFrame sizes attached to it. The middleware collects the spans of a request
+# into a Server-Timing header and folds them into process wide metrics, served in the
+# Prometheus text format by the metrics view. Spans outside a request (job workers, the
+# shell) cost one context variable lookup.
+
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+current = contextvars.ContextVar('portfolio_optimizer_recorder', default=None)
+
+
+def enabled():
+    return get_setting('INSTRUMENT', False)
+
+
+class Recorder:
+    # Spans of one request, plus its query totals
+
+    def __init__(self):
+        self.spans = []
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+@contextmanager
+def recording(recorder):
+    token = current.set(recorder)
+    try:
+        yield recorder
+    finally:
+        current.reset(token)
+
+
+@contextmanager
+def _span(recorder, name):
+    record = {'name': name, 'seconds': 0.0, 'queries': 0, 'query_seconds': 0.0}
+    queries, query_seconds = recorder.queries, recorder.query_seconds
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        record['queries'] = recorder.queries - queries
+        record['query_seconds'] = recorder.query_seconds - query_seconds
+        recorder.spans.append(record)
+
+
+def span(name):
+    """
+    Time a stage of the current request. Yields a dict that extra fields can be set on,
+    e.g. span['rows'] = len(df), or None when nothing is being recorded.
+    """
+    recorder = current.get()
+    if recorder is None:
+        return nullcontext()
+    return _span(recorder, name)
+
+
+def frame_size(record, df):
+    # Rows and in-memory bytes of a pandas or polars DataFrame on a span
+    if record is None or df is None:
+        return
+    record['rows'] = len(df)
+    record['bytes'] = int(df.estimated_size() if hasattr(df, 'estimated_size') else df.memory_usage(deep=False).sum())
+
+
+def count_queries(execute, sql, params, many, context):
+    # Installed on every connection, counts only while a request is being recorded
+    recorder = current.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.queries += 1
+        recorder.query_seconds += time.perf_counter() - start
+
+
+def install_query_counter(sender, connection, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+connection_created.connect(install_query_counter)
+
+
+class Metrics:
+    """
+    Process wide histograms of span durations, with query and row totals, labelled by span
+    and by the URL name of the request they ran in. Each server process keeps its own.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, view, record):
+        key = (record['name'], view)
+        with self.lock:
+            series = self.series.setdefault(key, {'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0,
+                                                  'queries': 0, 'query_seconds': 0.0, 'rows': 0})
+            for i, bound in enumerate(BUCKETS):
+                if record['seconds'] <= bound:
+                    series['buckets'][i] += 1
+            series['count'] += 1
+            series['sum'] += record['seconds']
+            series['queries'] += record['queries']
+            series['query_seconds'] += record['query_seconds']
+            series['rows'] += record.get('rows', 0)
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def render(self):
+        prefix = 'portfolio_optimizer_span'
+        lines = [
+            f'# HELP {prefix}_seconds Wall time of instrumented stages.',
+            f'# TYPE {prefix}_seconds histogram',
+        ]
+        with self.lock:
+            series = sorted(self.series.items())
+            for (name, view), x in series:
+                labels = f'span="{name}",view="{view}"'
+                for bound, count in zip(BUCKETS, x['buckets']):
+                    lines.append(f'{prefix}_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{prefix}_seconds_bucket{{{labels},le="+Inf"}} {x["count"]}')
+                lines.append(f'{prefix}_seconds_sum{{{labels}}} {x["sum"]:.6f}')
+                lines.append(f'{prefix}_seconds_count{{{labels}}} {x["count"]}')
+
+            for metric, field, kind, text in [
+                ('queries_total', 'queries', 'counter', 'Database queries run inside instrumented stages.'),
+                ('query_seconds_total', 'query_seconds', 'counter', 'Database time inside instrumented stages.'),
+                ('rows_total', 'rows', 'counter', 'DataFrame rows produced by instrumented stages.'),
+            ]:
+                lines += [f'# HELP {prefix}_{metric} {text}', f'# TYPE {prefix}_{metric} {kind}']
+                for (name, view), x in series:
+                    value = f'{x[field]:.6f}' if isinstance(x[field], float) else x[field]
+                    lines.append(f'{prefix}_{metric}{{span="{name}",view="{view}"}} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def server_timing(recorder, total):
+    # Spans with the same name are summed, the database and whole request come last
+    durations = {}
+    for record in recorder.spans:
+        durations[record['name']] = durations.get(record['name'], 0.0) + record['seconds']
+    entries = [f'{name};dur={1000 * seconds:.1f}' for name, seconds in durations.items()]
+    entries.append(f'db;dur={1000 * recorder.query_seconds:.1f};desc="{recorder.queries} queries"')
+    entries.append(f'total;dur={1000 * total:.1f}')
+    return ', '.join(entries)
+
+
+def profile_path(request, suffix):
+    name = request.resolver_match.url_name if request.resolver_match else 'request'
+    return cache_dir('profiles') / f'{time.time_ns()}-{name}{suffix}'
+
+
+@contextmanager
+def profiling(request):
+    """
+    Profile the request when PORTFOLIO_OPTIMIZER_PROFILE is set, 'cprofile' (or True) for a
+    .prof file to open in snakeviz or pstats, 'pyinstrument' for an HTML report. Dumps go
+    to the profiles folder of the cache directory.
+    """
+    profiler = get_setting('PROFILE', False)
+    if not profiler:
+        yield
+        return
+
+    if profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            profile_path(request, '.html').write_text(profile.output_html())
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(profile_path(request, '.prof'))
+
+
+class InstrumentationMiddleware:
+    """
+    Records the spans of each request when PORTFOLIO_OPTIMIZER_INSTRUMENT is set and adds
+    them as a Server-Timing header. Template rendering after the view is its own span.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not enabled():
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        with recording(Recorder()) as recorder, profiling(request):
+            response = self.get_response(request)
+        return self.finish(request, response, recorder, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not enabled():
+            return await self.get_response(request)
+
+        # cProfile only sees the event loop thread, pyinstrument follows the await chain
+        start = time.perf_counter()
+        with recording(Recorder()) as recorder, profiling(request):
+            response = await self.get_response(request)
+        return self.finish(request, response, recorder, time.perf_counter() - start)
+
+    def process_template_response(self, request, response):
+        recorder = current.get()
+        if recorder is not None:
+            rendering = _span(recorder, 'render')
+            rendering.__enter__()
+
+            def rendered(response):
+                # A callback's return value would replace the response
+                rendering.__exit__(None, None, None)
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, recorder, total):
+        view = request.resolver_match.url_name if request.resolver_match else ''
+        response.headers['Server-Timing'] = server_timing(recorder, total)
+
+        request_record = {'name': 'request', 'seconds': total, 'queries': recorder.queries,
+                          'query_seconds': recorder.query_seconds}
+        for record in [*recorder.spans, request_record]:
+            metrics.observe(view, record)
+        return response
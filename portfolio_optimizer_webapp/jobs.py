@@ -0,0 +1,152 @@
+from portfolio_optimizer_webapp.models import DataSettings, Job
+from portfolio_optimizer_webapp.ingest import ensure_securities, refresh
+from portfolio_optimizer_webapp.scoring import update_scores
+from portfolio_optimizer_webapp.sources import get_source
+from portfolio_optimizer_webapp import backtest, estimation, optimizer
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.forms.models import model_to_dict
+from django.utils import timezone
+from functools import partial
+import traceback
+import hashlib
+import json
+
+# Background jobs. Heavy work (scoring, estimation, optimization, data refreshes) is queued
+# as a Job row and run in a process pool by the run_jobs management command, so requests
+# only enqueue and poll. A queued or running job is reused when the same kind is submitted
+# with the same parameters.
+
+TASKS = {}
+
+
+def task(name):
+    # Register func(params, report) as the handler of a job kind, report(progress, message)
+    # stores progress in [0, 1] on the job row
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def dedup_key(kind, params):
+    text = json.dumps([kind, params], sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def enqueue(kind, **params):
+    """
+    Queue a job and return it, or the already queued/running job with the same kind and
+    parameters. Parameters must be JSON serializable (dates are stored as ISO strings).
+    """
+    if kind not in TASKS:
+        raise ValueError(f'Unknown job kind {kind}')
+
+    params = json.loads(json.dumps(params, cls=DjangoJSONEncoder))
+    key = dedup_key(kind, params)
+    try:
+        with transaction.atomic():
+            return Job.objects.create(kind=kind, params=params, dedup_key=key)
+    except IntegrityError:
+        job = Job.objects.filter(dedup_key=key, status__in=Job.ACTIVE).first()
+        # The duplicate may have finished in between
+        return job or enqueue(kind, **params)
+
+
+def claim(limit):
+    # Compare-and-set from queued to running, so several workers never run the same job
+    claimed = []
+    queued = Job.objects.filter(status='queued').order_by('created').values_list('pk', flat=True)[:limit]
+    for pk in queued:
+        if Job.objects.filter(pk=pk, status='queued').update(status='running', started=timezone.now()):
+            claimed.append(pk)
+    return claimed
+
+
+def report(pk, progress, message=''):
+    Job.objects.filter(pk=pk).update(progress=progress, message=message[:200])
+
+
+def fail(pk, error):
+    Job.objects.filter(pk=pk).update(status='failed', error=error, finished=timezone.now())
+
+
+def requeue_stale():
+    # Jobs left running by a worker that was killed
+    return Job.objects.filter(status='running').update(status='queued', progress=0, message='')
+
+
+def run_job(pk):
+    """
+    Run a claimed job in the current process and store its result or traceback.
+    """
+    job = Job.objects.get(pk=pk)
+    try:
+        result = TASKS[job.kind](job.params, partial(report, pk))
+    except Exception:
+        fail(pk, traceback.format_exc())
+        return 'failed'
+
+    result = json.loads(json.dumps(result, cls=DjangoJSONEncoder))
+    Job.objects.filter(pk=pk).update(status='done', progress=1, message='', result=result,
+                                     finished=timezone.now())
+    return 'done'
+
+
+def settings_params(data_settings):
+    # The computation settings plus the scenario the results belong to
+    return {**model_to_dict(data_settings, exclude=['id', 'user', 'name']), 'scenario': data_settings.pk}
+
+
+def settings_from_params(params):
+    fields = {x.name: x for x in DataSettings._meta.concrete_fields if x.name not in ['id', 'user', 'name']}
+    return DataSettings(pk=params.get('scenario'), **{k: fields[k].to_python(v) for k, v in params.items() if k in fields})
+
+
+@task('optimize')
+def run_optimize(params, report):
+    data_settings = settings_from_params(params)
+    # Estimated and saved once per state of the data, shared by every scenario with the same
+    # estimator, only the optimization is per scenario
+    report(0.1, 'Estimating returns')
+    estimation.get_expected_returns(data_settings.estimation_method)
+    report(0.6, 'Optimizing')
+    weights, allocation = optimizer.optimize(data_settings)
+    allocation = allocation or {}
+    return {'weights': weights.round(6).to_dict(),
+            **{x: allocation.get(x) for x in ['leftover', 'deviation', 'tracking_error', 'optimal']}}
+
+
+@task('score')
+def run_score(params, report):
+    report(0.1, 'Scoring')
+    return {'scored': update_scores(symbols=params.get('symbols'))}
+
+
+@task('add_data')
+def run_add_data(params, report):
+    symbols = params['symbols']
+    ensure_securities(symbols)
+    result = {'symbols': symbols}
+
+    source = get_source()
+    if source is not None:
+        report(0.1, f'Fetching {len(symbols)} symbols')
+        # Ingesting fundamentals rescores the affected symbols
+        refreshed = refresh(source, symbols)
+        for kind in ('prices', 'fundamentals'):
+            n_loaded, n_rejected = refreshed[kind]
+            result[kind] = {'loaded': n_loaded, 'rejected': n_rejected}
+        result['failed'] = refreshed['failed']
+    return result
+
+
+@task('backtest')
+def run_backtest(params, report):
+    data_settings = settings_from_params(params)
+    report(0.1, 'Backtesting')
+    table = backtest.run_grid(l2_gamma=data_settings.l2_gamma,
+                              method=data_settings.covariance_method,
+                              investment_amount=data_settings.investment_amount,
+                              start=data_settings.start_date)
+    return {'table': table.astype(object).where(table.notna(), None).to_dict('records')}
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from portfolio_optimizer_webapp.benchmarks import importtime
+import json
+
+
+class Command(BaseCommand):
+    help = 'Time the cold start import of the URLconf with python -X importtime'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters to time, the median is reported')
+        parser.add_argument('--top', type=int, default=10, help='Packages to list by import time (default 10)')
+        parser.add_argument('--json', help='Write the results to this file as a baseline')
+        parser.add_argument('--baseline', help='Compare against a baseline written by --json')
+        parser.add_argument('--threshold', type=float, default=importtime.THRESHOLD,
+                            help='Import time ratio over the baseline that counts as a regression (default 1.25)')
+
+    def handle(self, *args, **options):
+        results = importtime.run(options['repeat'], options['top'])
+
+        self.stdout.write(f"{results['urlconf']}: {results['import_ms']} ms importing {results['modules']} modules, "
+                          f"{results['wall_s']:.3f}s process wall time")
+        self.stdout.write(f"heavy packages imported: {', '.join(results['heavy']) or 'none'}\n")
+        self.stdout.write(f"{'package':<30}{'import ms':>10}")
+        for x in results['packages']:
+            self.stdout.write(f"{x['package']:<30}{x['import_ms']:>10}")
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            x = importtime.compare(results, baseline, options['threshold'])
+            flag = '  REGRESSION' if x['regression'] else ''
+            self.stdout.write(f"\nbaseline {x['baseline_ms']} ms, current {x['current_ms']} ms, ratio {x['ratio']:.2f}{flag}")
+            if x['regression']:
+                raise CommandError(f'URLconf import slower than {options["threshold"]}x the baseline')
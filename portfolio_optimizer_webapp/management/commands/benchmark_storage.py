@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from portfolio_optimizer_webapp.benchmarks import storage
+import json
+
+
+class Command(BaseCommand):
+    help = 'Compare bytes per row and load time of Decimal and float price columns on the fixture universe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--symbols', type=int, default=50, help='Fixture symbols to load (default 50)')
+        parser.add_argument('--layouts', nargs='*', default=list(storage.LAYOUTS), choices=list(storage.LAYOUTS))
+        parser.add_argument('--repeat', type=int, default=3, help='Timed loads per layout, the best is reported')
+        parser.add_argument('--json', help='Also write the results to this file')
+
+    def handle(self, *args, **options):
+        results = storage.run(options['symbols'], options['layouts'], options['repeat'])
+
+        self.stdout.write(f"{'layout':<10}{'rows':>10}{'bytes/row':>12}{'insert s':>10}{'load s':>10}")
+        for x in results:
+            size = '' if x['bytes_per_row'] is None else x['bytes_per_row']
+            self.stdout.write(f"{x['layout']:<10}{x['rows']:>10}{size:>12}{x['insert_seconds']:>10}{x['load_seconds']:>10}")
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2)
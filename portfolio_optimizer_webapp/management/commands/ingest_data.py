@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from portfolio_optimizer_webapp.ingest import ingest_fundamentals, ingest_prices, refresh
+from portfolio_optimizer_webapp.sources import SOURCES, FileSource
+
+
+class Command(BaseCommand):
+    help = 'Bulk load SecurityPrice and Fundamentals rows from CSV/Parquet files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prices', nargs='*', default=[], help='CSV/Parquet files of price rows')
+        parser.add_argument('--fundamentals', nargs='*', default=[], help='CSV/Parquet files of fundamentals rows')
+        parser.add_argument('--source-dir', help='Refresh from a directory of per-symbol files instead')
+        parser.add_argument('--source', choices=sorted(SOURCES), help='Refresh from a data source '
+                            '(file needs --source-dir, fixture is synthetic data for fixtures/sp500.csv)')
+        parser.add_argument('--symbols', nargs='*', help='Symbols to refresh (default all the source has)')
+        parser.add_argument('--concurrency', type=int, help='Concurrent requests to the source')
+        parser.add_argument('--rate-limit', type=float, help='Requests per second to the source')
+
+    def handle(self, *args, **options):
+        name = options['source'] or ('file' if options['source_dir'] else None)
+        if name is not None:
+            if name == 'file' and not options['source_dir']:
+                raise CommandError('The file source needs --source-dir')
+            source = FileSource(options['source_dir']) if name == 'file' else SOURCES[name]()
+
+            fetch_options = {x: options[x] for x in ('concurrency', 'rate_limit') if options[x] is not None}
+            result = refresh(source, options['symbols'] or source.symbols(), **fetch_options)
+            for kind in ('prices', 'fundamentals'):
+                n_loaded, n_rejected = result[kind]
+                self.stdout.write(f'{kind}: loaded {n_loaded} rows, rejected {n_rejected}')
+            for symbol, error in result['failed'].items():
+                self.stderr.write(f'{symbol} failed: {error}')
+            return
+
+        for path in options['prices']:
+            n_loaded, n_rejected = ingest_prices(path)
+            self.stdout.write(f'{path}: loaded {n_loaded} price rows, rejected {n_rejected}')
+
+        for path in options['fundamentals']:
+            n_loaded, n_rejected = ingest_fundamentals(path)
+            self.stdout.write(f'{path}: loaded {n_loaded} fundamentals rows, rejected {n_rejected}')
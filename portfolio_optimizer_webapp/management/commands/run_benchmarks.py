@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from portfolio_optimizer_webapp.benchmarks import harness
+import json
+
+
+def scale(text):
+    # '50x5' -> (50 symbols, 5 years)
+    n_symbols, n_years = text.lower().split('x')
+    return int(n_symbols), int(n_years)
+
+
+class Command(BaseCommand):
+    help = 'Time the analytics and dashboard on synthetic universes in a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', nargs='*', type=scale, default=harness.SCALES,
+                            help='Universe sizes as SYMBOLSxYEARS (default 10x3 50x5 200x10)')
+        parser.add_argument('--cases', nargs='*', default=list(harness.CASES), choices=list(harness.CASES))
+        parser.add_argument('--modes', nargs='*', default=harness.MODES, choices=harness.MODES)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per case, the median is compared')
+        parser.add_argument('--json', help='Write the results to this file as a baseline')
+        parser.add_argument('--baseline', help='Compare against a baseline written by --json')
+        parser.add_argument('--threshold', type=float, default=harness.THRESHOLD,
+                            help='Median time ratio over the baseline that counts as a regression (default 1.25)')
+
+    def handle(self, *args, **options):
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        results = harness.run(options['scales'], options['cases'], options['modes'], options['repeat'], log)
+
+        self.stdout.write(f"{'case':<26}{'mode':<6}{'scale':>10}{'rows':>10}{'min s':>10}{'median s':>10}{'peak MB':>10}")
+        for x in results['results']:
+            self.stdout.write(f"{x['case']:<26}{x['mode']:<6}{x['symbols']:>6}x{x['years']:<3}{x['price_rows']:>10}"
+                              f"{x['min_s']:>10.4f}{x['median_s']:>10.4f}{x['peak_mb']:>10}")
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            rows = harness.compare(results, baseline, options['threshold'])
+
+            self.stdout.write(f"\n{'case':<26}{'mode':<6}{'scale':>10}{'baseline s':>12}{'current s':>12}{'ratio':>8}")
+            for x in rows:
+                flag = '  REGRESSION' if x['regression'] else ''
+                self.stdout.write(f"{x['case']:<26}{x['mode']:<6}{x['symbols']:>6}x{x['years']:<3}"
+                                  f"{x['baseline_s']:>12.4f}{x['current_s']:>12.4f}{x['ratio']:>8.2f}{flag}")
+
+            regressions = [x for x in rows if x['regression']]
+            if regressions:
+                raise CommandError(f'{len(regressions)} case(s) slower than {options["threshold"]}x the baseline')
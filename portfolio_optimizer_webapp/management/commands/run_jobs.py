@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from portfolio_optimizer_webapp.jobs import claim, fail, requeue_stale
+from portfolio_optimizer_webapp.worker import execute, init_worker
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import time
+import os
+
+
+class Command(BaseCommand):
+    help = 'Run queued jobs (optimization, scoring, data refreshes) in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes (default all cores)')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds between checks for new jobs')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is drained')
+        parser.add_argument('--requeue', action='store_true', help='Requeue jobs left running by a stopped worker')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        if options['requeue']:
+            self.stdout.write(f'Requeued {requeue_stale()} jobs')
+
+        # Spawned rather than forked, so children never inherit the parent's database connections
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker) as pool:
+            running = {}
+            while True:
+                for pk in claim(workers - len(running)):
+                    running[pool.submit(execute, pk)] = pk
+
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    pk = running.pop(future)
+                    try:
+                        self.stdout.write(f'Job {pk}: {future.result()}')
+                    except BrokenProcessPool:
+                        for x in [pk, *running.values()]:
+                            fail(x, 'Worker process died')
+                        raise CommandError('A worker process died, the pool was shut down')
+                    except Exception as e:
+                        fail(pk, repr(e))
+                        self.stdout.write(f'Job {pk}: failed')
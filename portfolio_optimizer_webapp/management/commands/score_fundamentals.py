@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from portfolio_optimizer_webapp.scoring import update_scores
+
+
+class Command(BaseCommand):
+    help = 'Compute Piotroski F-scores from Fundamentals and upsert them into Scores'
+
+    def add_arguments(self, parser):
+        parser.add_argument('symbols', nargs='*', help='Only rescore these symbols (default all)')
+
+    def handle(self, *args, **options):
+        n_scores = update_scores(symbols=options['symbols'] or None)
+        self.stdout.write(self.style.SUCCESS(f'Scored {n_scores} fundamentals rows'))
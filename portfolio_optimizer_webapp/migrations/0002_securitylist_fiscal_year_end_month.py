@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:48
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_optimizer_webapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='securitylist',
+            name='fiscal_year_end_month',
+            field=models.IntegerField(default=12, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(12)]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_optimizer_webapp', '0002_securitylist_fiscal_year_end_month'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasettings',
+            name='covariance_method',
+            field=models.CharField(choices=[('sample', 'Sample'), ('ledoit_wolf', 'Ledoit-Wolf Shrinkage'), ('ewma', 'Exponentially Weighted'), ('factor', 'Factor Model')], default='ledoit_wolf', max_length=16),
+        ),
+    ]
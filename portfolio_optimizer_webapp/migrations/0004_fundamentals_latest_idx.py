@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_optimizer_webapp', '0003_datasettings_covariance_method'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fundamentals',
+            index=models.Index(fields=['symbol', '-as_of_date'], name='fundamentals_latest_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_optimizer_webapp', '0004_fundamentals_latest_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=24)),
+                ('params', models.JSONField(default=dict)),
+                ('dedup_key', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=8)),
+                ('progress', models.FloatField(default=0)),
+                ('message', models.CharField(blank=True, default='', max_length=200)),
+                ('result', models.JSONField(default=None, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(default=None, null=True)),
+                ('finished', models.DateTimeField(default=None, null=True)),
+            ],
+            options={
+                'db_table': 'job',
+                'indexes': [models.Index(fields=['status', 'created'], name='job_status_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('dedup_key',), name='job_active_dedup')],
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Moves the Decimal price, ratio and weight columns to floats. Each column is copied into a
+# new float column in primary key chunks, each chunk its own transaction so large tables
+# are never rewritten under one long lock, then the old column is dropped and the new one
+# takes its name.
+
+from django.db import migrations, models, transaction
+from django.db.models import FloatField, Max, Min
+from django.db.models.functions import Cast
+import portfolio_optimizer_webapp.models
+
+CHUNK_SIZE = 100_000
+
+# model: {field: (nullable, price field)}
+FIELDS = {
+    'securityprice': {x: (True, True) for x in ['open', 'high', 'low', 'close', 'adjclose', 'dividends']},
+    'fundamentals': {x: (True, True) for x in ['enterprises_value_ebitda_ratio', 'enterprises_value_revenue_ratio',
+                                               'forward_pe_ratio', 'pb_ratio', 'pe_ratio', 'peg_ratio', 'ps_ratio']},
+    'portfolio': {'allocation': (False, False)},
+    'expectedreturns': {'last_close': (False, True), 'forecasted_close': (False, True),
+                        'expected_return': (False, False)},
+}
+
+
+def new_field(null, price, final=False):
+    field = portfolio_optimizer_webapp.models.PriceField if price else models.FloatField
+    if not final or null:
+        return field(default=None, null=True)
+    return field()
+
+
+def copy_columns(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    for model_name, fields in FIELDS.items():
+        model = apps.get_model('portfolio_optimizer_webapp', model_name)
+        bounds = model.objects.using(alias).aggregate(lo=Min('pk'), hi=Max('pk'))
+        if bounds['lo'] is None:
+            continue
+
+        casts = {f'{x}_f': Cast(x, FloatField()) for x in fields}
+        for start in range(bounds['lo'], bounds['hi'] + 1, CHUNK_SIZE):
+            with transaction.atomic(using=alias):
+                model.objects.using(alias).filter(pk__gte=start, pk__lt=start + CHUNK_SIZE).update(**casts)
+
+
+class Migration(migrations.Migration):
+
+    # Chunks commit one by one
+    atomic = False
+
+    dependencies = [
+        ('portfolio_optimizer_webapp', '0005_job'),
+    ]
+
+    operations = [
+        *[migrations.AddField(model_name=model_name, name=f'{name}_f', field=new_field(null, price))
+          for model_name, fields in FIELDS.items() for name, (null, price) in fields.items()],
+        migrations.RunPython(copy_columns, migrations.RunPython.noop),
+        *[migrations.RemoveField(model_name=model_name, name=name)
+          for model_name, fields in FIELDS.items() for name in fields],
+        *[migrations.RenameField(model_name=model_name, old_name=f'{name}_f', new_name=name)
+          for model_name, fields in FIELDS.items() for name in fields],
+        *[migrations.AlterField(model_name=model_name, name=name, field=new_field(null, price, final=True))
+          for model_name, fields in FIELDS.items() for name, (null, price) in fields.items() if not null],
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:19
+
+import django.db.models.deletion
+import portfolio_optimizer_webapp.models
+from django.db import migrations, models
+import math
+
+# The aggregation of rollup.period_stats, inlined so the migration doesn't depend on app code
+
+PERIOD_MONTHS = {'Y': 12, 'Q': 3, 'M': 1}
+
+
+def period_start(date, months):
+    return date.replace(month=(date.month - 1) // months * months + 1, day=1)
+
+
+def symbol_rollups(rows):
+    # Statistics per (period, period_start) of date ordered (date, close, volume) rows, the
+    # mean and M2 by Welford's update
+    stats = {}
+    for date, close, volume in rows:
+        for period, months in PERIOD_MONTHS.items():
+            key = (period, period_start(date, months))
+            row = stats.setdefault(key, {'first_date': date, 'last_date': date, 'last_close': None, 'count': 0,
+                                         'mean': None, 'm2': 0.0, 'volume': 0})
+            row['last_date'] = date
+            row['volume'] += volume or 0
+            if close is None or math.isnan(close):
+                continue
+            close = float(close)
+            row['count'] += 1
+            delta = close - (row['mean'] or 0.0)
+            row['mean'] = (row['mean'] or 0.0) + delta / row['count']
+            row['m2'] += delta * (close - row['mean'])
+            row['last_close'] = close
+    return stats
+
+
+def backfill(apps, schema_editor):
+    # Rollups of the prices already loaded, one symbol at a time
+    alias = schema_editor.connection.alias
+    SecurityPrice = apps.get_model('portfolio_optimizer_webapp', 'SecurityPrice')
+    PriceRollup = apps.get_model('portfolio_optimizer_webapp', 'PriceRollup')
+
+    symbols = SecurityPrice.objects.using(alias).order_by().values_list('symbol_id', flat=True).distinct()
+    for symbol in list(symbols):
+        rows = SecurityPrice.objects.using(alias).filter(symbol_id=symbol).order_by('date')\
+            .values_list('date', 'close', 'volume')
+        PriceRollup.objects.using(alias).bulk_create(
+            [PriceRollup(symbol_id=symbol, period=period, period_start=start, **fields)
+             for (period, start), fields in symbol_rollups(rows.iterator()).items()],
+            batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_optimizer_webapp', '0006_float_price_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('Y', 'Year'), ('Q', 'Quarter'), ('M', 'Month')], max_length=1)),
+                ('period_start', models.DateField()),
+                ('first_date', models.DateField()),
+                ('last_date', models.DateField()),
+                ('last_close', portfolio_optimizer_webapp.models.PriceField(default=None, null=True)),
+                ('count', models.IntegerField(default=0)),
+                ('mean', models.FloatField(default=None, null=True)),
+                ('m2', models.FloatField(default=0)),
+                ('volume', models.BigIntegerField(default=0)),
+                ('symbol', models.ForeignKey(db_column='symbol', on_delete=django.db.models.deletion.CASCADE, to='portfolio_optimizer_webapp.securitylist')),
+            ],
+            options={
+                'db_table': 'price_rollup',
+                'unique_together': {('symbol', 'period', 'period_start')},
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_optimizer_webapp', '0007_price_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasettings',
+            name='allocation_method',
+            field=models.CharField(choices=[('largest_remainder', 'Largest Remainder'), ('exact', 'Exact (Branch and Bound)')], default='largest_remainder', max_length=24),
+        ),
+    ]
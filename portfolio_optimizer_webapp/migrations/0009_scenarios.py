@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_holdings(apps, schema_editor):
+    # The existing portfolio becomes the holdings of the first (shared) scenario
+    alias = schema_editor.connection.alias
+    DataSettings = apps.get_model('portfolio_optimizer_webapp', 'DataSettings')
+    LegacyPortfolio = apps.get_model('portfolio_optimizer_webapp', 'LegacyPortfolio')
+    Portfolio = apps.get_model('portfolio_optimizer_webapp', 'Portfolio')
+
+    # Holdings are now one per symbol, the latest report's row wins
+    rows = LegacyPortfolio.objects.using(alias).order_by('symbol_id', 'fundamentals__as_of_date')\
+        .values('symbol_id', 'fundamentals_id', 'allocation', 'shares')
+    rows = {row['symbol_id']: row for row in rows}
+    if not rows:
+        return
+    scenario = DataSettings.objects.using(alias).order_by('pk').first() or DataSettings.objects.using(alias).create()
+    Portfolio.objects.using(alias).bulk_create([Portfolio(scenario=scenario, **row) for row in rows.values()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_optimizer_webapp', '0008_datasettings_allocation_method'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasettings',
+            name='name',
+            field=models.CharField(default='Default', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='datasettings',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='portfolio_scenarios', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='datasettings',
+            constraint=models.UniqueConstraint(fields=('user', 'name'), name='data_settings_user_name'),
+        ),
+        # Portfolio moves from one row per report to one per scenario and symbol, a new
+        # primary key, so the table is rebuilt rather than altered in place
+        migrations.RenameModel(
+            old_name='Portfolio',
+            new_name='LegacyPortfolio',
+        ),
+        migrations.AlterModelTable(
+            name='legacyportfolio',
+            table='portfolio_legacy',
+        ),
+        migrations.CreateModel(
+            name='Portfolio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('allocation', models.FloatField()),
+                ('shares', models.IntegerField()),
+                ('fundamentals', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='portfolio_optimizer_webapp.fundamentals')),
+                ('scenario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holdings', to='portfolio_optimizer_webapp.datasettings')),
+                ('symbol', models.ForeignKey(db_column='symbol', on_delete=django.db.models.deletion.CASCADE, to='portfolio_optimizer_webapp.securitylist')),
+            ],
+            options={
+                'db_table': 'portfolio',
+                'unique_together': {('scenario', 'symbol')},
+            },
+        ),
+        migrations.RunPython(copy_holdings, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='LegacyPortfolio',
+        ),
+    ]
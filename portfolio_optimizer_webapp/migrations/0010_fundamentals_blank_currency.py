@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+def blank_currency(apps, schema_editor):
+    # Reports ingested without a currency were stored as NULL, which never conflicts on
+    # upsert, so re-ingesting them duplicated rows. Keep the last ingested of each and store
+    # the missing currency as '' like the ingestion now does
+    alias = schema_editor.connection.alias
+    Fundamentals = apps.get_model('portfolio_optimizer_webapp', 'Fundamentals')
+    rows = Fundamentals.objects.using(alias).filter(currency_code__isnull=True)\
+        .order_by('symbol_id', 'as_of_date', 'period_type', 'id')\
+        .values_list('id', 'symbol_id', 'as_of_date', 'period_type')
+
+    keep = {}
+    for pk, *key in rows:
+        keep[tuple(key)] = pk
+    Fundamentals.objects.using(alias).filter(currency_code__isnull=True).exclude(pk__in=keep.values()).delete()
+
+    # Reports that also exist with '' are the same report
+    blank = Fundamentals.objects.using(alias).filter(currency_code='')
+    blank = set(blank.values_list('symbol_id', 'as_of_date', 'period_type'))
+    duplicates = [pk for key, pk in keep.items() if key in blank]
+    Fundamentals.objects.using(alias).filter(pk__in=duplicates).delete()
+    Fundamentals.objects.using(alias).filter(currency_code__isnull=True).update(currency_code='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_optimizer_webapp', '0009_scenarios'),
+    ]
+
+    operations = [
+        migrations.RunPython(blank_currency, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio_optimizer_webapp', '0010_fundamentals_blank_currency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                ('key', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField()),
+                ('modified', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'cache_version',
+            },
+        ),
+    ]
@@ -1,44 +1,98 @@
+from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
-import pandas as pd
+from portfolio_optimizer_webapp.app_settings import get_setting
+from portfolio_optimizer_webapp.queries import latest_per_symbol
 import datetime
 
-# TODO Clean up the data fields to be more efficent (e.g., divide by million, as int, etc.
-#  Or at least convert int to IntegerFields. May cause issue with NAs?
-# TODO user-specific entries?
+def fiscal_years(dates, fiscal_year_end_month=12):
+    """
+    Vectorized fiscal year assignment, the year of the fiscal year end closest to each date.
+    fiscal_year_end_month can be a scalar or one month per date. Like the original per-date
+    search, candidates run from the year before the date up to last year and ties go to the
+    later year.
+    """
+    # pandas and numpy are only needed when reports are saved, not to load the models
+    import pandas as pd
+    import numpy as np
 
-def get_fiscal_year(date):
+    dates = pd.to_datetime(pd.Series(dates)).to_numpy().astype('datetime64[D]')
+    months = np.broadcast_to(np.asarray(fiscal_year_end_month, dtype=int), dates.shape)
+    years = dates.astype('datetime64[Y]').astype(int) + 1970
+
+    # Candidate years, latest first so argmin breaks ties towards the later year
+    candidates = years[:, None] + np.array([1, 0, -1])
+    # Last day of the fiscal year end month, i.e. the first of the next month minus a day
+    next_month = ((candidates - 1970) * 12 + months[:, None]).astype('datetime64[M]')
+    year_ends = next_month.astype('datetime64[D]') - np.timedelta64(1, 'D')
+
+    distance = np.abs((year_ends - dates[:, None]).astype(float))
+    distance[:, :2][candidates[:, :2] > datetime.date.today().year - 1] = np.inf
+
+    return candidates[np.arange(len(dates)), distance.argmin(axis=1)]
+
+
+def get_fiscal_year(date, fiscal_year_end_month=12):
     assert date
-    # Add fiscal year
-    the_date = pd.to_datetime(date)
-    fy_dates = {x: pd.to_datetime(f"{x}-12-31") for x in range(the_date.year - 1, datetime.date.today().year)}
-    # get all differences with date as values
-    cloz_dict = {abs(the_date.timestamp() - fydate.timestamp()): yr for yr, fydate in fy_dates.items()}
-    # extracting minimum key using min()
-    result = cloz_dict[min(cloz_dict.keys())]
-    return result
+    return int(fiscal_years([date], fiscal_year_end_month)[0])
+
+
+class PriceField(models.FloatField):
+    """
+    Float column for prices and ratios. Stored as double precision, or as single precision
+    (4 bytes) on PostgreSQL/MySQL with PORTFOLIO_OPTIMIZER_COMPACT_PRICES = True, which keeps
+    about 7 significant digits. The setting applies when the column is created, so set it
+    before running the migrations. SQLite stores every float as 8 bytes either way.
+    """
+
+    def db_type(self, connection):
+        if get_setting('COMPACT_PRICES', False):
+            if connection.vendor == 'postgresql':
+                return 'real'
+            if connection.vendor == 'mysql':
+                return 'float'
+        return super().db_type(connection)
 
 
 class DataSettings(models.Model):
-    
+    # One scenario: a user's named settings, shared by everyone when there is no user
+
     class Meta:
         db_table = 'data_settings'
-    
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'name'], name='data_settings_user_name'),
+        ]
+
     OBJ_CHOICES = [
         ('max_sharpe', 'Maximum Sharpe Ratio'),
         ('min_volatility', 'Minimum Volatility'),
         ('max_quadratic_utility', 'Maximum Quadratic Utility')
     ]
+    COVARIANCE_CHOICES = [
+        ('sample', 'Sample'),
+        ('ledoit_wolf', 'Ledoit-Wolf Shrinkage'),
+        ('ewma', 'Exponentially Weighted'),
+        ('factor', 'Factor Model'),
+    ]
     ESTIMATION_CHOICES = [
         ('nn', 'Neural Net'),
         ('lm', 'Linear Regression')
     ]
+    ALLOCATION_CHOICES = [
+        ('largest_remainder', 'Largest Remainder'),
+        ('exact', 'Exact (Branch and Bound)'),
+    ]
 
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True,
+                             related_name='portfolio_scenarios')
+    name = models.CharField(default='Default', max_length=64)
     start_date = models.DateField(default=datetime.date(2010, 1, 1))
     investment_amount = models.FloatField(default=10000)
     FScore_threshold = models.IntegerField(default=6)
     objective = models.CharField(default='max_sharpe', choices=OBJ_CHOICES, max_length=24)
     estimation_method = models.CharField(default='max_sharpe', choices=ESTIMATION_CHOICES, max_length=16)
+    covariance_method = models.CharField(default='ledoit_wolf', choices=COVARIANCE_CHOICES, max_length=16)
+    allocation_method = models.CharField(default='largest_remainder', choices=ALLOCATION_CHOICES, max_length=24)
     l2_gamma = models.FloatField(default=2)
     risk_aversion = models.FloatField(
         default=1,
@@ -60,6 +114,10 @@ class SecurityList(models.Model):
     country = models.CharField(default=None, null=True)
     sector = models.CharField(default=None, null=True)
     industry = models.CharField(default=None, null=True)
+    fiscal_year_end_month = models.IntegerField(
+        default=12,
+        validators=[MinValueValidator(1), MaxValueValidator(12)],
+        )
     # logo_url = models.CharField(default=None, null=True, max_length=100)
     fulltime_employees = models.IntegerField(default=None, null=True)
     business_summary = models.TextField(default=None, null=True, max_length=10000)
@@ -77,21 +135,68 @@ class SecurityPrice(models.Model):
     
     symbol = models.ForeignKey(SecurityList, on_delete=models.CASCADE, db_column='symbol')
     date = models.DateField(null=False, default=None)
-    open = models.DecimalField(max_digits=16, decimal_places=6, default=None, null=True)
-    high = models.DecimalField(max_digits=16, decimal_places=6, default=None, null=True)
-    low = models.DecimalField(max_digits=16, decimal_places=6, default=None, null=True)
-    close = models.DecimalField(max_digits=16, decimal_places=6, default=None, null=True)
-    adjclose = models.DecimalField(max_digits=16, decimal_places=6, default=None, null=True)
-    dividends = models.DecimalField(max_digits=10, decimal_places=6, default=None, null=True)
+    open = PriceField(default=None, null=True)
+    high = PriceField(default=None, null=True)
+    low = PriceField(default=None, null=True)
+    close = PriceField(default=None, null=True)
+    adjclose = PriceField(default=None, null=True)
+    dividends = PriceField(default=None, null=True)
     splits = models.BigIntegerField(default=None, null=True)
     volume = models.BigIntegerField(default=None, null=True)
 
 
+class PriceRollup(models.Model):
+    """
+    Close price statistics of a symbol per year, quarter or month, kept up to date by the
+    ingestion (see rollup.py). m2 is the sum of squared deviations from the mean, so
+    periods merge with new prices without rereading the daily rows.
+    """
+
+    class Meta:
+        db_table = 'price_rollup'
+        unique_together = ('symbol', 'period', 'period_start')
+
+    PERIOD_CHOICES = [
+        ('Y', 'Year'),
+        ('Q', 'Quarter'),
+        ('M', 'Month'),
+    ]
+
+    symbol = models.ForeignKey(SecurityList, on_delete=models.CASCADE, db_column='symbol')
+    period = models.CharField(max_length=1, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    first_date = models.DateField()
+    last_date = models.DateField()
+    last_close = PriceField(default=None, null=True)
+    count = models.IntegerField(default=0)
+    mean = models.FloatField(default=None, null=True)
+    m2 = models.FloatField(default=0)
+    volume = models.BigIntegerField(default=0)
+
+    @property
+    def variance(self):
+        # Sample variance, as pandas and polars compute it
+        return self.m2 / (self.count - 1) if self.count > 1 else None
+
+
+class FundamentalsQuerySet(models.QuerySet):
+
+    def latest_per_symbol(self):
+        # Latest report per symbol, served by the (symbol, as_of_date) index
+        return latest_per_symbol(self, 'as_of_date')
+
+
 class Fundamentals(models.Model):
     
     class Meta:
         db_table = 'fundamentals'
         unique_together = ('symbol', 'as_of_date', 'period_type', 'currency_code')
+        indexes = [
+            # Serves the latest-per-symbol pick without sorting the table
+            models.Index(fields=['symbol', '-as_of_date'], name='fundamentals_latest_idx'),
+        ]
+
+    objects = FundamentalsQuerySet.as_manager()
         
     symbol = models.ForeignKey(SecurityList, on_delete=models.CASCADE, db_column='symbol')
     as_of_date = models.DateField()
@@ -110,28 +215,31 @@ class Fundamentals(models.Model):
     total_revenue = models.BigIntegerField(default=None, null=True)
     currency_code = models.CharField(default=None, null=True, max_length=3)
     enterprise_value = models.BigIntegerField(default=None, null=True)
-    enterprises_value_ebitda_ratio = models.DecimalField(max_digits=16, default=None, null=True, decimal_places=6)
-    enterprises_value_revenue_ratio = models.DecimalField(max_digits=16, default=None, null=True, decimal_places=6)
-    forward_pe_ratio = models.DecimalField(max_digits=16, default=None, null=True, decimal_places=6)
+    enterprises_value_ebitda_ratio = PriceField(default=None, null=True)
+    enterprises_value_revenue_ratio = PriceField(default=None, null=True)
+    forward_pe_ratio = PriceField(default=None, null=True)
     market_cap = models.BigIntegerField(default=None, null=True)
-    pb_ratio = models.DecimalField(max_digits=16, default=None, null=True, decimal_places=6)
-    pe_ratio = models.DecimalField(max_digits=16, default=None, null=True, decimal_places=6)
-    peg_ratio = models.DecimalField(max_digits=16, default=None, null=True, decimal_places=6)
-    ps_ratio = models.DecimalField(max_digits=16, default=None, null=True, decimal_places=6)
+    pb_ratio = PriceField(default=None, null=True)
+    pe_ratio = PriceField(default=None, null=True)
+    peg_ratio = PriceField(default=None, null=True)
+    ps_ratio = PriceField(default=None, null=True)
 
     def save(self, *args, **kwargs):
-        self.fiscal_year = get_fiscal_year(self.as_of_date)
+        self.year = get_fiscal_year(self.as_of_date, self.symbol.fiscal_year_end_month)
         super(Fundamentals, self).save(*args, **kwargs)
 
 
 class Portfolio(models.Model):
-    
+    # Holdings of a scenario
+
     class Meta:
         db_table = 'portfolio'
+        unique_together = ('scenario', 'symbol')
 
+    scenario = models.ForeignKey(DataSettings, on_delete=models.CASCADE, related_name='holdings')
     symbol = models.ForeignKey(SecurityList, on_delete=models.CASCADE, db_column='symbol')
-    fundamentals = models.OneToOneField(Fundamentals, on_delete=models.CASCADE, primary_key=True)
-    allocation = models.DecimalField(max_digits=10, decimal_places=6)
+    fundamentals = models.ForeignKey(Fundamentals, on_delete=models.CASCADE)
+    allocation = models.FloatField()
     shares = models.IntegerField()
 
 
@@ -167,7 +275,56 @@ class ExpectedReturns(models.Model):
     fundamentals = models.OneToOneField(Fundamentals, on_delete=models.CASCADE, primary_key=True)    
     symbol = models.ForeignKey(SecurityList, on_delete=models.CASCADE, db_column='symbol')
     # date = models.DateField()
-    last_close = models.DecimalField(max_digits=16, decimal_places=6)
-    forecasted_close = models.DecimalField(max_digits=16, decimal_places=6)
-    expected_return = models.DecimalField(max_digits=16, decimal_places=6)
+    last_close = PriceField()
+    forecasted_close = PriceField()
+    expected_return = models.FloatField()
     variance = models.FloatField(default=None, null=True)
+
+
+class Job(models.Model):
+
+    class Meta:
+        db_table = 'job'
+        constraints = [
+            # At most one queued or running job per kind and parameters
+            models.UniqueConstraint(fields=['dedup_key'], condition=models.Q(status__in=['queued', 'running']),
+                                    name='job_active_dedup'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'created'], name='job_status_idx'),
+        ]
+
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    ACTIVE = ['queued', 'running']
+
+    kind = models.CharField(max_length=24)
+    params = models.JSONField(default=dict)
+    dedup_key = models.CharField(max_length=64)
+    status = models.CharField(default='queued', choices=STATUS_CHOICES, max_length=8)
+    progress = models.FloatField(default=0)
+    message = models.CharField(default='', blank=True, max_length=200)
+    result = models.JSONField(default=None, null=True)
+    error = models.TextField(default='', blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(default=None, null=True)
+    finished = models.DateTimeField(default=None, null=True)
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk} ({self.status})'
+
+
+class CacheVersion(models.Model):
+    # Version counters of the caches (render generation, data version), kept in the database
+    # so web and job worker processes see the same ones
+
+    class Meta:
+        db_table = 'cache_version'
+
+    key = models.CharField(max_length=32, primary_key=True)
+    value = models.BigIntegerField()
+    modified = models.DateTimeField()
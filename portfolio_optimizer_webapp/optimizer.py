@@ -0,0 +1,229 @@
+from portfolio_optimizer_webapp.allocation import TIME_BUDGET, allocate
+from portfolio_optimizer_webapp.app_settings import get_setting
+from portfolio_optimizer_webapp.covariance import get_covariance
+from portfolio_optimizer_webapp.models import DataSettings, Portfolio
+from portfolio_optimizer_webapp.rendercache import bump_generation
+from portfolio_optimizer_webapp.returns import get_returns_matrix
+from collections import OrderedDict
+from django.db import transaction
+import pandas as pd
+import numpy as np
+
+# Long-only, fully invested mean-variance optimization. Every objective is solved by
+# accelerated projected gradient on the simplex, which warm-starts from the scenario's
+# saved holdings and only needs the covariance and its largest eigenvalue (the step size).
+# Both are read from storage every process sees (the Portfolio rows and the covariance
+# store), optimize jobs run in worker processes of their own.
+
+RISK_FREE_RATE = 0.02
+
+
+class LRUCache(OrderedDict):
+
+    def __init__(self, maxsize=16):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def put(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+        return value
+
+
+class CovarianceModel:
+    """
+    Annualized covariance of a universe with its eigendecomposition, cached per
+    (universe, window) so repeated solves skip both the estimate and the factorization.
+    """
+
+    def __init__(self, symbols, cov):
+        self.symbols = list(symbols)
+        self.cov = cov
+        self.eigvals, self.eigvecs = np.linalg.eigh(cov)
+
+    @property
+    def max_eigval(self):
+        return max(self.eigvals[-1], 0.0)
+
+
+# Decompositions of the stored covariances, per process
+covariance_cache = LRUCache(maxsize=16)
+
+
+def get_covariance_model(symbols, start=None, method='ledoit_wolf'):
+    returns_matrix = get_returns_matrix()
+    returns_matrix.update(symbols)
+    # The last materialized date versions the cache entry, new prices mean a new estimate
+    close = returns_matrix.read('close')
+    last_date = None if close is None else close['date'].max()
+
+    key = (tuple(symbols), start, method, last_date)
+    model = covariance_cache.get(key)
+    if model is None:
+        model = covariance_cache.put(key, CovarianceModel(symbols, get_covariance(symbols, method, start)))
+    return model
+
+
+def project_simplex(v):
+    # Euclidean projection onto {w >= 0, sum(w) = 1} (Duchi et al., 2008)
+    u = np.sort(v)[::-1]
+    css = np.cumsum(u) - 1
+    rho = np.nonzero(u * np.arange(1, len(v) + 1) > css)[0][-1]
+    return np.maximum(v - css[rho] / (rho + 1), 0)
+
+
+def solve_qp(mu, model, risk_aversion, l2_gamma=0.0, w0=None, tol=1e-10, max_iter=20000):
+    """
+    Minimize (risk_aversion / 2) w'Cw - mu'w + l2_gamma ||w||^2 over the simplex with
+    FISTA and adaptive restart. Set mu to zeros for minimum volatility.
+    """
+    n = len(mu)
+    cov = model.cov
+    step = 1 / (risk_aversion * model.max_eigval + 2 * l2_gamma + 1e-12)
+
+    w = project_simplex(np.full(n, 1 / n) if w0 is None else np.asarray(w0, dtype=float))
+    y, t = w.copy(), 1.0
+    for _ in range(max_iter):
+        grad = risk_aversion * (cov @ y) - mu + 2 * l2_gamma * y
+        w_next = project_simplex(y - step * grad)
+        if np.abs(w_next - w).max() < tol:
+            return w_next
+
+        # Restart the momentum when it stops helping
+        if (y - w_next) @ (w_next - w) > 0:
+            t = 1.0
+        t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+        y = w_next + (t - 1) / t_next * (w_next - w)
+        w, t = w_next, t_next
+
+    return w
+
+
+def sharpe_ratio(w, mu, cov, risk_free_rate=RISK_FREE_RATE):
+    vol = np.sqrt(max(w @ cov @ w, 0))
+    return (w @ mu - risk_free_rate) / vol if vol > 0 else -np.inf
+
+
+def solve_max_sharpe(mu, model, l2_gamma=0.0, w0=None, risk_free_rate=RISK_FREE_RATE, tol=1e-3):
+    # The tangency portfolio lies on the quadratic utility frontier, golden-section search
+    # over log risk aversion with every solve warm-started from the last one
+    ratio = (np.sqrt(5) - 1) / 2
+    lo, hi = np.log(1e-3), np.log(1e3)
+    w = w0
+
+    def evaluate(log_delta):
+        nonlocal w
+        w = solve_qp(mu, model, np.exp(log_delta), l2_gamma, w)
+        return sharpe_ratio(w, mu, model.cov, risk_free_rate), w
+
+    a, b = hi - ratio * (hi - lo), lo + ratio * (hi - lo)
+    (fa, wa), (fb, wb) = evaluate(a), evaluate(b)
+    while hi - lo > tol:
+        if fa > fb:
+            hi, b, fb, wb = b, a, fa, wa
+            a = hi - ratio * (hi - lo)
+            fa, wa = evaluate(a)
+        else:
+            lo, a, fa, wa = a, b, fb, wb
+            b = lo + ratio * (hi - lo)
+            fb, wb = evaluate(b)
+
+    return wa if fa > fb else wb
+
+
+def solve(mu, model, objective='max_sharpe', risk_aversion=1.0, l2_gamma=0.0, w0=None):
+    mu = np.asarray(mu, dtype=float)
+    if objective == 'min_volatility':
+        # Scaled by 2 so the objective is w'Cw + l2_gamma ||w||^2
+        return solve_qp(np.zeros_like(mu), model, 2.0, l2_gamma, w0)
+    if objective == 'max_quadratic_utility':
+        return solve_qp(mu, model, risk_aversion, l2_gamma, w0)
+    if objective == 'max_sharpe':
+        return solve_max_sharpe(mu, model, l2_gamma, w0)
+    raise ValueError(f'Unknown objective {objective}')
+
+
+def warm_start(symbols, scenario=None):
+    # The scenario's saved weights of the overlapping symbols, renormalized
+    if scenario is None:
+        return None
+    previous = dict(Portfolio.objects.filter(scenario_id=scenario).values_list('symbol_id', 'allocation'))
+    if not previous:
+        return None
+    w0 = pd.Series(previous, dtype=float).reindex(symbols).fillna(0).to_numpy()
+    return w0 / w0.sum() if w0.sum() > 0 else None
+
+
+def clean_weights(w, cutoff=1e-4):
+    w = np.where(w < cutoff, 0, w)
+    return w / w.sum()
+
+
+def get_universe(data_settings, estimate=True):
+    # Latest expected returns of symbols passing the F-score threshold, both shared by every
+    # scenario. Without estimate, empty until the returns have been estimated
+    from portfolio_optimizer_webapp.estimation import get_expected_returns
+    from portfolio_optimizer_webapp.screening import passing
+
+    columns = ['symbol_id', 'fundamentals_id', 'last_close', 'expected_return']
+    expected = get_expected_returns(data_settings.estimation_method, estimate)
+    if expected is None:
+        return pd.DataFrame(columns=columns).set_index('symbol_id')
+    expected = expected.reindex(columns=columns)
+    df = expected[expected.symbol_id.isin(passing(data_settings.FScore_threshold))]
+    return df.sort_values('symbol_id').set_index('symbol_id')
+
+
+def optimize(data_settings=None, save=True):
+    """
+    Optimize the portfolio for the data settings (a scenario) and store it as the scenario's
+    holdings in Portfolio. Returns the weights as a Series indexed by symbol and the whole
+    share allocation summary of save_portfolio (None if not saved).
+    """
+    if data_settings is None:
+        data_settings = DataSettings.objects.first() or DataSettings()
+
+    universe = get_universe(data_settings)
+    if universe.empty:
+        return pd.Series(dtype=float), None
+
+    symbols = universe.index.to_list()
+    model = get_covariance_model(symbols, start=data_settings.start_date, method=data_settings.covariance_method)
+
+    w = solve(universe.expected_return.to_numpy(), model,
+              objective=data_settings.objective,
+              risk_aversion=data_settings.risk_aversion,
+              l2_gamma=data_settings.l2_gamma,
+              w0=warm_start(symbols, data_settings.pk))
+
+    weights = pd.Series(clean_weights(w), index=symbols)
+    allocation = save_portfolio(universe, weights, data_settings, model.cov) if save else None
+
+    return weights, allocation
+
+
+def save_portfolio(universe, weights, data_settings, cov=None):
+    # Whole shares at the latest closes as the scenario's holdings, returns the allocation summary
+    if data_settings.pk is None:
+        data_settings.save()
+    allocation = allocate(weights, data_settings.investment_amount, method=data_settings.allocation_method, cov=cov,
+                          time_budget=get_setting('ALLOCATION_TIME_BUDGET', TIME_BUDGET))
+    shares = allocation['shares']
+    objs = [
+        Portfolio(scenario_id=data_settings.pk, symbol_id=symbol, fundamentals_id=universe.fundamentals_id[symbol],
+                  allocation=round(weight, 6), shares=shares[symbol])
+        for symbol, weight in weights.items()
+    ]
+    with transaction.atomic():
+        Portfolio.objects.filter(scenario_id=data_settings.pk).delete()
+        Portfolio.objects.bulk_create(objs)
+    bump_generation(data=False)
+    return allocation
@@ -1,9 +1,18 @@
-from portfolio_optimizer_webapp.models import Portfolio, SecurityPrice#, Scores
+from portfolio_optimizer_webapp.models import DataSettings, Portfolio, Scores, SecurityList
+from portfolio_optimizer_webapp.frontier import get_frontier
+from portfolio_optimizer_webapp.instrumentation import frame_size, span
+from portfolio_optimizer_webapp.optimizer import LRUCache
+from portfolio_optimizer_webapp.rendercache import get_data_version, get_generation
+from portfolio_optimizer_webapp.returns import get_returns_matrix
+from portfolio_optimizer_webapp.rollup import yearly_rollup
+from portfolio_optimizer_webapp import analytics, downsample
+from django.urls import reverse
 import pandas as pd
+import numpy as np
 from io import BytesIO
 import base64
 
-import plotly.express as px
+import plotly.graph_objects as go
 from plotly.offline import plot
 
 pd.options.plotting.backend = "plotly"
@@ -12,105 +21,184 @@ pd.options.plotting.backend = "plotly"
 def calc_yield():
     pass
 
-def compare_ytd():
-    # Get portfolio
-    portfolio_qry = Portfolio.objects.filter(allocation__gt=0)
-    portfolio_df = pd.DataFrame(portfolio_qry.values('security_id', 'security__symbol', 'allocation'))
+def compare_series(scenario=None):
+    # Get the scenario's portfolio
+    with span('compare_ytd.query'):
+        portfolio_qry = Portfolio.objects.filter(scenario=scenario, allocation__gt=0)
+        portfolio_df = pd.DataFrame(portfolio_qry.values('symbol_id', 'allocation'))
 
     if portfolio_df.empty:
-        return
-
-    # Get symbols and IDs 
-    symbol_list = portfolio_df.security__symbol.to_list() + ['^GSPC']
-
-    # Get price data
-    prices_qry = SecurityPrice.objects.filter(security__symbol__in=symbol_list)
-    prices_df = pd.DataFrame(prices_qry.values('security_id', 'security__symbol', 'date', 'close'))
-
-    # calculate yield as % change since t=0
-    prices_df.sort_values(['security_id', 'date'], inplace=True)
-    prices_df.close = prices_df.close.astype(float)
+        return None
 
-    prices_grper = prices_df.groupby('security_id', group_keys=False)
-    
-    prices_df['cum_pct_chg'] = prices_grper.close.apply(lambda x: x.div(x.iloc[0]).subtract(1).mul(100))
+    # Get symbols
+    symbol_list = portfolio_df.symbol_id.to_list() + ['^GSPC']
 
-    # cast price to wide rows x cols = date x symbol
-    prices_wide = prices_df.pivot(index='date', columns='security__symbol', values='cum_pct_chg')
+    # Cumulative returns since t=0 from the materialized index levels, wide rows x cols = date x symbol
+    with span('compare_ytd.returns') as record:
+        returns_matrix = get_returns_matrix()
+        returns_matrix.update(symbol_list)
+        cum_pct_chg = returns_matrix.cumulative_returns(symbol_list)
+        frame_size(record, cum_pct_chg)
+    symbols = cum_pct_chg.columns[1:]
 
     # The weight vector
-    w = portfolio_df.set_index('security__symbol').allocation.astype(float).to_numpy()
+    portfolio_df = portfolio_df[portfolio_df.symbol_id.isin(symbols)]
+    w = portfolio_df.allocation.to_numpy()
 
     # dot product of yield and weight, sort columns to match the weight vector
-    folio_prices = prices_wide[portfolio_df.security__symbol].dot(w)
-    assert isinstance(folio_prices, pd.Series)
-
-    # SP500 Index
-    SPX_prices = prices_wide['^GSPC']
-
-    # compare df
-    compare_df = pd.concat([SPX_prices.to_frame('SP500'), folio_prices.to_frame('portfolio')], axis=1)
-    compare_df = compare_df.melt(ignore_index=False)
-
-    fig = px.line(compare_df.reset_index(), x="date", y="value", color="variable")
-    fig.layout.yaxis.tickformat = ',.0%'
+    folio_prices = cum_pct_chg.select(portfolio_df.symbol_id.to_list()).to_numpy() @ w
+    sp500 = cum_pct_chg['^GSPC'].to_numpy() if '^GSPC' in symbols else np.full(len(cum_pct_chg), np.nan)
+
+    return cum_pct_chg['date'].to_numpy(), ['SP500', 'portfolio'], np.column_stack([sp500, folio_prices])
+
+
+def cumulative_series(scenario=None):
+    # Cumulative return of every symbol since its first price
+    symbols = list(SecurityList.objects.values_list('symbol', flat=True))
+    returns_matrix = get_returns_matrix()
+    returns_matrix.update(symbols)
+    cum_pct_chg = returns_matrix.cumulative_returns(symbols)
+    if cum_pct_chg.is_empty():
+        return None
+    return cum_pct_chg['date'].to_numpy(), cum_pct_chg.columns[1:], cum_pct_chg.drop('date').to_numpy()
+
+
+# Line charts served downsampled to the visible range: the series, how to downsample them
+# (LTTB for a few lines, min/max buckets for many) and whether they depend on the scenario
+CHARTS = {
+    'compare': (compare_series, 'lttb', True),
+    'cumulative': (cumulative_series, 'minmax', False),
+}
+
+# Full resolution series per chart and data generation, kept in process rather than in the
+# render cache as they can run to megabytes
+series_cache = LRUCache(maxsize=8)
+
+
+def chart_data(name, start=None, end=None, points=downsample.POINTS, scenario=None):
+    """
+    Downsampled traces of a chart (of a scenario) between start and end, None if there is
+    nothing to plot. The full series are cached per data generation (data version for charts
+    shared by every scenario), so zooming only downsamples again.
+    """
+    series_func, method, per_scenario = CHARTS[name]
+    if per_scenario:
+        key = (name, getattr(scenario, 'pk', None), get_generation())
+    else:
+        scenario, key = None, (name, None, get_data_version())
+    series = series_cache.get(key)
+    if series is None:
+        series = series_cache.put(key, series_func(scenario) or ())
+    if not series:
+        return None
+    return downsample.traces(*series, start=start, end=end, points=points, method=method)
+
+
+def line_chart(name, trace_type=go.Scatter, scenario=None):
+    # Plotly div of a chart at the default resolution, refetched by base.js on zoom
+    data = chart_data(name, scenario=scenario)
+    if data is None:
+        return
 
-    return plot(fig, output_type='div')
+    with span(f'{name}.plot'):
+        fig = go.Figure([trace_type(x=x['x'], y=x['y'], name=x['name'], mode='lines') for x in data])
+        fig.layout.yaxis.tickformat = ',.0%'
 
+        # plotly.js is loaded once from static files by the template
+        div = plot(fig, output_type='div', include_plotlyjs=False)
+    url = reverse("portfolio-optimizer-chart-data", args=[name])
+    if scenario is not None and CHARTS[name][2]:
+        url += f'?scenario={scenario.pk}'
+    return f'<div data-chart-url="{url}">{div}</div>'
 
-def get_analysis_data():
-    score_cols = ['security_id', 'date', 'security__symbol', 'fiscal_year',
-                  'pf_score', 'pf_score_weighted', 'eps', 'pe_ratio', 'roa', 'cash', 'cash_ratio',
-                  'delta_cash', 'delta_roa', 'accruals', 'delta_long_lev_ratio',
-                  'delta_current_lev_ratio', 'delta_shares', 'delta_gross_margin', 'delta_asset_turnover']
 
-    # financials = models.Fundamentals.objects.all().values('security_id', 'date')
-    prices_qry = SecurityPrice.objects.all().values('security_id', 'date', 'close')
-    scores_qry = Scores.objects.all().values(*score_cols)
+def compare_ytd(scenario=None):
+    # Portfolio of a scenario against the S&P 500
+    return line_chart('compare', scenario=scenario)
 
-    # As dataframe
-    # financials = pd.DataFrame(financials)
-    prices = pd.DataFrame(prices_qry)
-    df = pd.DataFrame(scores_qry).rename(columns={'security__fundamentals__fiscal_year': 'year'})
 
-    pd.DataFrame(Scores.objects.all().values('security_id', 'date', 'security__fundamentals__fiscal_year'))
+def plot_cumulative():
+    # One WebGL line per symbol
+    return line_chart('cumulative', go.Scattergl)
 
-    # Aggregate price data annually
-    prices.close = prices.close.astype(float)
-    prices.date = pd.to_datetime(prices.date)
 
-    col_names = {'date': 'year', 'last': 'yearly_close', 'var': 'variance'}
-    prices_year = prices.groupby([prices.date.dt.year, 'security_id']).close\
-        .agg(['last', 'mean', 'var']).reset_index()\
-        .rename(columns=col_names)
+def plot_frontier(scenario=None):
+    # Efficient frontier of a scenario's universe, with each asset and its portfolio
+    data_settings = scenario or DataSettings()
+    frontier = get_frontier(data_settings)
+    if frontier is None:
+        return
 
-    # Add year and merge prices
-    df.date = pd.to_datetime(df.date)
-    df.rename(columns={'fiscal_year': 'year'}, inplace=True)
-    df = df.merge(prices_year, on=['security_id', 'year'])
+    points, assets = frontier['points'], frontier['assets']
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=points.volatility, y=points['return'], mode='lines', name='Efficient frontier'))
+    fig.add_trace(go.Scatter(x=assets.volatility, y=assets['return'], mode='markers', name='Assets',
+                             text=assets.index, marker={'size': 5, 'opacity': 0.6}))
 
-    # df.yearly_close = df.yearly_close.astype(float)
-    df.pe_ratio = df.pe_ratio.astype(float)
-    df = df.sort_values(['security_id', 'date'])
+    allocation = dict(Portfolio.objects.filter(scenario=scenario).values_list('symbol_id', 'allocation'))
+    if allocation:
+        w = assets.index.map(lambda x: allocation.get(x, 0.0)).to_numpy()
+        vol = np.sqrt(max(w @ frontier['cov'] @ w, 0))
+        fig.add_trace(go.Scatter(x=[vol], y=[w @ assets['return'].to_numpy()], mode='markers',
+                                 name='Portfolio', marker={'size': 12, 'symbol': 'star'}))
 
-    return df
+    fig.layout.xaxis.tickformat = ',.0%'
+    fig.layout.yaxis.tickformat = ',.0%'
+    fig.update_layout(xaxis_title='Volatility', yaxis_title='Expected return')
 
+    return plot(fig, output_type='div', include_plotlyjs=False)
 
-def create_plots(plot_data=None):
-    if not plot_data:
-        plot_data = get_analysis_data()
-    df = plot_data
 
-    plots = {}
-    # plots['pct_date'] = sns.lineplot(data=df.dropna(), x="date", y="pct_chg", hue="security_id")
-    # plots = {k: encode_plot(v) for k, v in plots.items()}
+def get_analysis_data():
+    if analytics.get_backend() == 'polars':
+        with span('get_analysis_data.polars') as record:
+            df = analytics.get_analysis_data()
+            frame_size(record, df)
+        return df
+
+    score_cols = {'symbol_id': 'symbol',
+                  'fundamentals_id': 'fundamentals_id',
+                  'fundamentals__as_of_date': 'date',
+                  'fundamentals__year': 'year',
+                  'fundamentals__pe_ratio': 'pe_ratio',
+                  'fundamentals__cash_and_cash_equivalents': 'cash',
+                  'pf_score': 'pf_score',
+                  'pf_score_weighted': 'pf_score_weighted',
+                  'eps': 'eps',
+                  'roa': 'roa',
+                  'cash_ratio': 'cash_ratio',
+                  'delta_cash': 'delta_cash',
+                  'delta_roa': 'delta_roa',
+                  'accruals': 'accruals',
+                  'delta_long_lev_ratio': 'delta_long_lev_ratio',
+                  'delta_current_lev_ratio': 'delta_current_lev_ratio',
+                  'delta_shares': 'delta_shares',
+                  'delta_gross_margin': 'delta_gross_margin',
+                  'delta_asset_turnover': 'delta_asset_turnover'}
+
+    with span('get_analysis_data.scores') as record:
+        scores_qry = Scores.objects.all().values(*score_cols)
+        df = pd.DataFrame(scores_qry, columns=list(score_cols)).rename(columns=score_cols)
+        frame_size(record, df)
+
+    # Annual price statistics from the rollup table
+    with span('get_analysis_data.prices') as record:
+        prices_year = yearly_rollup()
+        frame_size(record, prices_year)
+
+    # Merge prices, only for the scored symbols
+    with span('get_analysis_data.merge') as record:
+        df.date = pd.to_datetime(df.date)
+        df = df.merge(prices_year, on=['symbol', 'year'])
+
+        df = df.sort_values(['symbol', 'date'])
+        frame_size(record, df)
 
-    # plots['pct_date'] = df.plot.scatter(x="date", y="pct_chg")
-    plots['pct_date'] = px.line(df, x="date", y="cum_pct_chg", color="security_id")
+    return df
 
-    plots = {k: plot(fig, output_type="div") for k, fig in plots.items()}
 
-    return plots
+def create_plots():
+    return {'pct_date': plot_cumulative()}
 
 def encode_plot(plot):
     plot_file = BytesIO()
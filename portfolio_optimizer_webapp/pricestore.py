@@ -0,0 +1,118 @@
+from portfolio_optimizer_webapp.app_settings import cache_dir, temp_path
+from portfolio_optimizer_webapp.models import SecurityPrice
+from django.db.models import Q
+from urllib.parse import quote
+from pathlib import Path
+import polars as pl
+import pandas as pd
+import functools
+import os
+
+# Columnar price cache. Each symbol's history lives in its own Parquet file of float64
+# columns which is memory-mapped on read.
+# The ORM is only queried for rows newer than the last cached date of each symbol.
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'adjclose', 'volume']
+PRICE_SCHEMA = {'date': pl.Date, **{col: pl.Float64 for col in PRICE_COLUMNS}}
+
+
+class PriceStore:
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root else cache_dir('prices')
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, symbol):
+        # Symbols such as ^GSPC or BRK.B need quoting to be safe file names
+        return self.root / f"{quote(symbol, safe='')}.parquet"
+
+    def read(self, symbol):
+        path = self.path(symbol)
+        if not path.exists():
+            return None
+        return pl.read_parquet(path, memory_map=True)
+
+    def last_date(self, symbol):
+        path = self.path(symbol)
+        if not path.exists():
+            return None
+        return pl.scan_parquet(path).select(pl.col('date').max()).collect().item()
+
+    def write(self, symbol, df):
+        # Write to a temporary file first so readers never see a partial file
+        path = self.path(symbol)
+        tmp_path = temp_path(path)
+        df.select(*PRICE_SCHEMA).write_parquet(tmp_path)
+        os.replace(tmp_path, path)
+
+    def invalidate(self, symbol):
+        self.path(symbol).unlink(missing_ok=True)
+
+    def fetch(self, query):
+        rows = SecurityPrice.objects.filter(query)\
+            .order_by('symbol_id', 'date')\
+            .values_list('symbol_id', 'date', *PRICE_COLUMNS)
+
+        return pl.DataFrame(list(rows), schema={'symbol': pl.String, **PRICE_SCHEMA}, orient='row')
+
+    def append(self, delta):
+        # Append a long frame of new rows [symbol, date, *PRICE_COLUMNS] to the cache
+        for (symbol,), rows in delta.group_by('symbol', maintain_order=True):
+            rows = rows.drop('symbol')
+            cached = self.read(symbol)
+            if cached is not None:
+                rows = pl.concat([cached, rows]).unique('date', keep='last')
+            self.write(symbol, rows.sort('date'))
+
+    def sync(self, symbols):
+        # Group symbols by their last cached date, so the ORM delta is one query. No symbols
+        # would be an empty filter, i.e. the whole table
+        if not symbols:
+            return
+
+        by_last_date = {}
+        for symbol in symbols:
+            by_last_date.setdefault(self.last_date(symbol), []).append(symbol)
+
+        query = Q()
+        for last_date, group in by_last_date.items():
+            condition = Q(symbol_id__in=group)
+            if last_date is not None:
+                condition &= Q(date__gt=last_date)
+            query |= condition
+
+        delta = self.fetch(query)
+        if not delta.is_empty():
+            self.append(delta)
+
+    def load(self, symbols, columns=('close',), start=None, end=None):
+        # Long frame [symbol, date, *columns] for the requested symbols
+        symbols = list(dict.fromkeys(symbols))
+        self.sync(symbols)
+
+        frames = []
+        for symbol in symbols:
+            df = self.read(symbol)
+            if df is None:
+                continue
+            if start is not None:
+                df = df.filter(pl.col('date') >= start)
+            if end is not None:
+                df = df.filter(pl.col('date') <= end)
+            frames.append(df.select(pl.lit(symbol).alias('symbol'), 'date', *columns))
+
+        if not frames:
+            schema = {'symbol': pl.String, 'date': pl.Date, **{col: pl.Float64 for col in columns}}
+            return pl.DataFrame(schema=schema)
+
+        return pl.concat(frames)
+
+
+@functools.cache
+def get_price_store():
+    return PriceStore()
+
+
+def to_pandas(df):
+    # Build the pandas frame from the numpy views of each column (no pyarrow needed)
+    return pd.DataFrame({col: df[col].to_numpy() for col in df.columns})
@@ -0,0 +1,30 @@
+from django.db import connections
+from django.db.models import F, OuterRef, Subquery, Window
+from django.db.models.functions import RowNumber
+
+
+def latest_per_symbol(qry, date_field='fundamentals__as_of_date'):
+    """
+    Restrict a queryset to the most recent row per symbol, picked in the database with
+    DISTINCT ON on PostgreSQL and a ROW_NUMBER() window elsewhere (e.g., SQLite). The pick
+    is a subquery on the primary key, so filters chained afterwards apply to the latest rows
+    rather than changing which row is the latest.
+    """
+    if connections[qry.db].vendor == 'postgresql':
+        latest = qry.order_by('symbol', f'-{date_field}').distinct('symbol')
+    else:
+        latest = qry.annotate(row_number=Window(
+            expression=RowNumber(),
+            partition_by=F('symbol'),
+            order_by=F(date_field).desc(),
+        )).filter(row_number=1)
+
+    return qry.model.objects.using(qry.db).filter(pk__in=latest.values('pk'))
+
+
+def with_holdings(qry, scenario, fields=('allocation', 'shares')):
+    # Annotate rows keyed by a fundamentals report with the scenario's holding of it, None if not held
+    from portfolio_optimizer_webapp.models import Portfolio
+
+    holdings = Portfolio.objects.filter(scenario=scenario, fundamentals=OuterRef('fundamentals'))
+    return qry.annotate(**{x: Subquery(holdings.values(x)[:1]) for x in fields})
@@ -0,0 +1,81 @@
+from portfolio_optimizer_webapp.app_settings import get_setting
+from portfolio_optimizer_webapp.models import CacheVersion
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+import time
+
+# Versioned cache for rendered fragments (Plotly divs, the dashboard score table). Keys
+# embed a data generation counter that is bumped on every write to the underlying models,
+# so stale entries are never read again and age out of the cache backend's LRU eviction.
+#
+# Use a backend with LRU eviction, e.g. LocMemCache with MAX_ENTRIES, or Redis/Memcached:
+#   PORTFOLIO_OPTIMIZER_RENDER_CACHE = 'default'
+#
+# A second counter, the data version, only moves on writes to the market data (prices,
+# fundamentals, scores, securities) and not on per-scenario writes (settings, portfolios,
+# estimates), for caches shared by every scenario.
+#
+# The counters are rows of CacheVersion rather than cache entries, so a bump in a job worker
+# process reaches every web process whatever the cache backend.
+
+GENERATION_KEY = 'generation'
+DATA_VERSION_KEY = 'data_version'
+
+
+def get_cache():
+    return caches[get_setting('RENDER_CACHE', 'default')]
+
+
+def get_version(key):
+    version = CacheVersion.objects.filter(key=key).first()
+    if version is None:
+        # Seed from the clock, so entries cached against an earlier database can't be matched
+        version, _ = CacheVersion.objects.get_or_create(
+            key=key, defaults={'value': time.time_ns(), 'modified': timezone.now()})
+    return version
+
+
+def get_counter(key):
+    return get_version(key).value
+
+
+def bump_counter(key):
+    if not CacheVersion.objects.filter(key=key).update(value=F('value') + 1, modified=timezone.now()):
+        get_version(key)
+    return get_counter(key)
+
+
+def get_generation():
+    return get_counter(GENERATION_KEY)
+
+
+def get_data_version():
+    return get_counter(DATA_VERSION_KEY)
+
+
+def bump_generation(data=True):
+    # data=False for writes that don't change the market data, e.g. a scenario's portfolio
+    if data:
+        bump_counter(DATA_VERSION_KEY)
+    return bump_counter(GENERATION_KEY)
+
+
+def get_last_modified():
+    # Time of the last bump as a UTC datetime
+    return get_version(GENERATION_KEY).modified.replace(microsecond=0)
+
+
+_MISSING = object()
+
+
+def cached(name, func, *args, **kwargs):
+    # Return func(*args, **kwargs) from the cache for the current data generation
+    cache = get_cache()
+    key = f'portfolio_optimizer:{name}:{get_generation()}'
+    # A sentinel for misses, renders of None (nothing to plot yet) are cached like any other
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = func(*args, **kwargs)
+        cache.set(key, value, timeout=get_setting('RENDER_CACHE_TIMEOUT', 24 * 60 * 60))
+    return value
@@ -0,0 +1,195 @@
+from portfolio_optimizer_webapp.app_settings import cache_dir, temp_path
+from portfolio_optimizer_webapp.pricestore import get_price_store
+from pathlib import Path
+import polars as pl
+import numpy as np
+import functools
+import os
+
+# Materialized date x symbol matrices derived from the price store:
+#   close  - daily close
+#   simple - simple daily returns, close_t / close_t-1 - 1
+#   log    - log daily returns
+#   level  - cumulative index level, 1.0 at each symbol's first close
+# The matrices are kept as wide Parquet files (null for no value) and extended incrementally,
+# only the days after each symbol's last materialized close (and symbols never seen before)
+# are computed.
+
+MATRIX_KINDS = ['close', 'simple', 'log', 'level']
+
+
+def ffill_index(values):
+    # Row index of the last non-NaN value at or before each row, -1 if there is none
+    idx = np.where(np.isnan(values), -1, np.arange(values.shape[0])[:, None])
+    return np.maximum.accumulate(idx, axis=0)
+
+
+def compute_returns(close, prev_close=None, prev_level=None):
+    """
+    Compute simple/log returns and index levels from a T x N close matrix (NaN for no price).
+    prev_close and prev_level are the last known close and level before the first row, so
+    an incremental update continues exactly where the materialized matrix stopped.
+    """
+    n_cols = close.shape[1]
+    if prev_close is None:
+        prev_close = np.full(n_cols, np.nan)
+    if prev_level is None:
+        prev_level = np.full(n_cols, np.nan)
+
+    # Prepend the previous close and carry the last valid close forward
+    stacked = np.vstack([prev_close, close])
+    idx = ffill_index(stacked)
+    last_close = np.where(idx >= 0, stacked[np.maximum(idx, 0), np.arange(n_cols)], np.nan)
+
+    simple = close / last_close[:-1] - 1
+    log = np.log1p(simple)
+
+    # Levels compound the returns, missing days carry the level forward
+    seed = np.where(np.isnan(prev_level), 1.0, prev_level)
+    level = seed * np.cumprod(1 + np.nan_to_num(simple), axis=0)
+    level[np.isnan(last_close[1:])] = np.nan
+
+    return {'close': close, 'simple': simple, 'log': log, 'level': level}
+
+
+class ReturnsMatrix:
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root else cache_dir('returns')
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, kind):
+        return self.root / f'{kind}.parquet'
+
+    def read(self, kind):
+        path = self.path(kind)
+        if not path.exists():
+            return None
+        return pl.read_parquet(path, memory_map=True)
+
+    def write(self, frames):
+        for kind, df in frames.items():
+            tmp_path = temp_path(self.path(kind))
+            df.write_parquet(tmp_path)
+            os.replace(tmp_path, self.path(kind))
+
+    def symbols(self):
+        close = self.read('close')
+        return [] if close is None else [x for x in close.columns if x != 'date']
+
+    def invalidate(self, symbol=None):
+        # Drop one symbol's columns (recomputed on the next update) or the whole matrix
+        if symbol is None:
+            for kind in MATRIX_KINDS:
+                self.path(kind).unlink(missing_ok=True)
+            return
+
+        if symbol in self.symbols():
+            self.write({kind: self.read(kind).drop(symbol) for kind in MATRIX_KINDS})
+
+    def _to_frames(self, dates, symbols, matrices):
+        # NaN is stored as null, so drop_nulls() and joins see missing values alike
+        return {
+            kind: pl.DataFrame({'date': dates, **dict(zip(symbols, values.T))}).fill_nan(None)
+            for kind, values in matrices.items()
+        }
+
+    def _compute(self, symbols, start=None, previous=None):
+        # Returns for the symbols from the price store rows after start
+        prices = get_price_store().load(symbols, columns=['close'], start=start)
+        if start is not None:
+            prices = prices.filter(pl.col('date') > start)
+        if prices.is_empty():
+            return None
+
+        wide = prices.pivot(on='symbol', index='date', values='close').sort('date')
+        symbols = [x for x in symbols if x in wide.columns]
+        close = wide.select(symbols).to_numpy().astype(float)
+
+        prev_close, prev_level = None, None
+        if previous is not None:
+            prev_close = np.array([previous['close'][x] for x in symbols], dtype=float)
+            prev_level = np.array([previous['level'][x] for x in symbols], dtype=float)
+
+        matrices = compute_returns(close, prev_close, prev_level)
+        return self._to_frames(wide['date'], symbols, matrices)
+
+    def _last_valid(self, kind, symbols):
+        # Last valid value of each symbol, used to seed incremental updates
+        df = self.read(kind).select(symbols)
+        return df.select(pl.all().fill_nan(None).drop_nulls().last()).row(0, named=True)
+
+    def _last_dates(self, symbols):
+        # Date of each symbol's last valid close, None if it has none
+        close = self.read('close')
+        return close.select([
+            pl.col('date').filter(pl.col(x).fill_nan(None).is_not_null()).max().alias(x) for x in symbols
+        ]).row(0, named=True)
+
+    def update(self, symbols=()):
+        # Extend the matrix with new days for known symbols and full history for new ones
+        known = self.symbols()
+        new = [x for x in dict.fromkeys(symbols) if x not in known]
+
+        current = {kind: self.read(kind) for kind in MATRIX_KINDS} if known else None
+        changed = False
+
+        if known:
+            # Each symbol continues from its own last close, so one lagging behind the others
+            # has its gap filled rather than skipped. Symbols are grouped by that date
+            previous = {kind: self._last_valid(kind, known) for kind in ['close', 'level']}
+            by_last_date = {}
+            for symbol, last_date in self._last_dates(known).items():
+                by_last_date.setdefault(last_date, []).append(symbol)
+
+            for last_date, group in by_last_date.items():
+                tail = self._compute(group, start=last_date, previous=previous)
+                if tail is not None:
+                    changed = True
+                    current = {
+                        kind: current[kind].update(tail[kind], on='date', how='full').sort('date')
+                        for kind in MATRIX_KINDS
+                    }
+
+        if new:
+            added = self._compute(new)
+            if added is not None:
+                changed = True
+                if current is None:
+                    current = added
+                else:
+                    current = {
+                        kind: current[kind].join(added[kind], on='date', how='full', coalesce=True).sort('date')
+                        for kind in MATRIX_KINDS
+                    }
+
+        if changed:
+            # Levels carry forward over days added for other symbols, as in a full build
+            current['level'] = current['level'].with_columns(pl.exclude('date').forward_fill())
+            self.write(current)
+
+    def frame(self, kind, symbols=None, start=None, end=None):
+        # Wide date x symbol frame of one of the matrices
+        df = self.read(kind)
+        if df is None:
+            return pl.DataFrame(schema={'date': pl.Date})
+        if symbols is not None:
+            df = df.select('date', *[x for x in dict.fromkeys(symbols) if x in df.columns])
+        if start is not None:
+            df = df.filter(pl.col('date') >= start)
+        if end is not None:
+            df = df.filter(pl.col('date') <= end)
+        return df
+
+    def cumulative_returns(self, symbols, start=None, end=None):
+        # Cumulative return since the first row of the slice, from the index levels
+        levels = self.frame('level', symbols, start, end)
+        levels = levels.with_columns(pl.exclude('date').fill_nan(None))
+        return levels.select(
+            'date', *[(pl.col(x) / pl.col(x).drop_nulls().first() - 1).alias(x) for x in levels.columns[1:]]
+        )
+
+
+@functools.cache
+def get_returns_matrix():
+    return ReturnsMatrix()
@@ -0,0 +1,186 @@
+from portfolio_optimizer_webapp.models import PriceRollup, SecurityPrice
+import pandas as pd
+import numpy as np
+
+# Yearly, quarterly and monthly close statistics per symbol, stored in PriceRollup. Each
+# ingested chunk is summarized per period (count, mean, M2, last close, volume) and merged
+# into the stored rows with the pairwise form of Welford's update (Chan et al.), so a period
+# only ever reads its new prices. A chunk reaching back into a period's stored date range
+# (restated or backfilled history) can't be merged that way, that period is recomputed from
+# SecurityPrice instead.
+
+PERIODS = ['Y', 'Q', 'M']
+PERIOD_MONTHS = {'Y': 12, 'Q': 3, 'M': 1}
+STAT_FIELDS = ['first_date', 'last_date', 'last_close', 'count', 'mean', 'm2', 'volume']
+BATCH_SIZE = 5_000
+
+
+def period_starts(dates, period):
+    # First day of the year, quarter or month of each date
+    months = np.asarray(dates, dtype='datetime64[D]').astype('datetime64[M]').astype(int)
+    months = months // PERIOD_MONTHS[period] * PERIOD_MONTHS[period]
+    return months.astype('datetime64[M]').astype('datetime64[D]')
+
+
+def period_stats(df, periods=PERIODS):
+    """
+    Statistics of a frame of symbol, date, close and volume rows, one row per symbol,
+    period and period_start.
+    """
+    df = df[['symbol', 'date', 'close', 'volume']].sort_values(['symbol', 'date'])
+    df = df.assign(close=pd.to_numeric(df.close).astype(float),
+                   volume=pd.to_numeric(df.volume).astype(float).fillna(0))
+    frames = []
+    for period in periods:
+        grouped = df.assign(period_start=period_starts(df.date, period)).groupby(['symbol', 'period_start'])
+        count = grouped.close.count()
+        frames.append(pd.DataFrame({
+            'period': period,
+            'first_date': grouped.date.min(),
+            'last_date': grouped.date.max(),
+            'last_close': grouped.close.last(),
+            'count': count,
+            'mean': grouped.close.mean(),
+            'm2': (grouped.close.var(ddof=0) * count).fillna(0),
+            'volume': grouped.volume.sum(),
+        }).reset_index())
+
+    stats = pd.concat(frames, ignore_index=True)
+    stats['period_start'] = stats.period_start.dt.date
+    return stats
+
+
+def merge_stats(old, new):
+    # Combine the statistics of two runs of prices, new following old
+    n = old['count'] + new['count']
+    if old['count'] == 0 or new['count'] == 0:
+        mean, m2 = (new if old['count'] == 0 else old)['mean'], old['m2'] + new['m2']
+    else:
+        delta = new['mean'] - old['mean']
+        mean = old['mean'] + delta * new['count'] / n
+        m2 = old['m2'] + new['m2'] + delta ** 2 * old['count'] * new['count'] / n
+
+    return {
+        'first_date': old['first_date'],
+        'last_date': new['last_date'],
+        'last_close': old['last_close'] if new['last_close'] is None else new['last_close'],
+        'count': n,
+        'mean': mean,
+        'm2': m2,
+        'volume': old['volume'] + new['volume'],
+    }
+
+
+def as_fields(row):
+    # A period_stats row as model field values, NaN as None
+    return {
+        'first_date': row.first_date,
+        'last_date': row.last_date,
+        'last_close': None if pd.isna(row.last_close) else float(row.last_close),
+        'count': int(row.count),
+        'mean': None if pd.isna(row.mean) else float(row.mean),
+        'm2': float(row.m2),
+        'volume': int(row.volume),
+    }
+
+
+def save(rows):
+    # rows: {(symbol, period, period_start): fields}, inserted or overwritten
+    objs = [PriceRollup(symbol_id=symbol, period=period, period_start=start, **fields)
+            for (symbol, period, start), fields in rows.items()]
+    PriceRollup.objects.bulk_create(objs, batch_size=BATCH_SIZE, update_conflicts=True,
+                                    unique_fields=['symbol', 'period', 'period_start'], update_fields=STAT_FIELDS)
+
+
+def update_rollups(df):
+    """
+    Merge a chunk of price rows, already written to SecurityPrice, into the rollups.
+    """
+    if df.empty:
+        return
+
+    stats = period_stats(df)
+    stored = PriceRollup.objects.filter(symbol_id__in=stats.symbol.unique().tolist(),
+                                        period_start__gte=stats.period_start.min(),
+                                        period_start__lte=stats.period_start.max())
+    stored = {(x.symbol_id, x.period, x.period_start): {f: getattr(x, f) for f in STAT_FIELDS} for x in stored}
+
+    rows, stale = {}, []
+    for row in stats.itertuples(index=False):
+        key = (row.symbol, row.period, row.period_start)
+        old = stored.get(key)
+        if old is None:
+            rows[key] = as_fields(row)
+        elif row.first_date > old['last_date']:
+            rows[key] = merge_stats(old, as_fields(row))
+        else:
+            stale.append(key)
+
+    save(rows)
+    rebuild(stale)
+
+
+def load_prices(symbol, **filters):
+    rows = SecurityPrice.objects.filter(symbol_id=symbol, **filters).values_list('symbol_id', 'date', 'close', 'volume')
+    return pd.DataFrame(list(rows), columns=['symbol', 'date', 'close', 'volume'])
+
+
+def rebuild(keys):
+    """
+    Recompute (symbol, period, period_start) rollups from SecurityPrice, deleting those
+    left without prices.
+    """
+    by_symbol = {}
+    for symbol, period, start in keys:
+        by_symbol.setdefault(symbol, set()).add((period, start))
+
+    for symbol, periods in by_symbol.items():
+        first = min(start for _, start in periods)
+        end = max(np.datetime64(start, 'M') + PERIOD_MONTHS[period] for period, start in periods)
+        prices = load_prices(symbol, date__gte=first, date__lt=end.astype('datetime64[D]').item())
+
+        rows = {}
+        if not prices.empty:
+            for row in period_stats(prices, sorted({x for x, _ in periods})).itertuples(index=False):
+                if (row.period, row.period_start) in periods:
+                    rows[(symbol, row.period, row.period_start)] = as_fields(row)
+        save(rows)
+
+        empty = [x for x in periods if (symbol, *x) not in rows]
+        for period, start in empty:
+            PriceRollup.objects.filter(symbol_id=symbol, period=period, period_start=start).delete()
+
+
+def rebuild_rollups(symbols=None):
+    # Recompute every period of the symbols (all by default) from SecurityPrice
+    qry, stale = SecurityPrice.objects.all(), PriceRollup.objects.all()
+    if symbols is not None:
+        symbols = list(symbols)
+        qry, stale = qry.filter(symbol_id__in=symbols), stale.filter(symbol_id__in=symbols)
+    priced = list(qry.order_by().values_list('symbol_id', flat=True).distinct())
+    # Rollups of the symbols left without prices
+    stale.exclude(symbol_id__in=priced).delete()
+
+    for symbol in priced:
+        prices = load_prices(symbol)
+        PriceRollup.objects.filter(symbol_id=symbol).delete()
+        save({(row.symbol, row.period, row.period_start): as_fields(row) for row in period_stats(prices).itertuples(index=False)})
+
+
+def period_keys(symbol, date):
+    # The rollups a single price row belongs to
+    return [(symbol, period, period_starts([date], period)[0].item()) for period in PERIODS]
+
+
+def yearly_rollup():
+    """
+    Yearly close statistics of every symbol: symbol, year, yearly_close (the year's last
+    close), mean and (sample) variance.
+    """
+    rows = PriceRollup.objects.filter(period='Y').values_list('symbol_id', 'period_start', 'last_close',
+                                                              'mean', 'm2', 'count')
+    df = pd.DataFrame(list(rows), columns=['symbol', 'period_start', 'yearly_close', 'mean', 'm2', 'count'])
+    df['year'] = pd.to_datetime(df.period_start).dt.year.astype('int64')
+    df['variance'] = np.where(df['count'] > 1, df.m2 / (df['count'] - 1).clip(lower=1), np.nan)
+    return df[['symbol', 'year', 'yearly_close', 'mean', 'variance']].astype(
+        {'yearly_close': float, 'mean': float, 'variance': float})
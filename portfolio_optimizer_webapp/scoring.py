@@ -0,0 +1,145 @@
+from portfolio_optimizer_webapp.models import Fundamentals, Scores
+from portfolio_optimizer_webapp.rendercache import bump_generation
+import pandas as pd
+import numpy as np
+
+# Piotroski F-score engine. The whole fundamentals frame is scored at once: rows are sorted
+# per (symbol, period_type, currency_code) and lagged values come from a grouped shift.
+
+FUNDAMENTAL_FIELDS = ['id', 'symbol_id', 'as_of_date', 'period_type', 'currency_code',
+                      'net_income', 'total_assets', 'current_assets', 'current_liabilities',
+                      'total_liabilities_net_minority_interest', 'capital_stock',
+                      'cash_and_cash_equivalents', 'gross_profit', 'total_revenue']
+
+SCORE_FIELDS = ['roa', 'delta_cash', 'delta_roa', 'accruals', 'delta_long_lev_ratio',
+                'delta_current_lev_ratio', 'delta_shares', 'delta_gross_margin',
+                'delta_asset_turnover', 'cash_ratio', 'eps', 'book_value',
+                'pf_score', 'pf_score_weighted']
+
+GROUP_KEYS = ['symbol_id', 'period_type', 'currency_code']
+
+
+def load_fundamentals(symbols=None):
+    qry = Fundamentals.objects.all()
+    if symbols is not None:
+        qry = qry.filter(symbol_id__in=symbols)
+
+    df = pd.DataFrame(qry.values_list(*FUNDAMENTAL_FIELDS), columns=FUNDAMENTAL_FIELDS)
+    value_cols = FUNDAMENTAL_FIELDS[5:]
+    df[value_cols] = df[value_cols].astype(float)
+    return df
+
+
+def safe_div(a, b):
+    return a.div(b.where(b != 0))
+
+
+def calc_scores(df):
+    """
+    Score a frame of fundamentals, one row per report. Returns the Scores fields indexed
+    like the input. Components that can't be computed (e.g., no prior period) are NaN
+    and do not add to the F-score.
+    """
+    df = df.sort_values(GROUP_KEYS + ['as_of_date'])
+    # currency_code may be null, keep those rows in their own group
+    prev = df.groupby(GROUP_KEYS, dropna=False, sort=False).shift(1)
+
+    assets = df.total_assets
+    prev_assets = prev.total_assets.fillna(assets)
+    long_liabilities = df.total_liabilities_net_minority_interest - df.current_liabilities
+    prev_long_liabilities = prev.total_liabilities_net_minority_interest - prev.current_liabilities
+
+    out = pd.DataFrame(index=df.index)
+
+    # Profitability, the change in cash stands in for operating cash flow
+    out['roa'] = safe_div(df.net_income, prev_assets)
+    prev_roa = safe_div(prev.net_income, prev.total_assets)
+    out['delta_cash'] = safe_div(df.cash_and_cash_equivalents - prev.cash_and_cash_equivalents, prev_assets)
+    out['delta_roa'] = out.roa - prev_roa
+    out['accruals'] = out.roa - out.delta_cash
+
+    # Leverage, liquidity and source of funds
+    out['delta_long_lev_ratio'] = safe_div(long_liabilities, assets) - safe_div(prev_long_liabilities, prev.total_assets)
+    out['delta_current_lev_ratio'] = safe_div(df.current_assets, df.current_liabilities) \
+        - safe_div(prev.current_assets, prev.current_liabilities)
+    out['delta_shares'] = df.capital_stock - prev.capital_stock
+
+    # Operating efficiency
+    out['delta_gross_margin'] = safe_div(df.gross_profit, df.total_revenue) \
+        - safe_div(prev.gross_profit, prev.total_revenue)
+    out['delta_asset_turnover'] = safe_div(df.total_revenue, assets) - safe_div(prev.total_revenue, prev_assets)
+
+    # Other metrics, there is no share count to derive EPS from
+    out['cash_ratio'] = safe_div(df.cash_and_cash_equivalents, df.current_liabilities)
+    out['eps'] = np.nan
+    out['book_value'] = df.total_assets - df.total_liabilities_net_minority_interest
+
+    # The nine binary signals
+    signals = pd.DataFrame({
+        'roa': out.roa > 0,
+        'cfo': out.delta_cash > 0,
+        'delta_roa': out.delta_roa > 0,
+        'accruals': out.accruals < 0,
+        'delta_long_lev_ratio': out.delta_long_lev_ratio < 0,
+        'delta_current_lev_ratio': out.delta_current_lev_ratio > 0,
+        'delta_shares': out.delta_shares <= 0,
+        'delta_gross_margin': out.delta_gross_margin > 0,
+        'delta_asset_turnover': out.delta_asset_turnover > 0,
+    })
+    components = out[['roa', 'delta_cash', 'delta_roa', 'accruals', 'delta_long_lev_ratio',
+                      'delta_current_lev_ratio', 'delta_shares', 'delta_gross_margin',
+                      'delta_asset_turnover']]
+    available = components.notna().sum(axis=1)
+
+    out['pf_score'] = signals.sum(axis=1)
+    # Share of the available signals passed, so reports with missing components compare fairly
+    out['pf_score_weighted'] = out.pf_score / available.where(available > 0)
+
+    return out.loc[df.index]
+
+
+def affected_rows(df, changed_ids):
+    # The changed reports and the report right after each, whose deltas depend on them
+    df = df.sort_values(GROUP_KEYS + ['as_of_date'])
+    is_changed = df.id.isin(changed_ids)
+    follows_changed = is_changed.groupby([df[x] for x in GROUP_KEYS], dropna=False, sort=False).shift(1)
+    return df.index[is_changed | follows_changed.fillna(False).astype(bool)]
+
+
+def save_scores(df, scores, batch_size=1000):
+    records = scores.astype(object).where(scores.notna(), None)
+    records['fundamentals_id'] = df.loc[scores.index, 'id']
+    records['symbol_id'] = df.loc[scores.index, 'symbol_id']
+
+    objs = [Scores(**x) for x in records.to_dict('records')]
+    Scores.objects.bulk_create(
+        objs,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['fundamentals'],
+        update_fields=SCORE_FIELDS,
+    )
+    bump_generation()
+    return len(objs)
+
+
+def update_scores(fundamentals_ids=None, symbols=None):
+    """
+    Compute and upsert F-scores. With no arguments the whole universe is rescored,
+    otherwise only the given Fundamentals rows (and the rows whose deltas depend on
+    them) are recomputed, loading just the affected symbols.
+    """
+    if fundamentals_ids is not None:
+        fundamentals_ids = list(fundamentals_ids)
+        symbols = Fundamentals.objects.filter(id__in=fundamentals_ids)\
+            .values_list('symbol_id', flat=True).distinct()
+
+    df = load_fundamentals(None if symbols is None else list(symbols))
+    if df.empty:
+        return 0
+
+    scores = calc_scores(df)
+    if fundamentals_ids is not None:
+        scores = scores.loc[affected_rows(df, fundamentals_ids)]
+
+    return save_scores(df, scores)
@@ -0,0 +1,130 @@
+from portfolio_optimizer_webapp.models import Scores
+from portfolio_optimizer_webapp.optimizer import LRUCache
+from portfolio_optimizer_webapp.queries import latest_per_symbol
+from portfolio_optimizer_webapp.rendercache import get_data_version
+import pandas as pd
+import numpy as np
+import json
+
+# Screens over the latest F-score snapshot. A screen is a dict such as
+#   {'threshold': 7, 'sectors': ['Energy'], 'industries': [...], 'pe_ratio': [None, 20], 'pb_ratio': [0, 3]}
+# (every key optional, ranges inclusive, None for an open end). The snapshot is indexed once
+# per data version: a precomputed mask per score threshold, integer codes per sector and
+# industry, and the rank of each symbol in the sorted pe/pb ratios. Any number of screens is
+# then evaluated together as a few screens x symbols array operations, so each extra screen
+# costs a row of booleans rather than a query.
+
+MAX_SCORE = 9
+CATEGORIES = {'sectors': 'sector', 'industries': 'industry'}
+RANGES = ['pe_ratio', 'pb_ratio']
+SCREEN_KEYS = {'threshold', *CATEGORIES, *RANGES}
+
+index_cache = LRUCache(maxsize=2)
+screen_cache = LRUCache(maxsize=256)
+
+
+class ScoreIndex:
+
+    def __init__(self, df):
+        self.symbols = df.symbol.to_numpy()
+        n = len(df)
+
+        # at_least[t] is pf_score >= t, symbols without a score never pass
+        scores = np.nan_to_num(df.pf_score.to_numpy(dtype=float), nan=-1)
+        self.at_least = scores[None, :] >= np.arange(MAX_SCORE + 2)[:, None]
+
+        # Category codes, missing values get the last code
+        self.codes, self.categories = {}, {}
+        for field in CATEGORIES.values():
+            codes, uniques = pd.factorize(df[field])
+            self.categories[field] = {x: i for i, x in enumerate(uniques)}
+            self.codes[field] = np.where(codes < 0, len(uniques), codes)
+
+        # Sorted values and each symbol's rank among them, NaN sorts last
+        self.sorted, self.ranks, self.n_valid = {}, {}, {}
+        for field in RANGES:
+            values = df[field].to_numpy(dtype=float)
+            order = np.argsort(values, kind='stable')
+            self.sorted[field] = values[order]
+            self.ranks[field] = np.empty(n, dtype=int)
+            self.ranks[field][order] = np.arange(n)
+            self.n_valid[field] = int(np.isfinite(values).sum())
+
+    def masks(self, screens):
+        """
+        Screens x symbols boolean array, True where a symbol passes a screen.
+        """
+        for screen in screens:
+            unknown = set(screen) - SCREEN_KEYS
+            if unknown:
+                raise ValueError(f'Unknown screen criteria: {sorted(unknown)}')
+
+        thresholds = [screen.get('threshold') for screen in screens]
+        thresholds = np.clip([0 if x is None else int(x) for x in thresholds], 0, MAX_SCORE + 1)
+        mask = self.at_least[thresholds]
+
+        for key, field in CATEGORIES.items():
+            if not any(screen.get(key) for screen in screens):
+                continue
+            lookup = self.categories[field]
+            allowed = np.ones((len(screens), len(lookup) + 1), dtype=bool)
+            for i, screen in enumerate(screens):
+                if screen.get(key):
+                    allowed[i] = False
+                    allowed[i, [lookup[x] for x in screen[key] if x in lookup]] = True
+            mask &= allowed[:, self.codes[field]]
+
+        for field in RANGES:
+            if not any(screen.get(field) for screen in screens):
+                continue
+            # Rank bounds per screen, unfiltered screens keep every symbol including NaN
+            valid = self.sorted[field][:self.n_valid[field]]
+            lo = np.zeros(len(screens), dtype=int)
+            hi = np.full(len(screens), len(self.symbols))
+            for i, screen in enumerate(screens):
+                if screen.get(field):
+                    low, high = screen[field]
+                    lo[i] = 0 if low is None else np.searchsorted(valid, low, 'left')
+                    hi[i] = len(valid) if high is None else np.searchsorted(valid, high, 'right')
+            ranks = self.ranks[field]
+            mask &= (ranks[None, :] >= lo[:, None]) & (ranks[None, :] < hi[:, None])
+
+        return mask
+
+
+def load_snapshot():
+    fields = {'symbol_id': 'symbol',
+              'pf_score': 'pf_score',
+              'symbol__sector': 'sector',
+              'symbol__industry': 'industry',
+              'fundamentals__pe_ratio': 'pe_ratio',
+              'fundamentals__pb_ratio': 'pb_ratio'}
+    rows = latest_per_symbol(Scores.objects.all()).order_by('symbol_id').values_list(*fields)
+    return pd.DataFrame(list(rows), columns=list(fields.values()))
+
+
+def get_index():
+    # Index of the latest scores, built once per data version
+    version = get_data_version()
+    index = index_cache.get(version)
+    if index is None:
+        index = index_cache.put(version, ScoreIndex(load_snapshot()))
+    return index
+
+
+def run_screens(screens):
+    """
+    Symbols passing each screen, one list per screen in symbol order. Cached per data
+    version and set of screens.
+    """
+    key = (get_data_version(), json.dumps(screens, sort_keys=True))
+    result = screen_cache.get(key)
+    if result is None:
+        index = get_index()
+        result = screen_cache.put(key, [index.symbols[row].tolist() for row in index.masks(screens)])
+    return result
+
+
+def passing(threshold):
+    # Symbols whose latest F-score is at least threshold
+    return run_screens([{'threshold': threshold}])[0]
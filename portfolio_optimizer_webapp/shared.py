@@ -0,0 +1,106 @@
+from portfolio_optimizer_webapp.app_settings import cache_dir, temp_path
+from portfolio_optimizer_webapp.models import Fundamentals, Scores, SecurityList, SecurityPrice
+from portfolio_optimizer_webapp.optimizer import LRUCache
+from portfolio_optimizer_webapp.pricestore import to_pandas
+from portfolio_optimizer_webapp.rendercache import get_data_version
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max
+import functools
+import hashlib
+import polars as pl
+import json
+import os
+
+# Content-addressed cache of the intermediates every scenario shares. An entry's key is a
+# digest of what it is computed from, a fingerprint of the market data (row counts, latest
+# dates and keys, and the data version for edits in place) plus the parameters that matter
+# (e.g. the estimator), never of the scenario or user asking for it, so scenarios with the
+# same inputs reuse one computation and only their own optimization runs per scenario.
+# Entries are kept in memory and as Parquet files, shared by the web and job worker processes.
+# Nothing is pickled, so reading an entry back can't run code.
+
+fingerprint_cache = LRUCache(maxsize=4)
+
+
+def digest(kind, **params):
+    text = json.dumps([kind, params], sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def data_fingerprint():
+    # Summary of the market data tables, computed once per data version
+    version = get_data_version()
+    fingerprint = fingerprint_cache.get(version)
+    if fingerprint is None:
+        fingerprint = fingerprint_cache.put(version, {
+            'data_version': version,
+            'prices': SecurityPrice.objects.aggregate(rows=Count('pk'), last=Max('date')),
+            'fundamentals': Fundamentals.objects.aggregate(rows=Count('pk'), last=Max('pk')),
+            'scores': Scores.objects.aggregate(rows=Count('pk')),
+            'securities': SecurityList.objects.aggregate(rows=Count('pk'), last=Max('last_updated')),
+        })
+    return fingerprint
+
+
+class SharedCache:
+    """
+    DataFrames shared by every scenario, kept in memory and as Parquet files. Entries of a
+    kind and parameters for older data are removed once a newer one is written, bar the
+    previous one in case a process is still reading it.
+    """
+    keep = 2
+
+    def __init__(self, root=None, maxsize=32):
+        self.root = root or cache_dir('shared')
+        self.memory = LRUCache(maxsize=maxsize)
+
+    def prefix(self, kind, **params):
+        return f'{kind}-{digest(kind, **params)[:16]}'
+
+    def path(self, kind, key, **params):
+        return self.root / f'{self.prefix(kind, **params)}-{key}.parquet'
+
+    def key(self, kind, **params):
+        return digest(kind, inputs=data_fingerprint(), **params)
+
+    def peek(self, kind, **params):
+        # The entry for the current data if some process computed it, else None
+        key = self.key(kind, **params)
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+
+        path = self.path(kind, key, **params)
+        if path.exists():
+            return self.memory.put(key, to_pandas(pl.read_parquet(path)))
+        return None
+
+    def get(self, kind, func, **params):
+        """
+        func(), a DataFrame, cached under kind and params for the current data.
+        """
+        value = self.peek(kind, **params)
+        if value is not None:
+            return value
+
+        key = self.key(kind, **params)
+        path = self.path(kind, key, **params)
+        value = func()
+        tmp_path = temp_path(path)
+        pl.DataFrame({col: value[col].to_numpy() for col in value.columns}).write_parquet(tmp_path)
+        os.replace(tmp_path, path)
+        self.prune(kind, **params)
+        return self.memory.put(key, value)
+
+    def prune(self, kind, **params):
+        old = sorted(self.root.glob(f'{self.prefix(kind, **params)}-*.parquet'), key=lambda x: x.stat().st_mtime)
+        for stale in old[:-self.keep]:
+            stale.unlink(missing_ok=True)
+
+    def clear(self):
+        self.memory.clear()
+
+
+@functools.cache
+def get_shared_cache():
+    return SharedCache()
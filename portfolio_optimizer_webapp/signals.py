@@ -0,0 +1,70 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from portfolio_optimizer_webapp.models import DataSettings, ExpectedReturns, Fundamentals, Portfolio, Scores, SecurityList, SecurityPrice
+from portfolio_optimizer_webapp.rendercache import bump_generation
+
+
+# Keep the columnar price store and returns matrix in sync with SecurityPrice writes. New rows
+# after the cached range are picked up lazily on the next read, edits to cached history drop
+# the symbol so it is rebuilt.
+# Bulk operations do not send signals and must update the store themselves.
+# The analytics stack (polars, pandas) is imported on the first price write, not at startup.
+
+@receiver(post_save, sender=SecurityPrice)
+def sync_price_store_on_save(sender, instance, **kwargs):
+    from portfolio_optimizer_webapp.pricestore import get_price_store
+    from portfolio_optimizer_webapp.returns import get_returns_matrix
+    import pandas as pd
+
+    store = get_price_store()
+    last_date = store.last_date(instance.symbol_id)
+    if last_date is not None and pd.Timestamp(instance.date).date() <= last_date:
+        store.invalidate(instance.symbol_id)
+        get_returns_matrix().invalidate(instance.symbol_id)
+
+
+@receiver(post_delete, sender=SecurityPrice)
+def sync_price_store_on_delete(sender, instance, **kwargs):
+    from portfolio_optimizer_webapp.pricestore import get_price_store
+    from portfolio_optimizer_webapp.returns import get_returns_matrix
+
+    get_price_store().invalidate(instance.symbol_id)
+    get_returns_matrix().invalidate(instance.symbol_id)
+
+
+# Single price rows recompute the rollups of their year, quarter and month
+
+@receiver(post_save, sender=SecurityPrice)
+@receiver(post_delete, sender=SecurityPrice)
+def sync_rollups(sender, instance, **kwargs):
+    from portfolio_optimizer_webapp.rollup import period_keys, rebuild
+    import pandas as pd
+
+    rebuild(period_keys(instance.symbol_id, pd.Timestamp(instance.date).date()))
+
+
+# Any write to the data (or settings) behind the dashboard invalidates the cached renders,
+# writes to the market data also move the data version of the shared caches.
+# Bulk operations bump the generation themselves.
+
+@receiver(post_save, sender=SecurityList)
+@receiver(post_save, sender=SecurityPrice)
+@receiver(post_save, sender=Fundamentals)
+@receiver(post_save, sender=Scores)
+@receiver(post_delete, sender=SecurityList)
+@receiver(post_delete, sender=SecurityPrice)
+@receiver(post_delete, sender=Fundamentals)
+@receiver(post_delete, sender=Scores)
+def bump_render_generation(sender, **kwargs):
+    bump_generation()
+
+
+@receiver(post_save, sender=DataSettings)
+@receiver(post_save, sender=Portfolio)
+@receiver(post_save, sender=ExpectedReturns)
+@receiver(post_delete, sender=DataSettings)
+@receiver(post_delete, sender=Portfolio)
+@receiver(post_delete, sender=ExpectedReturns)
+def bump_scenario_generation(sender, **kwargs):
+    bump_generation(data=False)
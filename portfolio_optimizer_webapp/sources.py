@@ -0,0 +1,178 @@
+from portfolio_optimizer_webapp.app_settings import get_setting
+from portfolio_optimizer_webapp.ingest import normalize_columns
+from portfolio_optimizer_webapp.fetch import SourceError, TransientSourceError  # noqa: F401
+from pathlib import Path
+import pandas as pd
+import numpy as np
+import datetime
+import asyncio
+import zlib
+
+# Data sources feed the ingestion pipeline with one DataFrame per symbol. The file and
+# fixture sources are local stand-ins for the remote APIs, so refreshes can run offline.
+#
+# The fetcher (fetch.py) calls the async methods. Sources wrapping a blocking client can
+# keep the sync methods, which then run in threads; network sources should override the
+# async ones, and raise TransientSourceError for failures worth retrying. concurrency and
+# rate_limit (requests per second, None for unlimited) are the per-source fetch defaults.
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures'
+
+
+class DataSource:
+    name = 'base'
+    concurrency = 8
+    rate_limit = None
+
+    def symbols(self):
+        raise NotImplementedError
+
+    def prices(self, symbol, start=None, end=None):
+        # Daily rows with columns symbol, date, open, high, low, close, adjclose, volume, ...
+        raise NotImplementedError
+
+    def fundamentals(self, symbol):
+        # Report rows with columns symbol, as_of_date, period_type, currency_code, ...
+        raise NotImplementedError
+
+    async def aprices(self, symbol, start=None, end=None):
+        return await asyncio.to_thread(self.prices, symbol, start, end)
+
+    async def afundamentals(self, symbol):
+        return await asyncio.to_thread(self.fundamentals, symbol)
+
+
+class FileSource(DataSource):
+    """
+    Reads per-symbol CSV or Parquet files laid out as
+        <root>/prices/<SYMBOL>.csv
+        <root>/fundamentals/<SYMBOL>.parquet
+    """
+    name = 'file'
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _path(self, kind, symbol):
+        for suffix in ('.parquet', '.csv'):
+            path = self.root / kind / f'{symbol}{suffix}'
+            if path.exists():
+                return path
+        return None
+
+    def _read(self, kind, symbol):
+        path = self._path(kind, symbol)
+        if path is None:
+            return pd.DataFrame()
+        df = pd.read_parquet(path) if path.suffix == '.parquet' else pd.read_csv(path)
+        return normalize_columns(df).assign(symbol=symbol)
+
+    def symbols(self):
+        return sorted({x.stem for x in self.root.glob('*/*') if x.suffix in ('.csv', '.parquet')})
+
+    def prices(self, symbol, start=None, end=None):
+        df = self._read('prices', symbol)
+        if df.empty:
+            return df
+        dates = pd.to_datetime(df.date).dt.date
+        keep = pd.Series(True, index=df.index)
+        if start is not None:
+            keep &= dates >= start
+        if end is not None:
+            keep &= dates <= end
+        return df[keep]
+
+    def fundamentals(self, symbol):
+        return self._read('fundamentals', symbol)
+
+
+class FixtureSource(DataSource):
+    """
+    Deterministic synthetic data for the symbols in fixtures/sp500.csv. Each symbol gets a
+    seeded random walk from ORIGIN, so any date window returns the same rows as a full
+    fetch, and yearly reports up to last year. latency (seconds) simulates a network call.
+    """
+    name = 'fixture'
+    concurrency = 32
+    ORIGIN = datetime.date(2010, 1, 1)
+
+    def __init__(self, path=FIXTURES_DIR / 'sp500.csv', latency=0.0):
+        self.path = Path(path)
+        self.latency = latency
+
+    def symbols(self):
+        return pd.read_csv(self.path, usecols=['Symbol']).Symbol.str.strip().tolist()
+
+    def _rng(self, symbol, kind):
+        return np.random.default_rng([zlib.crc32(symbol.encode()), zlib.crc32(kind.encode())])
+
+    def prices(self, symbol, start=None, end=None):
+        dates = pd.bdate_range(self.ORIGIN, end or datetime.date.today())
+        rng = self._rng(symbol, 'prices')
+        drift, vol = rng.normal(3e-4, 2e-4), rng.uniform(0.01, 0.03)
+        close = rng.uniform(20, 200) * np.exp(np.cumsum(rng.normal(drift, vol, len(dates))))
+        spread = np.abs(rng.normal(0, vol / 2, (2, len(dates))))
+
+        df = pd.DataFrame({
+            'symbol': symbol,
+            'date': dates.date,
+            'open': close * np.exp(rng.normal(0, vol / 4, len(dates))),
+            'high': close * np.exp(spread[0]),
+            'low': close * np.exp(-spread[1]),
+            'close': close,
+            'adjclose': close,
+            'volume': rng.integers(1e5, 1e7, len(dates)),
+        })
+        if start is not None:
+            df = df[df.date >= start]
+        return df
+
+    def fundamentals(self, symbol):
+        years = np.arange(self.ORIGIN.year, datetime.date.today().year)
+        rng = self._rng(symbol, 'fundamentals')
+        growth = np.exp(np.cumsum(rng.normal(0.05, 0.1, len(years))))
+        assets = rng.uniform(1e9, 1e11) * growth
+        revenue = assets * rng.uniform(0.3, 1.2) * np.exp(rng.normal(0, 0.05, len(years)))
+        current_assets = assets * rng.uniform(0.2, 0.5, len(years))
+        liabilities = assets * rng.uniform(0.3, 0.7, len(years))
+
+        return pd.DataFrame({
+            'symbol': symbol,
+            'as_of_date': [datetime.date(x, 12, 31) for x in years],
+            'period_type': '12M',
+            'currency_code': 'USD',
+            'net_income': revenue * rng.normal(0.08, 0.05, len(years)),
+            'total_assets': assets,
+            'current_assets': current_assets,
+            'current_liabilities': current_assets / rng.uniform(0.8, 2.5, len(years)),
+            'total_liabilities_net_minority_interest': liabilities,
+            'capital_stock': assets * 0.05 * np.exp(np.cumsum(rng.normal(0, 0.02, len(years)))),
+            'cash_and_cash_equivalents': assets * rng.uniform(0.02, 0.15, len(years)),
+            'gross_profit': revenue * rng.uniform(0.2, 0.6, len(years)),
+            'total_revenue': revenue,
+            'pe_ratio': rng.uniform(8, 40, len(years)),
+        })
+
+    async def aprices(self, symbol, start=None, end=None):
+        await asyncio.sleep(self.latency)
+        return self.prices(symbol, start, end)
+
+    async def afundamentals(self, symbol):
+        await asyncio.sleep(self.latency)
+        return self.fundamentals(symbol)
+
+
+SOURCES = {
+    'file': FileSource,
+    'fixture': FixtureSource,
+}
+
+
+def get_source():
+    # The configured source for background refreshes, None when there is nothing to fetch from.
+    # PORTFOLIO_OPTIMIZER_SOURCE picks one by name, SOURCE_DIR alone implies the file source
+    root = get_setting('SOURCE_DIR')
+    name = get_setting('SOURCE', 'file' if root else None)
+    if name is None:
+        return None
+    return FileSource(root) if name == 'file' else SOURCES[name]()
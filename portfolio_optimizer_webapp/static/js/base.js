@@ -1,18 +1,63 @@
-function updateProgress(progressBarElement, progressBarMessageElement, progress) {
-  progressBarElement.style.width = progress.percent + "%";
-//  progressBarMessageElement.innerHTML = progress.current + ' of ' + progress.total + ' processed.';
-  progressBarMessageElement.innerHTML = progress.current + '% processed.';
+function updateProgress(progressBarElement, progressBarMessageElement, job) {
+  progressBarElement.style.width = Math.round(100 * job.progress) + "%";
+  progressBarMessageElement.textContent = job.kind + ': ' + (job.error || job.message || job.status);
 }
 
-var trigger = document.getElementById('progress-bar-trigger');
-trigger.addEventListener('click', function(e) {
-  var bar = document.getElementById("progress-bar");
-  var barMessage = document.getElementById("progress-bar-message");
-  for (var i = 0; i < 11; i++) {
-    setTimeout(updateProgress, 500 * i, bar, barMessage, {
-      percent: 10 * i,
-      current: 10 * i,
-      total: 100
-    })
+// Poll the status of queued/running jobs, reload once they have all finished
+function pollJobs() {
+  var elements = document.querySelectorAll('[data-job-url]');
+  if (elements.length === 0) {
+    return;
   }
-})
\ No newline at end of file
+
+  var requests = Array.prototype.map.call(elements, function(element) {
+    return fetch(element.dataset.jobUrl)
+      .then(function(response) { return response.json(); })
+      .then(function(job) {
+        updateProgress(element.querySelector('.progress-bar'), element.querySelector('.job-message'), job);
+        return job.status === 'queued' || job.status === 'running';
+      });
+  });
+
+  Promise.all(requests).then(function(active) {
+    if (active.some(Boolean)) {
+      setTimeout(pollJobs, 2000);
+    } else {
+      window.location.reload();
+    }
+  });
+}
+
+pollJobs();
+
+// Line charts are rendered downsampled, refetch the visible range at the chart's width on zoom
+function bindChartZoom(container) {
+  var plot = container.querySelector('.plotly-graph-div');
+  if (!plot || !window.Plotly) {
+    return;
+  }
+
+  plot.on('plotly_relayout', function(event) {
+    // The chart URL may already carry a query, e.g. the scenario
+    var url = new URL(container.dataset.chartUrl, window.location.href);
+    url.searchParams.set('points', Math.round(plot.clientWidth));
+    if (event['xaxis.range[0]'] !== undefined) {
+      url.searchParams.set('start', String(event['xaxis.range[0]']).slice(0, 10));
+      url.searchParams.set('end', String(event['xaxis.range[1]']).slice(0, 10));
+    } else if (!event['xaxis.autorange']) {
+      return;
+    }
+
+    fetch(url)
+      .then(function(response) { return response.json(); })
+      .then(function(data) {
+        var traces = plot.data.map(function(trace, i) {
+          var update = data.traces[i] || {x: [], y: []};
+          return Object.assign({}, trace, {x: update.x, y: update.y});
+        });
+        Plotly.react(plot, traces, plot.layout);
+      });
+  });
+}
+
+document.querySelectorAll('[data-chart-url]').forEach(bindChartZoom);
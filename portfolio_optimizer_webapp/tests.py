@@ -0,0 +1,1551 @@
+from portfolio_optimizer_webapp.app_settings import cache_dir
+from portfolio_optimizer_webapp.models import CacheVersion, DataSettings, ExpectedReturns, Fundamentals, Job,\
+    Portfolio, PriceRollup, Scores, SecurityList, SecurityPrice, fiscal_years, get_fiscal_year
+from portfolio_optimizer_webapp.pricestore import get_price_store, to_pandas
+from portfolio_optimizer_webapp.queries import latest_per_symbol, with_holdings
+from portfolio_optimizer_webapp.returns import MATRIX_KINDS, ReturnsMatrix, compute_returns, get_returns_matrix
+from portfolio_optimizer_webapp.sources import DataSource, FixtureSource
+from portfolio_optimizer_webapp.views import DashboardView
+from portfolio_optimizer_webapp.benchmarks import harness, synthetic
+from portfolio_optimizer_webapp import allocation, api, app_settings, backtest, covariance, downsample, estimation,\
+    fetch, frontier, ingest, instrumentation, jobs, optimizer, rendercache, rollup, scoring, screening, shared
+from django.core.exceptions import ImproperlyConfigured
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.db.models import F
+from django.http import HttpResponse
+from django.urls import reverse
+from unittest import mock
+from pathlib import Path
+import pandas as pd
+import itertools
+import csv
+import threading
+import json
+import asyncio
+import time
+import numpy as np
+import tempfile
+import os
+import datetime
+import shutil
+
+# Run from a project with the app installed: python manage.py test portfolio_optimizer_webapp
+
+
+class CacheDirTestCase(TestCase):
+    # Cache directory and render cache of its own, the in-process caches emptied around each test
+
+    def setUp(self):
+        root = tempfile.mkdtemp(prefix='portfolio_optimizer_test_')
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': root}}
+        overrides = override_settings(PORTFOLIO_OPTIMIZER_CACHE_DIR=root, PORTFOLIO_OPTIMIZER_RENDER_CACHE='default',
+                                      CACHES=caches)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.addCleanup(harness.clear_caches, root)
+        harness.clear_caches(root)
+        self.root = root
+
+
+def walk_prices(symbols, days, start='2024-01-01', seed=0):
+    # Daily closes of random walks for each symbol, in the long format the ingestion reads
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, periods=days)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, (days, len(symbols))), axis=0))
+    return pd.DataFrame({'symbol': np.repeat(symbols, days), 'date': np.tile(dates, len(symbols)),
+                         'close': closes.T.ravel()})
+
+
+def report(symbol, as_of_date, **values):
+    # A yearly report, every statement line defaulting to the same as last year's below
+    fields = {'net_income': 5, 'total_assets': 100, 'current_assets': 40, 'current_liabilities': 20,
+              'total_liabilities_net_minority_interest': 60, 'capital_stock': 100,
+              'cash_and_cash_equivalents': 20, 'gross_profit': 30, 'total_revenue': 100}
+    return Fundamentals.objects.create(symbol_id=symbol, as_of_date=as_of_date, period_type='12M',
+                                       currency_code='USD', **{**fields, **values})
+
+
+class ScoringTests(TestCase):
+
+    def setUp(self):
+        SecurityList.objects.create(symbol='AAA')
+        SecurityList.objects.create(symbol='BBB')
+        self.first = report('AAA', datetime.date(2021, 12, 31))
+        # Better on every signal but accruals (ROA equals the change in cash) and asset turnover
+        self.second = report('AAA', datetime.date(2022, 12, 31), net_income=10, total_assets=110,
+                             current_assets=50, total_liabilities_net_minority_interest=50,
+                             cash_and_cash_equivalents=30, gross_profit=40)
+
+    def test_signals(self):
+        scoring.update_scores()
+        second = Scores.objects.get(fundamentals=self.second)
+        self.assertAlmostEqual(second.roa, 0.1)
+        self.assertAlmostEqual(second.delta_cash, 0.1)
+        self.assertAlmostEqual(second.delta_roa, 0.05)
+        self.assertAlmostEqual(second.accruals, 0)
+        self.assertEqual(second.pf_score, 7)
+        self.assertAlmostEqual(second.pf_score_weighted, 7 / 9)
+
+    def test_first_report_scores_available_signals(self):
+        # No prior period, only ROA can be computed and the other signals don't count
+        scoring.update_scores()
+        first = Scores.objects.get(fundamentals=self.first)
+        self.assertIsNone(first.delta_cash)
+        self.assertEqual(first.pf_score, 1)
+        self.assertEqual(first.pf_score_weighted, 1)
+
+    def test_incremental_matches_full(self):
+        third = report('AAA', datetime.date(2023, 12, 31), net_income=8, total_assets=120)
+        scoring.update_scores(symbols=['AAA'])
+
+        Fundamentals.objects.filter(pk=self.second.pk).update(net_income=-10)
+        df = scoring.load_fundamentals(['AAA'])
+        self.assertEqual(set(df.loc[scoring.affected_rows(df, [self.second.pk]), 'id']),
+                         {self.second.pk, third.pk})
+
+        scoring.update_scores(fundamentals_ids=[self.second.pk])
+        incremental = {x.pk: (x.roa, x.delta_roa, x.pf_score) for x in Scores.objects.all()}
+        scoring.update_scores()
+        full = {x.pk: (x.roa, x.delta_roa, x.pf_score) for x in Scores.objects.all()}
+        self.assertEqual(incremental, full)
+        self.assertLess(Scores.objects.get(pk=self.second.pk).roa, 0)
+
+    def test_incremental_loads_changed_symbols(self):
+        other = report('BBB', datetime.date(2022, 12, 31))
+        scoring.update_scores(fundamentals_ids=[self.second.pk])
+        self.assertFalse(Scores.objects.filter(fundamentals=other).exists())
+
+
+class IngestTests(CacheDirTestCase):
+
+    def prices(self, close=10.0):
+        return pd.DataFrame({'Ticker': ['aaa', 'aaa', 'aaa', 'bbb', None],
+                             'Date': ['2024-01-02', '2024-01-03', '2024-01-03', '2024-01-02', '2024-01-02'],
+                             'Adj Close': [1.0, 2.0, 3.0, 4.0, 5.0],
+                             'Close': [close, close + 1, close + 2, -1, close]})
+
+    def test_prices_rejected_and_deduplicated(self):
+        # BBB's negative close, the row without a symbol and the first of AAA's repeated date
+        self.assertEqual(ingest.ingest_prices(self.prices()), (2, 3))
+        self.assertEqual(list(SecurityPrice.objects.order_by('date').values_list('symbol', 'close', 'adjclose')),
+                         [('AAA', 10.0, 1.0), ('AAA', 12.0, 3.0)])
+
+    def test_prices_upsert(self):
+        ingest.ingest_prices(self.prices(), chunksize=2, batch_size=1)
+        ingest.ingest_prices(self.prices(close=20.0))
+        self.assertEqual(SecurityPrice.objects.count(), 2)
+        self.assertEqual(SecurityPrice.objects.get(date='2024-01-02').close, 20.0)
+        self.assertEqual(SecurityList.objects.get(symbol='AAA').last_updated.date(), datetime.date(2024, 1, 3))
+
+    def test_fundamentals_upsert_without_currency(self):
+        df = pd.DataFrame({'symbol': ['AAA', 'AAA'], 'asOfDate': ['2021-12-31', '2022-12-31'],
+                           'periodType': ['12M', '12M'], 'NetIncome': [5, 10], 'TotalAssets': [100, 110]})
+        ingest.ingest_fundamentals(df)
+        ingest.ingest_fundamentals(df.assign(NetIncome=[5, 20], currencyCode=[None, ' ']))
+
+        self.assertEqual(Fundamentals.objects.count(), 2)
+        latest = Fundamentals.objects.get(as_of_date='2022-12-31')
+        self.assertEqual((latest.net_income, latest.currency_code, latest.year), (20, '', 2022))
+        self.assertAlmostEqual(Scores.objects.get(fundamentals=latest).roa, 0.2)
+
+    def test_copy_keeps_blank_currency(self):
+        # Postgres' COPY path, the blank currency must reach the staging table as '' to conflict
+        df, _ = ingest.validate_fundamentals(pd.DataFrame({'symbol': ['AAA'], 'asOfDate': ['2022-12-31'],
+                                                           'periodType': ['12M'], 'NetIncome': [5]}))
+        connection = mock.MagicMock()
+        connection.ops.quote_name = lambda x: f'"{x}"'
+        cursor = connection.cursor.return_value.__enter__.return_value
+        with mock.patch.object(ingest, 'connection', connection):
+            ingest.copy_upsert(Fundamentals, df, ingest.FUNDAMENTAL_KEYS)
+
+        copy_sql = cursor.cursor.copy.call_args.args[0]
+        self.assertTrue(copy_sql.endswith(r"FROM STDIN WITH (FORMAT csv, NULL '\N')"))
+        written = cursor.cursor.copy.return_value.__enter__.return_value.write.call_args.args[0]
+        row = dict(zip(df.columns, next(csv.reader(written.splitlines()))))
+        self.assertEqual((row['symbol'], row['currency_code'], row['net_income']), ('AAA', '', '5'))
+        self.assertEqual(row['total_assets'], r'\N')
+
+
+class FiscalYearTests(SimpleTestCase):
+
+    def test_closest_year_end(self):
+        dates = ['2021-07-01', '2021-07-02', '2022-03-31', '2022-03-31']
+        self.assertEqual(list(fiscal_years(dates, [12, 12, 3, 12])), [2020, 2021, 2022, 2021])
+
+    def test_tie_goes_to_later_year(self):
+        # 183 days from the end of 2019 and of 2020
+        self.assertEqual(list(fiscal_years(['2020-06-30', '2020-07-01'])), [2019, 2020])
+
+    def test_not_after_last_year(self):
+        today = datetime.date.today()
+        self.assertEqual(get_fiscal_year(today), today.year - 1)
+        self.assertEqual(get_fiscal_year(datetime.date(today.year - 1, 12, 31)), today.year - 1)
+
+    def test_matches_per_date_search(self):
+        # The per-date search fiscal_years replaced, December year ends
+        def search(date):
+            date = pd.Timestamp(date)
+            year_ends = {x: pd.Timestamp(f'{x}-12-31') for x in range(date.year - 1, datetime.date.today().year)}
+            distances = {abs(date.timestamp() - x.timestamp()): year for year, x in year_ends.items()}
+            return distances[min(distances)]
+
+        dates = pd.date_range('2015-01-01', datetime.date.today(), freq='17D')
+        self.assertEqual(list(fiscal_years(dates)), [search(x) for x in dates])
+
+
+class OptimizerTests(SimpleTestCase):
+
+    def model(self, variances):
+        return optimizer.CovarianceModel(['A', 'B', 'C'][:len(variances)], np.diag(variances).astype(float))
+
+    def test_project_simplex(self):
+        np.testing.assert_allclose(optimizer.project_simplex(np.array([2.0, 0.0])), [1, 0])
+        np.testing.assert_allclose(optimizer.project_simplex(np.array([0.5, 0.5, 0.5])), [1 / 3] * 3)
+        np.testing.assert_allclose(optimizer.project_simplex(np.array([0.6, 0.2, -1.0])), [0.7, 0.3, 0])
+
+    def test_min_volatility(self):
+        # Inverse variance weights for uncorrelated assets
+        w = optimizer.solve([0.1, 0.5], self.model([1, 4]), 'min_volatility')
+        np.testing.assert_allclose(w, [0.8, 0.2], atol=1e-6)
+
+    def test_quadratic_utility(self):
+        # Interior optimum where the marginal utilities are equal, w_a - w_b = (mu_a - mu_b) / risk_aversion
+        w = optimizer.solve([0.2, 0.1], self.model([1, 1]), 'max_quadratic_utility', risk_aversion=1.0)
+        np.testing.assert_allclose(w, [0.55, 0.45], atol=1e-6)
+
+    def test_max_sharpe_against_grid(self):
+        mu, model = np.array([0.12, 0.08, 0.05]), self.model([0.04, 0.02, 0.01])
+        w = optimizer.solve(mu, model, 'max_sharpe')
+        grid = [np.array([a, b, 1 - a - b]) for a in np.linspace(0, 1, 101) for b in np.linspace(0, 1, 101)
+                if a + b <= 1]
+        best = max(optimizer.sharpe_ratio(x, mu, model.cov) for x in grid)
+        self.assertAlmostEqual(w.sum(), 1)
+        self.assertGreaterEqual(optimizer.sharpe_ratio(w, mu, model.cov), best - 1e-4)
+
+    def test_warm_start_from_solution(self):
+        mu, model = np.array([0.12, 0.08, 0.05]), self.model([0.04, 0.02, 0.01])
+        w = optimizer.solve(mu, model, 'max_quadratic_utility', risk_aversion=3.0)
+        np.testing.assert_allclose(optimizer.solve_qp(mu, model, 3.0, w0=w, max_iter=1), w, atol=1e-8)
+
+    def test_lru_cache(self):
+        cache = optimizer.LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(list(cache), ['a', 'c'])
+
+
+class OptimizeTests(CacheDirTestCase):
+
+    def test_optimize_saves_holdings(self):
+        synthetic.generate(12, 3)
+        data_settings = DataSettings.objects.get()
+        weights, allocation = optimizer.optimize(data_settings)
+
+        self.assertAlmostEqual(weights.sum(), 1)
+        self.assertTrue((weights >= 0).all())
+        holdings = dict(Portfolio.objects.filter(scenario=data_settings).values_list('symbol', 'allocation'))
+        self.assertEqual(holdings, {k: round(v, 6) for k, v in weights.items()})
+        self.assertEqual(set(allocation['shares'].keys()), set(holdings))
+
+        # The saved weights warm-start the next solve of the scenario only, in any process
+        harness.clear_caches(self.root)
+        np.testing.assert_allclose(optimizer.warm_start(weights.index, data_settings.pk), weights.to_numpy(),
+                                   atol=1e-5)
+        self.assertIsNone(optimizer.warm_start(weights.index, data_settings.pk + 1))
+
+    def test_scenarios_leave_shared_rows_alone(self):
+        # Each scenario's estimator keeps its own covariance, the shared expected returns aren't written
+        synthetic.generate(12, 3, optimize_portfolio=False)
+        estimation.estimate_returns(DataSettings())
+        rows = list(ExpectedReturns.objects.order_by('pk').values_list('pk', 'expected_return', 'variance'))
+        for method in ['ledoit_wolf', 'ewma']:
+            optimizer.optimize(DataSettings.objects.create(covariance_method=method))
+        self.assertEqual(list(ExpectedReturns.objects.order_by('pk').values_list('pk', 'expected_return', 'variance')),
+                         rows)
+
+
+class CovarianceTests(SimpleTestCase):
+
+    def setUp(self):
+        self.returns = np.random.default_rng(1).normal(0, 0.01, (60, 4))
+
+    def test_sample_covariance_pairwise(self):
+        np.testing.assert_allclose(covariance.sample_covariance(self.returns), np.cov(self.returns, rowvar=False))
+
+        # Missing days leave out only the pairs involving the symbol
+        returns = self.returns.copy()
+        returns[:10, 0] = np.nan
+        cov = covariance.sample_covariance(returns)
+        np.testing.assert_allclose(cov[0, 1], np.cov(self.returns[10:, :2], rowvar=False)[0, 1])
+        np.testing.assert_allclose(cov[2, 3], np.cov(self.returns[:, 2:], rowvar=False)[0, 1])
+
+    def test_ledoit_wolf_invertible(self):
+        # More symbols than days, the sample covariance is singular but the shrunk one is not
+        returns = np.random.default_rng(2).normal(0, 0.01, (20, 40))
+        cov = covariance.ledoit_wolf(returns)
+        np.testing.assert_allclose(cov, cov.T)
+        self.assertGreater(np.linalg.eigvalsh(cov).min(), 0)
+        self.assertLess(np.linalg.eigvalsh(covariance.sample_covariance(returns)).min(), 1e-12)
+
+    def test_ledoit_wolf_shrinkage(self):
+        # Against the intensity from the per-day outer products
+        returns = self.returns
+        sample = covariance.sample_covariance(returns)
+        x = returns - returns.mean(axis=0)
+        n_obs, n_cols = returns.shape
+        target = np.trace(sample) / n_cols * np.eye(n_cols)
+        d2 = np.sum((sample - target) ** 2) / n_cols
+        b2 = sum(np.sum((np.outer(row, row) - sample) ** 2) for row in x) / n_obs ** 2 / n_cols
+        shrinkage = min(b2, d2) / d2
+        np.testing.assert_allclose(covariance.ledoit_wolf(returns), shrinkage * target + (1 - shrinkage) * sample)
+
+    def test_factor_covariance_keeps_variances(self):
+        cov = covariance.factor_covariance(self.returns, n_factors=2)
+        np.testing.assert_allclose(np.diag(cov), np.diag(np.cov(self.returns, rowvar=False)))
+
+    def test_ewma_incremental(self):
+        full = covariance.ewma_moments(self.returns)
+        extended = covariance.ewma_moments(self.returns[40:], state=covariance.ewma_moments(self.returns[:40]))
+        np.testing.assert_allclose(extended['cross'], full['cross'])
+        np.testing.assert_allclose(extended['norm'], full['norm'])
+
+
+class CovarianceStoreTests(CacheDirTestCase):
+    symbols = ['AAA', 'BBB', 'CCC']
+
+    def setUp(self):
+        super().setUp()
+        self.prices = walk_prices(self.symbols, 60)
+        # All but the last three days
+        ingest.ingest_prices(self.prices[self.prices.date < self.prices.date.max() - pd.Timedelta(days=3)])
+
+    def fresh(self, method):
+        # The same estimate computed without any stored state
+        return covariance.CovarianceStore(cache_dir('fresh')).get(self.symbols, method)
+
+    def test_new_days_replace_the_stored_estimate(self):
+        store = covariance.CovarianceStore()
+        store.get(self.symbols)
+        ingest.ingest_prices(self.prices)
+        np.testing.assert_allclose(store.get(self.symbols), self.fresh('ledoit_wolf'))
+
+        key = store.key(self.symbols, 'ledoit_wolf', None)
+        self.assertEqual(len(list(store.root.glob(f'{key}-*.npz'))), 1)
+
+    def test_ewma_extended_with_new_days(self):
+        store = covariance.CovarianceStore()
+        store.get(self.symbols, 'ewma')
+        ingest.ingest_prices(self.prices)
+        np.testing.assert_allclose(store.get(self.symbols, 'ewma'), self.fresh('ewma'))
+
+    def test_ewma_rebuilt_after_backfill(self):
+        store = covariance.CovarianceStore()
+        store.get(self.symbols, 'ewma')
+        # AAA's first days revised
+        ingest.ingest_prices(self.prices.iloc[:5].assign(close=lambda x: x.close * 1.1))
+        np.testing.assert_allclose(store.get(self.symbols, 'ewma'), self.fresh('ewma'))
+
+
+class EstimationTests(CacheDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rng = np.random.default_rng(3)
+        self.X = rng.normal(size=(200, 3))
+        self.y = 1 + 2 * self.X[:, 0] - self.X[:, 1]
+
+    def test_linear_model(self):
+        model = estimation.LinearModel(alpha=0).fit(self.X, self.y)
+        np.testing.assert_allclose(model.predict(self.X[:5]), self.y[:5])
+
+    def test_neural_net(self):
+        y = np.sin(self.X[:, 0]) + self.X[:, 1] ** 2
+        model = estimation.NeuralNet().fit(self.X, y)
+        self.assertLess(np.mean((model.predict(self.X) - y) ** 2), 0.1 * y.var())
+
+    def test_build_features(self):
+        df = pd.DataFrame({'symbol': ['AAA', 'AAA', 'BBB'], 'year': [2022, 2021, 2021],
+                           'yearly_close': [20.0, 10.0, 5.0], 'mean': [15.0, 10.0, 5.0], 'variance': [4.0, 1.0, 1.0]})
+        df = estimation.build_features(df)
+        self.assertAlmostEqual(df.target[0], np.log(2))
+        self.assertTrue(df.target[1:].isna().all())
+        self.assertAlmostEqual(df.cv_close[1], 2 / 15)
+
+    def test_fitted_model_cached(self):
+        model = estimation.get_model('lm', self.X, self.y)
+        self.assertIs(estimation.get_model('lm', self.X, self.y), model)
+
+        # From disk in a new process, without training
+        estimation.model_cache.clear()
+        with mock.patch.object(estimation.LinearModel, 'fit') as fit:
+            loaded = estimation.get_model('lm', self.X, self.y)
+        fit.assert_not_called()
+        np.testing.assert_allclose(loaded.predict(self.X), model.predict(self.X))
+
+        # Different data or settings train a new one
+        self.assertIsNot(estimation.get_model('lm', self.X[1:], self.y[1:]), model)
+        net = estimation.get_model('nn', self.X, self.y)
+        self.assertIsInstance(net, estimation.NeuralNet)
+        estimation.model_cache.clear()
+        np.testing.assert_allclose(estimation.get_model('nn', self.X, self.y).predict(self.X), net.predict(self.X))
+
+    def test_old_models_pruned(self):
+        for i in range(estimation.MODELS_KEPT + 2):
+            estimation.get_model('lm', self.X[i:], self.y[i:])
+        self.assertEqual(len(list(cache_dir('models').glob('lm-*.npz'))), estimation.MODELS_KEPT)
+
+    def test_estimate_returns(self):
+        synthetic.generate(10, 4, optimize_portfolio=False)
+        result = estimation.estimate_returns(DataSettings(estimation_method='lm'))
+
+        self.assertEqual(len(result), 10)
+        np.testing.assert_allclose(result.expected_return, result.forecasted_close / result.last_close - 1)
+        saved = dict(ExpectedReturns.objects.values_list('fundamentals_id', 'expected_return'))
+        self.assertEqual(saved, {k: round(v, 6) for k, v in zip(result.fundamentals_id, result.expected_return)})
+
+
+class RenderCacheTests(CacheDirTestCase):
+
+    def test_cached_per_generation(self):
+        calls = []
+
+        def render():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(rendercache.cached('table', render), 1)
+        self.assertEqual(rendercache.cached('table', render), 1)
+        rendercache.bump_generation()
+        self.assertEqual(rendercache.cached('table', render), 2)
+
+    def test_none_cached(self):
+        render = mock.Mock(return_value=None)
+        self.assertIsNone(rendercache.cached('plot', render))
+        self.assertIsNone(rendercache.cached('plot', render))
+        self.assertEqual(render.call_count, 1)
+
+    def test_writes_bump_generation(self):
+        generation, data_version = rendercache.get_generation(), rendercache.get_data_version()
+        SecurityList.objects.create(symbol='AAA')
+        self.assertGreater(rendercache.get_generation(), generation)
+        self.assertGreater(rendercache.get_data_version(), data_version)
+
+        # Scenario writes invalidate the renders but not the shared data
+        generation, data_version = rendercache.get_generation(), rendercache.get_data_version()
+        DataSettings.objects.create()
+        self.assertGreater(rendercache.get_generation(), generation)
+        self.assertEqual(rendercache.get_data_version(), data_version)
+
+    def test_dashboard_score_table_rendered_once(self):
+        request = RequestFactory().get('/dashboard/')
+        with mock.patch.object(DashboardView, 'build_score_table', return_value=[]) as build:
+            DashboardView.as_view()(request).render()
+            DashboardView.as_view()(request).render()
+            self.assertEqual(build.call_count, 1)
+
+            SecurityList.objects.create(symbol='AAA')
+            DashboardView.as_view()(request).render()
+            self.assertEqual(build.call_count, 2)
+
+
+class LatestPerSymbolTests(TestCase):
+
+    def setUp(self):
+        for symbol in ['AAA', 'BBB']:
+            SecurityList.objects.create(symbol=symbol)
+        self.reports = {(x, year): report(x, datetime.date(year, 12, 31))
+                        for x in ['AAA', 'BBB'] for year in [2021, 2022]}
+        scoring.update_scores()
+
+    def test_latest_report(self):
+        with self.assertNumQueries(1):
+            latest = list(Fundamentals.objects.latest_per_symbol().order_by('symbol'))
+        self.assertEqual(latest, [self.reports['AAA', 2022], self.reports['BBB', 2022]])
+
+    def test_filters_apply_to_latest(self):
+        # AAA's earlier report scores 9 but its latest only 1, so it is not picked
+        Scores.objects.filter(fundamentals=self.reports['AAA', 2021]).update(pf_score=9)
+        Scores.objects.filter(fundamentals=self.reports['BBB', 2022]).update(pf_score=9)
+        passing = latest_per_symbol(Scores.objects.all()).filter(pf_score__gte=7)
+        self.assertEqual(list(passing.values_list('symbol', flat=True)), ['BBB'])
+
+    def test_with_holdings(self):
+        data_settings = DataSettings.objects.create()
+        Portfolio.objects.create(scenario=data_settings, symbol_id='AAA', fundamentals=self.reports['AAA', 2022],
+                                 allocation=1.0, shares=3)
+        rows = with_holdings(latest_per_symbol(Scores.objects.all()), data_settings).order_by('symbol')
+        self.assertEqual(list(rows.values_list('symbol', 'allocation', 'shares')),
+                         [('AAA', 1.0, 3), ('BBB', None, None)])
+        # Another scenario holds nothing
+        rows = with_holdings(Scores.objects.all(), DataSettings.objects.create())
+        self.assertEqual(set(rows.values_list('allocation', flat=True)), {None})
+
+
+class JobTests(CacheDirTestCase):
+
+    def test_enqueue_reuses_active_job(self):
+        job = jobs.enqueue('score', symbols=['AAA'])
+        self.assertEqual(jobs.enqueue('score', symbols=['AAA']), job)
+        self.assertNotEqual(jobs.enqueue('score', symbols=['BBB']), job)
+
+        Job.objects.filter(pk=job.pk).update(status='done')
+        self.assertNotEqual(jobs.enqueue('score', symbols=['AAA']), job)
+
+        with self.assertRaises(ValueError):
+            jobs.enqueue('unknown')
+
+    def test_claim_once(self):
+        first, second = jobs.enqueue('score', symbols=['AAA']), jobs.enqueue('score', symbols=['BBB'])
+        self.assertEqual(jobs.claim(1), [first.pk])
+        self.assertEqual(jobs.claim(5), [second.pk])
+        self.assertEqual(jobs.claim(5), [])
+
+        self.assertEqual(jobs.requeue_stale(), 2)
+        self.assertEqual(jobs.claim(5), [first.pk, second.pk])
+
+    def test_run_job(self):
+        def run(params, report):
+            report(0.5, 'Halfway')
+            if params['fail']:
+                raise RuntimeError('Source unavailable')
+            return {'date': datetime.date(2024, 1, 2)}
+
+        with mock.patch.dict(jobs.TASKS, {'test': run}):
+            done, failed = jobs.enqueue('test', fail=False), jobs.enqueue('test', fail=True)
+            self.assertEqual(jobs.run_job(done.pk), 'done')
+            self.assertEqual(jobs.run_job(failed.pk), 'failed')
+
+        done.refresh_from_db()
+        self.assertEqual((done.status, done.progress, done.result), ('done', 1, {'date': '2024-01-02'}))
+
+        response = self.client.get(reverse('portfolio-optimizer-job-status', args=[failed.pk]))
+        self.assertEqual(response.json()['status'], 'failed')
+        self.assertEqual(response.json()['progress'], 0.5)
+        self.assertEqual(response.json()['error'], 'RuntimeError: Source unavailable')
+
+    def test_optimize_job(self):
+        synthetic.generate(10, 3, optimize_portfolio=False)
+        data_settings = DataSettings.objects.create()
+        job = jobs.enqueue('optimize', **jobs.settings_params(data_settings))
+        self.assertEqual(jobs.run_job(job.pk), 'done')
+
+        job.refresh_from_db()
+        self.assertAlmostEqual(sum(job.result['weights'].values()), 1, places=4)
+        self.assertEqual(set(job.result['weights']),
+                         set(Portfolio.objects.filter(scenario=data_settings).values_list('symbol', flat=True)))
+
+    def test_generation_shared_between_processes(self):
+        # A bump by a job worker is a database write, seen without any in-process state
+        render = mock.Mock(side_effect=[1, 2])
+        rendercache.cached('table', render)
+        CacheVersion.objects.filter(key=rendercache.GENERATION_KEY).update(value=F('value') + 1)
+        self.assertEqual(rendercache.cached('table', render), 2)
+
+
+class CountingSource(DataSource):
+    # Async source recording calls and concurrency, failing on request
+    name = 'counting'
+
+    def __init__(self, latency=0.01, transient=0, failing=()):
+        self.latency, self.transient, self.failing = latency, transient, set(failing)
+        self.calls, self.active, self.max_active = [], 0, 0
+
+    async def aprices(self, symbol, start=None, end=None):
+        self.calls.append(symbol)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.active -= 1
+        if symbol in self.failing:
+            raise fetch.SourceError(f'No data for {symbol}')
+        if self.calls.count(symbol) <= self.transient:
+            raise fetch.TransientSourceError('Throttled')
+        return pd.DataFrame({'symbol': [symbol]})
+
+
+class FetchTests(SimpleTestCase):
+
+    def requests(self, n):
+        return [('prices', f'S{i:03d}', ()) for i in range(n)]
+
+    def test_bounded_concurrency(self):
+        source = CountingSource()
+        results = list(fetch.stream(source, self.requests(20), concurrency=4))
+        self.assertEqual(sorted(x[1] for x in results), [f'S{i:03d}' for i in range(20)])
+        self.assertEqual(source.max_active, 4)
+
+    def test_retries(self):
+        # Transient errors are retried, others reported as the result
+        source = CountingSource(transient=2, failing=['S001'])
+        results = {symbol: result for _, symbol, result in fetch.stream(source, self.requests(2), backoff=0)}
+        self.assertIsInstance(results['S000'], pd.DataFrame)
+        self.assertIsInstance(results['S001'], fetch.SourceError)
+        self.assertEqual(source.calls.count('S000'), 3)
+        self.assertEqual(source.calls.count('S001'), 1)
+
+        source = CountingSource(transient=5)
+        [(_, _, result)] = fetch.stream(source, self.requests(1), retries=2, backoff=0)
+        self.assertIsInstance(result, fetch.TransientSourceError)
+
+    def test_rate_limit(self):
+        # A burst of 5 requests, then 5 a second
+        start = time.monotonic()
+        list(fetch.stream(CountingSource(latency=0), self.requests(7), rate_limit=5))
+        self.assertGreaterEqual(time.monotonic() - start, 0.35)
+
+    def test_consumer_stopping_cancels_fetch(self):
+        threads = set(threading.enumerate())
+        source = CountingSource(latency=0.05)
+        for _ in fetch.stream(source, self.requests(100), concurrency=2, maxsize=1):
+            break
+
+        deadline = time.monotonic() + 5
+        while set(threading.enumerate()) - threads and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(set(threading.enumerate()) - threads, set())
+        self.assertLess(len(source.calls), 10)
+
+
+class RefreshTests(CacheDirTestCase):
+
+    def test_refresh_loads_new_rows_only(self):
+        # Two years of reports
+        source = FixtureSource(latency=0.001)
+        source.ORIGIN = datetime.date(datetime.date.today().year - 2, 1, 1)
+        first = ingest.refresh(source, ['AAA', 'BBB'])
+        self.assertGreater(first['prices'][0], 0)
+        self.assertEqual(first['failed'], {})
+        self.assertEqual(SecurityPrice.objects.count(), first['prices'][0])
+        self.assertTrue(Scores.objects.filter(symbol='AAA').exists())
+
+        # Prices from each symbol's last_updated on
+        self.assertEqual(ingest.refresh(source, ['AAA', 'BBB'])['prices'][0], 0)
+
+    def test_failed_symbols_reported(self):
+        class FailingSource(FixtureSource):
+            async def afundamentals(self, symbol):
+                raise fetch.SourceError('Not found')
+
+        source = FailingSource()
+        source.ORIGIN = datetime.date.today() - datetime.timedelta(days=30)
+        result = ingest.refresh(source, ['AAA'])
+        self.assertEqual(result['fundamentals'], (0, 0))
+        self.assertIn('fundamentals', result['failed']['AAA'])
+        self.assertGreater(result['prices'][0], 0)
+
+
+class BacktestTests(CacheDirTestCase):
+
+    def test_rebalance_rows(self):
+        dates = pd.bdate_range('2023-01-02', '2023-12-29').to_numpy().astype('datetime64[D]')
+        rows = backtest.rebalance_rows(dates, 'Q', lookback=10)
+        self.assertEqual([str(x) for x in dates[rows]], ['2023-04-03', '2023-07-03', '2023-10-02'])
+        self.assertEqual(len(backtest.rebalance_rows(dates, 'M', lookback=100)), 7)
+
+    def test_reports_pass_once_published(self):
+        scores = pd.DataFrame({'symbol': ['AAA', 'AAA', 'BBB'], 'pf_score': [8, 3, 7],
+                               'published': pd.to_datetime(['2022-03-31', '2023-03-31', '2023-03-31'])})
+        self.assertEqual(backtest.passing_symbols(scores, '2023-03-30', 6), {'AAA'})
+        self.assertEqual(backtest.passing_symbols(scores, '2023-03-31', 6), {'BBB'})
+
+    def test_summarize(self):
+        dates = pd.to_datetime(['2023-01-02', '2023-01-03', '2023-01-04']).to_numpy().astype('datetime64[D]')
+        metrics = backtest.summarize(np.array([100.0, 110.0, 99.0]), dates)
+        self.assertAlmostEqual(metrics['total_return'], -0.01)
+        self.assertAlmostEqual(metrics['max_drawdown'], -0.1)
+
+    def test_grid(self):
+        params = backtest.grid_params([5, 6], ['max_sharpe', 'max_quadratic_utility'], [0.5, 1.0, 2.0])
+        self.assertEqual(len(params), 8)
+        self.assertEqual({x['risk_aversion'] for x in params if x['objective'] == 'max_sharpe'}, {None})
+
+    def test_backtest(self):
+        self.assertIsNone(backtest.backtest())
+        synthetic.generate(10, 3, optimize_portfolio=False)
+        result = backtest.backtest(threshold=0, investment_amount=10000, lookback=120)
+
+        # Held in cash until the first reports are published, then invested net of costs
+        values, metrics = result['values'], result['metrics']
+        self.assertEqual(values.iloc[0], 10000)
+        self.assertGreater(values.std(), 0)
+        self.assertGreater(metrics['costs'], 0)
+        self.assertLess(metrics['costs'], 2 * backtest.COST_BPS / 1e4 * values.max() * metrics['rebalances'])
+
+        table = backtest.run_grid([0, 9], ['max_sharpe'], workers=1, lookback=120)
+        self.assertEqual(list(table.objective), ['max_sharpe', 'max_sharpe', 'benchmark'])
+        self.assertTrue(table.sharpe.iloc[0] >= table.sharpe.iloc[1] or np.isnan(table.sharpe.iloc[1]))
+
+
+class FrontierTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(4)
+        returns = rng.normal(0, 0.01, (250, 6))
+        self.mu = rng.normal(0.08, 0.04, 6)
+        self.model = optimizer.CovarianceModel(list('ABCDEF'), np.cov(returns, rowvar=False) * 252)
+
+    def test_project_simplex_rows(self):
+        V = np.random.default_rng(5).normal(size=(10, 6))
+        np.testing.assert_allclose(frontier.project_simplex_rows(V), [optimizer.project_simplex(x) for x in V])
+
+    def test_batch_matches_single_solves(self):
+        deltas = [0.5, 2.0, 10.0]
+        W = frontier.solve_batch(self.mu, self.model, deltas, tol=1e-10, max_iter=20000)
+        for w, delta in zip(W, deltas):
+            np.testing.assert_allclose(w, optimizer.solve_qp(self.mu, self.model, delta), atol=1e-6)
+
+    def test_efficient_frontier(self):
+        returns, volatilities, weights = frontier.efficient_frontier(self.mu, self.model, n_points=20)
+        np.testing.assert_allclose(weights.sum(axis=1), 1)
+        self.assertTrue((weights >= 0).all())
+        # Evenly spaced returns up to the best asset's, risk rising with them
+        np.testing.assert_allclose(np.diff(returns), np.diff(returns).mean(), atol=1e-3)
+        self.assertAlmostEqual(returns.max(), self.mu.max(), places=3)
+        self.assertTrue((np.diff(volatilities) > -1e-6).all())
+
+        min_vol = optimizer.solve(self.mu, self.model, 'min_volatility')
+        self.assertAlmostEqual(volatilities[0], np.sqrt(min_vol @ self.model.cov @ min_vol), places=3)
+
+
+class GetFrontierTests(CacheDirTestCase):
+
+    def test_cached_frontier_and_plot(self):
+        from portfolio_optimizer_webapp import plots
+
+        synthetic.generate(10, 3)
+        data_settings = DataSettings.objects.get()
+        result = frontier.get_frontier(data_settings, n_points=10)
+        self.assertEqual(len(result['points']), 10)
+        self.assertEqual(list(result['weights'].columns), list(result['assets'].index))
+        self.assertIs(frontier.get_frontier(data_settings, n_points=10), result)
+        self.assertIn('Efficient frontier', plots.plot_frontier(data_settings))
+
+
+class PriceFieldTests(TestCase):
+
+    def test_compact_column_type(self):
+        from django.db import connection
+
+        field = SecurityPrice._meta.get_field('close')
+        self.assertEqual(field.db_type(connection), connection.data_types['FloatField'])
+        with override_settings(PORTFOLIO_OPTIMIZER_COMPACT_PRICES=True):
+            self.assertEqual(field.db_type(mock.Mock(vendor='postgresql')), 'real')
+            self.assertEqual(field.db_type(mock.Mock(vendor='mysql')), 'float')
+            self.assertEqual(field.db_type(connection), connection.data_types['FloatField'])
+
+    def test_read_as_float(self):
+        SecurityList.objects.create(symbol='AAA')
+        SecurityPrice.objects.bulk_create([SecurityPrice(symbol_id='AAA', date=datetime.date(2024, 1, 2), close=1.25)])
+        close = SecurityPrice.objects.values_list('close', flat=True).get()
+        self.assertIs(type(close), float)
+        self.assertEqual(close, 1.25)
+
+
+class FloatColumnsMigrationTests(TransactionTestCase):
+
+    def test_decimals_copied_to_floats(self):
+        from django.db import connection
+        from django.db.migrations.executor import MigrationExecutor
+        from decimal import Decimal
+
+        before = [('portfolio_optimizer_webapp', '0005_job')]
+        after = [('portfolio_optimizer_webapp', '0006_float_price_columns')]
+        executor = MigrationExecutor(connection)
+        executor.migrate(before)
+        self.addCleanup(lambda: MigrationExecutor(connection).migrate(executor.loader.graph.leaf_nodes()))
+
+        old = executor.loader.project_state(before).apps
+        old.get_model('portfolio_optimizer_webapp', 'SecurityList').objects.create(symbol='AAA')
+        old.get_model('portfolio_optimizer_webapp', 'SecurityPrice').objects.create(
+            symbol_id='AAA', date=datetime.date(2024, 1, 2), close=Decimal('101.25'), open=None)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(after)
+        new = executor.loader.project_state(after).apps
+        price = new.get_model('portfolio_optimizer_webapp', 'SecurityPrice').objects.get()
+        self.assertEqual((price.close, price.open), (101.25, None))
+
+
+class RollupMigrationTests(TransactionTestCase):
+
+    def test_backfill_matches_period_stats(self):
+        from django.db import connection
+        from django.db.migrations.executor import MigrationExecutor
+
+        before = [('portfolio_optimizer_webapp', '0006_float_price_columns')]
+        after = [('portfolio_optimizer_webapp', '0007_price_rollup')]
+        executor = MigrationExecutor(connection)
+        executor.migrate(before)
+        self.addCleanup(lambda: MigrationExecutor(connection).migrate(executor.loader.graph.leaf_nodes()))
+
+        prices = walk_prices(['AAA', 'BBB'], 300, start='2023-10-02').assign(volume=7)
+        prices.loc[5, ['close', 'volume']] = [np.nan, np.nan]
+        old = executor.loader.project_state(before).apps
+        old.get_model('portfolio_optimizer_webapp', 'SecurityList').objects.bulk_create(
+            [old.get_model('portfolio_optimizer_webapp', 'SecurityList')(symbol=x) for x in ['AAA', 'BBB']])
+        SecurityPrice = old.get_model('portfolio_optimizer_webapp', 'SecurityPrice')
+        SecurityPrice.objects.bulk_create([
+            SecurityPrice(symbol_id=x.symbol, date=x.date.date(), close=None if np.isnan(x.close) else x.close,
+                          volume=None if np.isnan(x.volume) else int(x.volume))
+            for x in prices.itertuples()])
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(after)
+        new = executor.loader.project_state(after).apps
+        fields = ['symbol_id', 'period', 'period_start', 'first_date', 'last_date', 'last_close', 'count', 'mean', 'm2',
+                  'volume']
+        migrated = pd.DataFrame(list(new.get_model('portfolio_optimizer_webapp', 'PriceRollup').objects
+                                     .values_list(*fields)), columns=fields)
+        expected = rollup.period_stats(prices.assign(date=prices.date.dt.date))
+        expected = pd.DataFrame([{'symbol_id': x.symbol, 'period': x.period, 'period_start': x.period_start,
+                                  **rollup.as_fields(x)} for x in expected.itertuples(index=False)])[fields]
+
+        key = ['symbol_id', 'period', 'period_start']
+        pd.testing.assert_frame_equal(migrated.sort_values(key).reset_index(drop=True),
+                                      expected.sort_values(key).reset_index(drop=True), check_dtype=False)
+
+
+class BenchmarkTests(CacheDirTestCase):
+
+    def test_synthetic_universe(self):
+        source = synthetic.SyntheticSource(3, 2)
+        self.assertEqual(source.symbols(), ['SYN00000', 'SYN00001', 'SYN00002'])
+        pd.testing.assert_frame_equal(source.prices('SYN00001'), synthetic.SyntheticSource(3, 2).prices('SYN00001'))
+
+        rows = synthetic.generate(3, 2, optimize_portfolio=False)
+        self.assertEqual(rows['prices'], SecurityPrice.objects.count())
+        self.assertEqual(rows['fundamentals'], Fundamentals.objects.count())
+        self.assertTrue(SecurityPrice.objects.filter(symbol=synthetic.BENCHMARK).exists())
+        self.assertEqual(SecurityList.objects.get(symbol='SYN00001').sector, synthetic.SECTORS[1])
+
+    def test_measure(self):
+        timing = harness.measure(lambda: sum(range(1000)), repeat=3)
+        self.assertLessEqual(timing['min_s'], timing['median_s'])
+        self.assertGreaterEqual(timing['peak_mb'], 0)
+
+    def test_compare(self):
+        def results(*medians):
+            return {'results': [{'case': case, 'mode': 'warm', 'symbols': 10, 'years': 3, 'median_s': x}
+                                for case, x in zip(['a', 'b', 'c'], medians)]}
+
+        rows = harness.compare(results(1.0, 2.0, 1.0), results(1.0, 1.0), threshold=1.25)
+        self.assertEqual([(x['case'], x['ratio'], x['regression']) for x in rows],
+                         [('a', 1.0, False), ('b', 2.0, True)])
+
+
+@override_settings(PORTFOLIO_OPTIMIZER_INSTRUMENT=True)
+class InstrumentationTests(CacheDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        instrumentation.metrics.clear()
+        self.addCleanup(instrumentation.metrics.clear)
+
+    def view(self, request):
+        with instrumentation.span('load') as record:
+            record['rows'] = SecurityList.objects.count()
+        return HttpResponse()
+
+    async def async_view(self, request):
+        with instrumentation.span('wait'):
+            await asyncio.sleep(0)
+        return HttpResponse()
+
+    def profiles(self):
+        return list(cache_dir('profiles').glob('*.prof'))
+
+    def test_span_outside_request(self):
+        with instrumentation.span('load') as record:
+            self.assertIsNone(record)
+
+    def test_server_timing_and_metrics(self):
+        middleware = instrumentation.InstrumentationMiddleware(self.view)
+        response = middleware(RequestFactory().get('/'))
+
+        timing = response.headers['Server-Timing']
+        self.assertRegex(timing, r'^load;dur=[\d.]+, db;dur=[\d.]+;desc="1 queries", total;dur=[\d.]+$')
+        rendered = instrumentation.metrics.render()
+        self.assertIn('portfolio_optimizer_span_seconds_count{span="load",view=""} 1', rendered)
+        self.assertIn('portfolio_optimizer_span_queries_total{span="load",view=""} 1', rendered)
+
+    @override_settings(PORTFOLIO_OPTIMIZER_PROFILE='cprofile')
+    def test_profiles(self):
+        instrumentation.InstrumentationMiddleware(self.view)(RequestFactory().get('/'))
+        self.assertEqual(len(self.profiles()), 1)
+
+        # Under ASGI as well
+        middleware = instrumentation.InstrumentationMiddleware(self.async_view)
+        response = asyncio.run(middleware(RequestFactory().get('/')))
+        self.assertTrue(response.headers['Server-Timing'].startswith('wait;dur='))
+        self.assertEqual(len(self.profiles()), 2)
+
+    def test_metrics_view(self):
+        self.assertEqual(self.client.get(reverse('portfolio-optimizer-metrics')).status_code, 200)
+        with override_settings(PORTFOLIO_OPTIMIZER_INSTRUMENT=False):
+            self.assertEqual(self.client.get(reverse('portfolio-optimizer-metrics')).status_code, 404)
+
+
+class APITests(CacheDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        sectors = ['Energy', None, 'Utilities', 'Energy', None, 'Technology', 'Energy']
+        for i, sector in enumerate(sectors):
+            SecurityList.objects.create(symbol=f'S{i}', sector=sector)
+        ingest.ingest_prices(walk_prices(['S0', 'S1'], 5))
+
+    def pages(self, name, **params):
+        # Results of every page, following the next links
+        results, url = [], reverse(name) + '?' + '&'.join(f'{k}={v}' for k, v in params.items())
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            results.extend(response.json()['results'])
+            url = response.json()['next']
+        return results
+
+    def test_cursor(self):
+        self.assertEqual(api.decode_cursor(api.encode_cursor([None, 'AAA'])), [None, 'AAA'])
+        for cursor in ['not base64!', api.encode_cursor({'a': 1}), api.encode_cursor([1, 2, 3])]:
+            response = self.client.get(reverse('portfolio-optimizer-api-tickers'), {'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+
+    def test_keyset_pages(self):
+        # Null sectors last in either direction, ties by symbol, every row once
+        rows = sorted(SecurityList.objects.values_list('sector', 'symbol'), key=lambda x: x[1])
+        for sort, descending in [('sector', False), ('-sector', True)]:
+            expected = [x[1] for x in sorted([x for x in rows if x[0]], key=lambda x: x[0], reverse=descending)]
+            expected += [x[1] for x in rows if x[0] is None]
+            for limit in [1, 2, 3, 100]:
+                results = self.pages('portfolio-optimizer-api-tickers', sort=sort, limit=limit)
+                self.assertEqual([x['symbol'] for x in results], expected)
+
+    def test_prices_pages(self):
+        results = self.pages('portfolio-optimizer-api-prices', limit=3, symbol='s1')
+        self.assertEqual([x['date'] for x in results],
+                         [str(x) for x in SecurityPrice.objects.filter(symbol='S1').order_by('date')
+                          .values_list('date', flat=True)])
+        self.assertEqual(self.pages('portfolio-optimizer-api-prices', limit=4, start='2024-01-03'),
+                         self.pages('portfolio-optimizer-api-prices', limit=100, start='2024-01-03'))
+        self.assertEqual(self.client.get(reverse('portfolio-optimizer-api-prices'), {'sort': 'close'}).status_code,
+                         400)
+
+    def test_not_modified_until_data_changes(self):
+        url = reverse('portfolio-optimizer-api-tickers')
+        tag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=tag).status_code, 304)
+        SecurityList.objects.create(symbol='S9')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=tag).status_code, 200)
+
+    def test_export(self):
+        url = reverse('portfolio-optimizer-api-price-export')
+        with mock.patch.object(api, 'EXPORT_CHUNK_SIZE', 3):
+            response = self.client.get(url, {'symbol': 'S0'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0])['symbol'], 'S0')
+
+        response = self.client.get(url, {'format': 'csv'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(api.PRICE_FIELDS.values()))
+        self.assertEqual(len(lines), 11)
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 400)
+
+    def test_scores_filters(self):
+        for symbol in ['S0', 'S2', 'S3']:
+            report(symbol, datetime.date(2022, 12, 31))
+        scoring.update_scores()
+        Scores.objects.filter(symbol='S3').update(pf_score=8)
+
+        url = reverse('portfolio-optimizer-api-scores')
+        results = self.client.get(url, {'sector': 'Energy', 'min_score': 5}).json()['results']
+        self.assertEqual([x['symbol'] for x in results], ['S3'])
+        results = self.client.get(url, {'sector': ['Energy', 'Utilities']}).json()['results']
+        self.assertEqual([x['symbol'] for x in results], ['S3', 'S0', 'S2'])
+        self.assertEqual(self.client.get(url, {'min_score': 'high'}).status_code, 400)
+
+
+class DownsampleTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.x = np.arange(500)
+        self.Y = np.cumsum(rng.normal(size=(500, 3)), axis=0)
+        self.Y[200, 0] = 100
+        self.Y[300:350, 1] = np.nan
+
+    def test_lttb(self):
+        index = downsample.lttb(self.x, self.Y, 50)
+        self.assertEqual(index.shape, (50, 3))
+        self.assertTrue((index[0] == 0).all() and (index[-1] == 499).all())
+        self.assertTrue((np.diff(index, axis=0) > 0).all())
+        # The spike is the largest triangle of its bucket
+        self.assertIn(200, index[:, 0])
+        # Nothing to drop
+        self.assertEqual(downsample.lttb(self.x, self.Y, 600).shape, (500, 3))
+
+    def test_lttb_skips_gaps(self):
+        # A bucket only picks a missing value when it has nothing else
+        index = downsample.lttb(self.x, self.Y, 50)
+        edges = np.linspace(1, 499, 49).astype(int)
+        for i, (lo, hi) in enumerate(zip(edges[:-1], edges[1:])):
+            self.assertEqual(np.isnan(self.Y[index[i + 1, 1], 1]), np.isnan(self.Y[lo:hi, 1]).all())
+
+    def test_minmax(self):
+        index = downsample.minmax(self.Y, 50)
+        self.assertEqual(index.shape, (50, 3))
+        self.assertTrue((np.diff(index, axis=0) >= 0).all())
+        for j in range(3):
+            self.assertIn(np.nanargmin(self.Y[:, j]), index[:, j])
+            self.assertIn(np.nanargmax(self.Y[:, j]), index[:, j])
+
+    def test_series_points(self):
+        self.assertEqual(downsample.series_points(2), downsample.POINTS)
+        self.assertEqual(downsample.series_points(100), downsample.MAX_POINTS // 100)
+        self.assertEqual(downsample.series_points(10_000), downsample.MIN_POINTS)
+
+    def test_traces(self):
+        dates = np.datetime64('2024-01-01') + np.arange(500)
+        for method in ['lttb', 'minmax']:
+            traces = downsample.traces(dates, ['a', 'b', 'c'], self.Y, start='2024-02-01', end='2024-12-31',
+                                       points=64, method=method, digits=2)
+            self.assertEqual([x['name'] for x in traces], ['a', 'b', 'c'])
+            for trace in traces:
+                self.assertLessEqual(len(trace['x']), 64)
+                self.assertEqual(len(trace['x']), len(trace['y']))
+                self.assertEqual(trace['x'], sorted(trace['x']))
+                self.assertGreaterEqual(trace['x'][0], '2024-02-01')
+                self.assertLessEqual(trace['x'][-1], '2024-12-31')
+                self.assertFalse(np.isnan(trace['y']).any())
+                self.assertEqual(trace['y'], [round(y, 2) for y in trace['y']])
+
+
+class ChartDataTests(CacheDirTestCase):
+
+    def test_chart_data_view(self):
+        symbols = ['AAA', 'BBB']
+        for symbol in symbols:
+            SecurityList.objects.create(symbol=symbol)
+        ingest.ingest_prices(walk_prices(symbols, 300))
+
+        url = reverse('portfolio-optimizer-chart-data', args=['cumulative'])
+        traces = self.client.get(url, {'points': 40}).json()['traces']
+        self.assertEqual({x['name'] for x in traces}, set(symbols))
+        self.assertTrue(all(len(x['x']) <= 40 for x in traces))
+
+        traces = self.client.get(url, {'start': '2024-06-01'}).json()['traces']
+        self.assertTrue(all(x['x'][0] >= '2024-06-01' for x in traces))
+        self.assertEqual(self.client.get(url, {'start': 'June'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('portfolio-optimizer-chart-data', args=['pie'])).status_code, 404)
+        # No portfolio to compare yet
+        url = reverse('portfolio-optimizer-chart-data', args=['compare'])
+        self.assertEqual(self.client.get(url).json()['traces'], [])
+
+
+class RollupTests(CacheDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.prices = walk_prices(['AAA', 'BBB'], 400, start='2023-11-01').assign(volume=10)
+
+    def rollups(self):
+        rows = PriceRollup.objects.order_by('symbol', 'period', 'period_start')\
+            .values_list('symbol', 'period', 'period_start', 'first_date', 'last_date', 'count', 'volume',
+                         'last_close', 'mean', 'm2')
+        return [(*x[:7], *np.round(x[7:], 8)) for x in rows]
+
+    def test_merge_stats(self):
+        df = self.prices[self.prices.symbol == 'AAA'].iloc[:40]
+        stats = [rollup.as_fields(next(rollup.period_stats(x, ['Y']).itertuples(index=False)))
+                 for x in [df.iloc[:15], df.iloc[15:], df]]
+        merged = rollup.merge_stats(stats[0], stats[1])
+        self.assertEqual({k: merged[k] for k in ['first_date', 'last_date', 'count', 'last_close', 'volume']},
+                         {k: stats[2][k] for k in ['first_date', 'last_date', 'count', 'last_close', 'volume']})
+        self.assertAlmostEqual(merged['mean'], df.close.mean())
+        self.assertAlmostEqual(merged['m2'] / (merged['count'] - 1), df.close.var())
+
+    def test_incremental_matches_rebuild(self):
+        # Chunks in date order are merged, the last reaching back into stored months is recomputed
+        by_date = self.prices.sort_values('date')
+        ingest.ingest_prices(by_date.iloc[:500], chunksize=70)
+        ingest.ingest_prices(by_date.iloc[500:], chunksize=70)
+        ingest.ingest_prices(by_date.iloc[100:130].assign(close=lambda x: x.close * 2))
+        incremental = self.rollups()
+
+        self.assertEqual(PriceRollup.objects.filter(symbol='AAA', period='Y').count(), 3)
+        rollup.rebuild_rollups()
+        self.assertEqual(incremental, self.rollups())
+
+    def test_rebuild_symbols(self):
+        ingest.ingest_prices(self.prices)
+        PriceRollup.objects.update(mean=0)
+        rollup.rebuild_rollups(['AAA'])
+        self.assertFalse(PriceRollup.objects.filter(symbol='AAA', mean=0).exists())
+        self.assertEqual(PriceRollup.objects.filter(symbol='BBB').exclude(mean=0).count(), 0)
+
+        # Symbols without prices lose their rollups (deleted without the per-row signals)
+        SecurityPrice.objects.filter(symbol='BBB')._raw_delete(SecurityPrice.objects.db)
+        rollup.rebuild_rollups()
+        self.assertFalse(PriceRollup.objects.filter(symbol='BBB').exists())
+
+    def test_single_rows(self):
+        ingest.ingest_prices(self.prices)
+        price = SecurityPrice.objects.filter(symbol='AAA').order_by('date').first()
+        price.close = 1000
+        price.save()
+        month = PriceRollup.objects.get(symbol='AAA', period='M', period_start=datetime.date(2023, 11, 1))
+        self.assertEqual(month.first_date, price.date)
+        self.assertGreater(month.mean, 100)
+
+        for price in SecurityPrice.objects.filter(symbol='AAA', date__lt='2023-12-01'):
+            price.delete()
+        self.assertFalse(PriceRollup.objects.filter(symbol='AAA', period='M', period_start='2023-11-01').exists())
+        self.assertEqual(PriceRollup.objects.get(symbol='AAA', period='Y', period_start='2023-01-01').first_date,
+                         datetime.date(2023, 12, 1))
+
+    def test_yearly_rollup(self):
+        ingest.ingest_prices(self.prices)
+        df = rollup.yearly_rollup().set_index(['symbol', 'year']).sort_index()
+        prices = self.prices.assign(year=self.prices.date.dt.year.astype('int64')).groupby(['symbol', 'year']).close
+        pd.testing.assert_series_equal(df['yearly_close'], prices.last(), check_names=False)
+        pd.testing.assert_series_equal(df['mean'], prices.mean(), check_names=False)
+        pd.testing.assert_series_equal(df['variance'], prices.var(), check_names=False)
+
+
+class ScreenIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n = 200
+        self.df = pd.DataFrame({'symbol': [f'S{i:03d}' for i in range(n)],
+                                'pf_score': rng.choice([np.nan, *range(10)], n),
+                                'sector': rng.choice(['Energy', 'Utilities', 'Technology', None], n),
+                                'industry': rng.choice(['Oil', 'Gas', None], n),
+                                'pe_ratio': np.where(rng.random(n) < 0.2, np.nan, rng.normal(15, 10, n).round(1)),
+                                'pb_ratio': rng.lognormal(0, 1, n)})
+
+    def expected(self, screen):
+        # The screen as a plain row filter
+        df = self.df
+        keep = df.pf_score.fillna(-1) >= screen.get('threshold', 0)
+        for key, field in screening.CATEGORIES.items():
+            if screen.get(key):
+                keep &= df[field].isin(screen[key])
+        for field in screening.RANGES:
+            if screen.get(field):
+                low, high = screen[field]
+                keep &= df[field].notna()
+                if low is not None:
+                    keep &= df[field] >= low
+                if high is not None:
+                    keep &= df[field] <= high
+        return df.symbol[keep].tolist()
+
+    def test_masks_match_filters(self):
+        screens = [{}, {'threshold': 7}, {'threshold': 12}, {'sectors': ['Energy', 'Mining']},
+                   {'threshold': 3, 'sectors': ['Utilities'], 'industries': ['Gas']},
+                   {'pe_ratio': [None, 15]}, {'pe_ratio': [10, None], 'pb_ratio': [0.5, 2]},
+                   {'pe_ratio': [15.0, 15.0]}, {'threshold': 5, 'sectors': [], 'pe_ratio': None}]
+        index = screening.ScoreIndex(self.df)
+        masks = index.masks(screens)
+        self.assertEqual(masks.shape, (len(screens), len(self.df)))
+        for screen, mask in zip(screens, masks):
+            self.assertEqual(index.symbols[mask].tolist(), self.expected(screen), screen)
+
+    def test_unknown_criteria(self):
+        with self.assertRaises(ValueError):
+            screening.ScoreIndex(self.df).masks([{'sector': ['Energy']}])
+
+
+class ScreeningTests(CacheDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for symbol, sector in [('AAA', 'Energy'), ('BBB', 'Energy'), ('CCC', 'Utilities')]:
+            SecurityList.objects.create(symbol=symbol, sector=sector)
+            report(symbol, datetime.date(2022, 12, 31), pe_ratio=10)
+        scoring.update_scores()
+        Scores.objects.filter(symbol='BBB').update(pf_score=8)
+
+    def test_run_screens(self):
+        self.assertEqual(screening.passing(5), ['BBB'])
+        self.assertEqual(screening.run_screens([{'sectors': ['Energy']}, {'pe_ratio': [None, 5]}]),
+                         [['AAA', 'BBB'], []])
+        # Only the data version is read
+        with self.assertNumQueries(1):
+            screening.passing(5)
+
+        # A new data version is screened again
+        Scores.objects.filter(symbol='CCC').update(pf_score=9)
+        rendercache.bump_generation()
+        self.assertEqual(screening.passing(5), ['BBB', 'CCC'])
+
+    def test_screens_view(self):
+        url = reverse('portfolio-optimizer-api-screens')
+        response = self.client.get(url, {'screen': ['{"threshold": 7}', '{"sectors": ["Utilities"]}']})
+        self.assertEqual([(x['count'], x['symbols']) for x in response.json()['results']],
+                         [(1, ['BBB']), (1, ['CCC'])])
+        self.assertEqual(self.client.get(url).json()['results'][0]['count'], 3)
+        for screen in ['{"threshold": ', '[7]', '{"size": 1}', '{"pe_ratio": 3}']:
+            self.assertEqual(self.client.get(url, {'screen': screen}).status_code, 400, screen)
+
+
+class AllocationTests(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.prices = rng.uniform(5, 200, 8).round(2)
+        self.prices[3] = np.nan
+        self.target = rng.dirichlet(np.ones(8)) * 1000
+
+    def test_largest_remainder(self):
+        shares = allocation.largest_remainder(self.target, self.prices, 1000)
+        held = shares * np.nan_to_num(self.prices)
+        self.assertLessEqual(held.sum(), 1000)
+        self.assertEqual(shares[3], 0)
+        self.assertTrue((shares <= np.nan_to_num(np.ceil(self.target / self.prices))).all())
+        # Nothing left is affordable for a name still below its target
+        below = (held < self.target) & np.isfinite(self.prices)
+        self.assertTrue((self.prices[below] > 1000 - held.sum()).all())
+
+    def test_exact_against_brute_force(self):
+        floor = np.nan_to_num(np.floor(self.target / self.prices))
+        prices = np.nan_to_num(self.prices)
+        best = min(np.abs(self.target - (floor + extra) * prices).sum()
+                   for extra in itertools.product([0, 1], repeat=8)
+                   if (floor + extra) @ prices <= 1000 and not extra[3])
+
+        shares, optimal = allocation.exact(self.target, self.prices, 1000)
+        self.assertTrue(optimal)
+        self.assertLessEqual(shares @ prices, 1000)
+        self.assertAlmostEqual(np.abs(self.target - shares * prices).sum(), best)
+
+        greedy = allocation.largest_remainder(self.target, self.prices, 1000)
+        self.assertLessEqual(best, np.abs(self.target - greedy * prices).sum() + 1e-9)
+
+    def test_knapsack_time_budget(self):
+        rng = np.random.default_rng(1)
+        weights = rng.uniform(1, 100, 2000)
+        values = weights + rng.normal(0, 1, 2000)
+        chosen, finished = allocation.knapsack(values, weights, 5000.5, time_budget=0)
+        self.assertFalse(finished)
+        self.assertLessEqual(weights[chosen].sum(), 5000.5)
+
+        chosen, finished = allocation.knapsack(np.array([6.0, 10, 12]), np.array([1.0, 2, 3]), 5)
+        self.assertTrue(finished)
+        self.assertEqual(chosen.tolist(), [False, True, True])
+
+    def test_allocate(self):
+        weights = pd.Series([0.5, 0.3, 0.2], index=['AAA', 'BBB', 'CCC'])
+        prices = [30.0, 45.0, 7.0]
+        cov = np.diag([0.04, 0.09, 0.01])
+        for method in allocation.METHODS:
+            result = allocation.allocate(weights, 1000, method, prices=prices, cov=cov)
+            held = result['shares'].to_numpy() * prices
+            self.assertEqual(result['shares'].index.tolist(), ['AAA', 'BBB', 'CCC'])
+            self.assertAlmostEqual(result['leftover'], 1000 - held.sum())
+            self.assertAlmostEqual(result['deviation'], np.abs(1000 * weights.to_numpy() - held).sum())
+            pd.testing.assert_series_equal(result['weights'], pd.Series(held / 1000, index=weights.index))
+            diff = held / 1000 - weights.to_numpy()
+            self.assertAlmostEqual(result['tracking_error'], np.sqrt(diff @ cov @ diff))
+            self.assertEqual(result['optimal'], True if method == 'exact' else None)
+
+        self.assertIsNone(allocation.allocate(weights, 1000, prices=prices)['tracking_error'])
+        with self.assertRaises(ValueError):
+            allocation.allocate(weights, 1000, 'round', prices=prices)
+
+
+class LatestClosesTests(CacheDirTestCase):
+
+    def test_latest_closes(self):
+        prices = walk_prices(['AAA', 'BBB'], 10)
+        ingest.ingest_prices(prices)
+        closes = allocation.latest_closes(['BBB', 'ZZZ', 'AAA'])
+        self.assertEqual(closes.index.tolist(), ['BBB', 'ZZZ', 'AAA'])
+        self.assertAlmostEqual(closes['AAA'], prices.close[9])
+        self.assertAlmostEqual(closes['BBB'], prices.close.iloc[-1])
+        self.assertTrue(np.isnan(closes['ZZZ']))
+
+
+class SharedCacheTests(CacheDirTestCase):
+
+    def test_shared_between_processes(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return pd.DataFrame({'symbol_id': ['AAA', 'BBB'], 'value': [len(calls), np.nan]})
+
+        cache = shared.SharedCache()
+        self.assertIsNone(cache.peek('thing', method='a'))
+        first = cache.get('thing', compute, method='a')
+        self.assertIs(cache.get('thing', compute, method='a'), first)
+        # Another process reads the file, other parameters are computed again
+        pd.testing.assert_frame_equal(shared.SharedCache().peek('thing', method='a'), first, check_dtype=False)
+        self.assertEqual(shared.SharedCache().get('thing', compute, method='b').value[0], 2)
+
+    def test_older_entries_pruned(self):
+        cache = shared.SharedCache()
+        for symbol in ['AAA', 'BBB', 'CCC']:
+            SecurityList.objects.create(symbol=symbol)
+            cache.get('thing', lambda: pd.DataFrame({'value': [1.0]}), method='a')
+        cache.get('thing', lambda: pd.DataFrame({'value': [1.0]}), method='b')
+        self.assertEqual(len(list(cache.root.glob(f'{cache.prefix("thing", method="a")}-*.parquet'))), cache.keep)
+        self.assertEqual(len(list(cache.root.glob('thing-*.parquet'))), cache.keep + 1)
+
+    def test_key_follows_data(self):
+        SecurityList.objects.create(symbol='AAA')
+        cache = shared.SharedCache()
+        key = cache.key('thing')
+        self.assertEqual(cache.key('thing'), key)
+
+        # Rows written without bumping the data version, as seen by a fresh process
+        SecurityPrice.objects.bulk_create([SecurityPrice(symbol_id='AAA', date=datetime.date(2024, 1, 2), close=1)])
+        shared.fingerprint_cache.clear()
+        self.assertNotEqual(cache.key('thing'), key)
+
+    def test_scenarios_share_estimate(self):
+        synthetic.generate(10, 3, optimize_portfolio=False)
+        scenarios = [DataSettings.objects.create(FScore_threshold=x) for x in [1, 3]]
+
+        with mock.patch.object(estimation, 'estimate_returns', wraps=estimation.estimate_returns) as estimate:
+            # Page views don't estimate
+            self.assertIsNone(frontier.get_frontier(scenarios[0]))
+            self.assertEqual(estimate.call_count, 0)
+            self.assertFalse(ExpectedReturns.objects.exists())
+
+            for scenario in scenarios:
+                job = jobs.enqueue('optimize', **jobs.settings_params(scenario))
+                self.assertEqual(jobs.run_job(job.pk), 'done')
+            self.assertEqual(estimate.call_count, 1)
+
+        self.assertTrue(ExpectedReturns.objects.exists())
+        for scenario in scenarios:
+            self.assertTrue(Portfolio.objects.filter(scenario=scenario).exists())
+        self.assertIsNotNone(frontier.get_frontier(scenarios[1], n_points=5))
+
+
+class AnalyticsBackendTests(CacheDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        synthetic.generate(12, 3)
+        self.scenario = DataSettings.objects.get()
+
+    def build(self):
+        from portfolio_optimizer_webapp import plots
+
+        return plots.get_analysis_data(), DashboardView().build_score_table(self.scenario)
+
+    def test_polars_matches_pandas(self):
+        df, records = self.build()
+        with override_settings(PORTFOLIO_OPTIMIZER_ANALYTICS_BACKEND='polars'):
+            polars_df, polars_records = self.build()
+
+        self.assertFalse(df.empty)
+        pd.testing.assert_frame_equal(polars_df.reset_index(drop=True), df.reset_index(drop=True))
+        self.assertEqual(len(polars_records), len(records))
+        self.assertTrue(any(x['allocation'] != '0.00%' for x in records))
+        for polars_record, record in zip(polars_records, records):
+            self.assertEqual(polars_record.keys(), record.keys())
+            for key, value in record.items():
+                if isinstance(value, float):
+                    self.assertAlmostEqual(polars_record[key], value, msg=key)
+                else:
+                    self.assertEqual(polars_record[key], value, key)
+
+    @override_settings(PORTFOLIO_OPTIMIZER_ANALYTICS_BACKEND='polars')
+    def test_snapshot_per_data_version(self):
+        from portfolio_optimizer_webapp import analytics
+
+        path = analytics.snapshot(Scores)
+        self.assertEqual(analytics.snapshot(Scores), path)
+        rendercache.bump_generation()
+        self.assertNotEqual(analytics.snapshot(Scores), path)
+        Scores.objects.filter(symbol='SYN00000').delete()
+        rendercache.bump_generation()
+        self.assertEqual(len(analytics.scan(Scores, ['symbol']).collect()), Scores.objects.count())
+
+    @override_settings(PORTFOLIO_OPTIMIZER_ANALYTICS_SOURCE='connectorx',
+                       PORTFOLIO_OPTIMIZER_ANALYTICS_DATABASE_URI='postgresql://db')
+    def test_connectorx_query(self):
+        from portfolio_optimizer_webapp import analytics
+        import polars as pl
+
+        rows = pl.DataFrame({'symbol': ['AAA'], 'period_start': [datetime.date(2024, 1, 1)], 'last_close': [1.0],
+                             'mean': [1.0], 'm2': [0.0], 'count': [1]})
+        with mock.patch.object(pl, 'read_database_uri', return_value=rows) as read:
+            df = analytics.yearly_rollup_plan().collect()
+        self.assertEqual(read.call_args.args[0], 'SELECT symbol, period_start, last_close, mean, m2, count '
+                                                 "FROM price_rollup WHERE period = 'Y'")
+        self.assertEqual(df['year'].to_list(), [2024])
+        self.assertEqual(analytics.sql_literal("O'Neil"), "'O''Neil'")
+
+    def test_unknown_backend(self):
+        from portfolio_optimizer_webapp import analytics
+        from django.core.exceptions import ImproperlyConfigured
+
+        with override_settings(PORTFOLIO_OPTIMIZER_ANALYTICS_BACKEND='spark'):
+            with self.assertRaises(ImproperlyConfigured):
+                analytics.get_backend()
+
+
+class ColdStartTests(SimpleTestCase):
+
+    def test_urlconf_imports_no_analytics(self):
+        from portfolio_optimizer_webapp.benchmarks import importtime
+
+        result = importtime.run(repeat=1)
+        self.assertEqual(result['heavy'], [])
+        self.assertGreater(result['modules'], 0)
+
+    def test_parse(self):
+        from portfolio_optimizer_webapp.benchmarks import importtime
+
+        stderr = ('import time: self [us] | cumulative | imported package\n'
+                  'import time:       120 |        120 |   _io\n'
+                  'import time:       300 |        420 | django\n'
+                  'unrelated line\n')
+        self.assertEqual(importtime.parse(stderr), [(120, 120, '_io', 1), (300, 420, 'django', 0)])
+        self.assertTrue(importtime.compare({'import_ms': 130}, {'import_ms': 100})['regression'])
+        self.assertFalse(importtime.compare({'import_ms': 120}, {'import_ms': 100})['regression'])
+
+    def test_markdown_rendered_per_mtime(self):
+        from portfolio_optimizer_webapp.views import render_markdown
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        path = f'{root}/about.md'
+        with open(path, 'w') as f:
+            f.write('# About')
+        self.assertEqual(render_markdown(path, 1), '<h1>About</h1>')
+        with open(path, 'w') as f:
+            f.write('*changed*')
+        self.assertEqual(render_markdown(path, 1), '<h1>About</h1>')
+        self.assertEqual(render_markdown(path, 2), '<p><em>changed</em></p>')
+
+
+class IndexViewTests(TestCase):
+
+    def test_index(self):
+        response = self.client.get(reverse('portfolio-optimizer-index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('<h', response.context['about'])
+
+
+
+class ReturnsMatrixTests(CacheDirTestCase):
+
+    def matrix(self, matrix, kind):
+        return to_pandas(matrix.read(kind)).set_index('date')
+
+    def test_compute_returns(self):
+        close = np.array([[10, np.nan], [11, 20], [np.nan, 22], [12.1, np.nan], [13.31, 19.8]])
+        result = compute_returns(close)
+        expected = pd.DataFrame(close).ffill().pct_change(fill_method=None).where(~np.isnan(close))
+        np.testing.assert_allclose(result['simple'], expected.to_numpy())
+        np.testing.assert_allclose(result['level'][:, 0], [1, 1.1, 1.1, 1.21, 1.331])
+        np.testing.assert_allclose(result['level'][:, 1], [np.nan, 1, 1.1, 1.1, 0.99])
+
+        # Continued from the last close and level
+        tail = compute_returns(close[3:], prev_close=[11, 22], prev_level=[1.1, 1.1])
+        np.testing.assert_allclose(tail['level'], result['level'][3:])
+
+    def test_missing_values_stored_as_null(self):
+        prices = walk_prices(['AAA'], 20)
+        ingest.ingest_prices(pd.concat([prices, walk_prices(['BBB'], 10, start='2024-01-15', seed=1)]))
+        matrix = get_returns_matrix()
+        matrix.update(['AAA', 'BBB'])
+        self.assertEqual(matrix.read('close')['BBB'].is_nan().sum(), 0)
+
+        # A symbol starting later starts its cumulative returns at zero
+        cumulative = to_pandas(matrix.cumulative_returns(['AAA', 'BBB'])).set_index('date')
+        self.assertEqual(cumulative.BBB.first_valid_index(), pd.Timestamp('2024-01-15'))
+        self.assertEqual(cumulative.BBB.dropna().iloc[0], 0)
+        self.assertAlmostEqual(cumulative.AAA.iloc[-1], prices.close.iloc[-1] / prices.close.iloc[0] - 1)
+
+    def test_incremental_matches_full(self):
+        # BBB lags AAA by a few days before both catch up
+        prices = walk_prices(['AAA', 'BBB'], 40)
+        first = prices[prices.date < np.where(prices.symbol == 'AAA', '2024-02-01', '2024-01-25')]
+        ingest.ingest_prices(first)
+        matrix = get_returns_matrix()
+        matrix.update(['AAA', 'BBB'])
+        ingest.ingest_prices(prices.drop(first.index))
+        matrix.update(['AAA', 'BBB', 'CCC'])
+
+        full = ReturnsMatrix(cache_dir('full'))
+        full.update(['AAA', 'BBB'])
+        for kind in MATRIX_KINDS:
+            pd.testing.assert_frame_equal(self.matrix(matrix, kind), self.matrix(full, kind))
+        self.assertFalse(self.matrix(matrix, 'level').isna().any().any())
+
+
+class PriceStoreTests(CacheDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.prices = walk_prices(['AAA', '^GSPC'], 10)
+        ingest.ingest_prices(self.prices)
+
+    def test_load_syncs_new_rows(self):
+        store = get_price_store()
+        df = to_pandas(store.load(['^GSPC', 'AAA', 'ZZZ'], start=datetime.date(2024, 1, 5)))
+        self.assertEqual(df.symbol.unique().tolist(), ['^GSPC', 'AAA'])
+        self.assertEqual(df.date.min(), pd.Timestamp('2024-01-05'))
+        self.assertTrue(store.path('^GSPC').exists())
+
+        # A new row is picked up in one query for every symbol
+        SecurityPrice.objects.create(symbol_id='AAA', date=datetime.date(2024, 2, 1), close=1.0)
+        with self.assertNumQueries(1):
+            df = store.load(['AAA', '^GSPC'])
+        self.assertEqual(len(df), 21)
+
+    def test_no_symbols(self):
+        with self.assertNumQueries(0):
+            df = get_price_store().load([])
+        self.assertTrue(df.is_empty())
+        self.assertEqual(df.columns, ['symbol', 'date', 'close'])
+
+
+class CacheRootTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        patcher = mock.patch.object(app_settings.tempfile, 'gettempdir', return_value=self.tmp)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(PORTFOLIO_OPTIMIZER_CACHE_DIR=None)
+    def test_private_default(self):
+        path = cache_dir('shared')
+        self.assertEqual(path, Path(self.tmp) / 'portfolio_optimizer' / 'shared')
+        self.assertEqual(path.parent.stat().st_mode & 0o777, 0o700)
+
+        # Opened up by someone else, closed again
+        path.parent.chmod(0o777)
+        cache_dir()
+        self.assertEqual(path.parent.stat().st_mode & 0o777, 0o700)
+
+    @override_settings(PORTFOLIO_OPTIMIZER_CACHE_DIR=None)
+    def test_other_users_directory_refused(self):
+        (Path(self.tmp) / 'portfolio_optimizer').mkdir()
+        with mock.patch.object(app_settings.os, 'getuid', return_value=os.getuid() + 1):
+            with self.assertRaises(ImproperlyConfigured):
+                cache_dir()
+
+    @override_settings(PORTFOLIO_OPTIMIZER_CACHE_DIR=None)
+    def test_link_refused(self):
+        target = Path(self.tmp) / 'elsewhere'
+        target.mkdir(mode=0o700)
+        (Path(self.tmp) / 'portfolio_optimizer').symlink_to(target)
+        with self.assertRaises(ImproperlyConfigured):
+            cache_dir()
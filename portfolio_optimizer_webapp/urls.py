@@ -1,6 +1,7 @@
 # users/urls.py
 
-from .views import IndexView, MetaDataView, DashboardView
+from .views import IndexView, MetaDataView, DashboardView, JobStatusView, MetricsView, ChartDataView
+from .api import PriceExportView, PricesAPIView, ScoresAPIView, ScreensAPIView, TickersAPIView
 from django.urls import path, include
 
 urlpatterns = [
@@ -8,5 +9,13 @@ urlpatterns = [
     path('', IndexView.as_view(), name='portfolio-optimizer-index'),
     path('dashboard/', DashboardView.as_view(), name='portfolio-optimizer-dashboard'),
     path('meta-data/', MetaDataView.as_view(), name='portfolio-optimizer-meta-data'),
+    path('jobs/<int:pk>/', JobStatusView.as_view(), name='portfolio-optimizer-job-status'),
+    path('charts/<str:name>/', ChartDataView.as_view(), name='portfolio-optimizer-chart-data'),
+    path('api/scores/', ScoresAPIView.as_view(), name='portfolio-optimizer-api-scores'),
+    path('api/screens/', ScreensAPIView.as_view(), name='portfolio-optimizer-api-screens'),
+    path('api/tickers/', TickersAPIView.as_view(), name='portfolio-optimizer-api-tickers'),
+    path('api/prices/', PricesAPIView.as_view(), name='portfolio-optimizer-api-prices'),
+    path('api/prices/export/', PriceExportView.as_view(), name='portfolio-optimizer-api-price-export'),
+    path('metrics/', MetricsView.as_view(), name='portfolio-optimizer-metrics'),
     path('accounts/', include('django.contrib.auth.urls')),
 ]
\ No newline at end of file
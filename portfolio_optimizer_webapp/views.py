@@ -1,19 +1,35 @@
 # webframe/views.py
 
 
-from django.urls import reverse_lazy
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.urls import reverse, reverse_lazy
 from django.views.generic.edit import FormView
-from django.views.generic.base import TemplateView
+from django.views.generic.base import TemplateView, View
 
-from portfolio_optimizer_webapp.models import Fundamentals as Scores, DataSettings, Portfolio, SecurityList
-from portfolio_optimizer_webapp import plots
+from portfolio_optimizer_webapp.models import DataSettings, Job, Scores, SecurityList
+from portfolio_optimizer_webapp.api import conditional, date_param, get_scenario, int_param, scenario_owner,\
+    user_scenarios
+from portfolio_optimizer_webapp.queries import latest_per_symbol, with_holdings
+from portfolio_optimizer_webapp.forms import AddDataForm, OptimizeForm
+from portfolio_optimizer_webapp.instrumentation import enabled as instrumentation_enabled, frame_size, metrics, span
+from portfolio_optimizer_webapp import rendercache
 
+import functools
 import datetime
-import pandas as pd
-import markdown as md
-import json
 from pathlib import Path
 
+# The analytics stack (pandas, polars, plotly and the jobs importing them) and markdown are
+# imported by the views that use them, so booting a worker or loading the URLconf doesn't
+# pay for them
+
+
+@functools.lru_cache(maxsize=4)
+def render_markdown(path, mtime):
+    # HTML of a markdown file, rendered once per modification time
+    import markdown
+
+    return markdown.markdown(Path(path).read_text())
+
 
 class IndexView(TemplateView):
     template_name = 'optimizer/index.html'
@@ -21,78 +37,172 @@ class IndexView(TemplateView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        
-        with open(self.template_path, 'r') as f:
-            text = f.read()
-            context["about"] = md.markdown(text)
-            
+        context["about"] = render_markdown(self.template_path, self.template_path.stat().st_mtime_ns)
         return context
     
 # uvicorn config.asgi:application --reload
 
+
+def active_jobs():
+    return [{'id': x.pk, 'kind': x.kind, 'status': x.status, 'progress': x.progress, 'message': x.message,
+             'url': reverse('portfolio-optimizer-job-status', args=[x.pk])}
+            for x in Job.objects.filter(status__in=Job.ACTIVE).order_by('created')]
+
+
 class DashboardView(FormView):
     model = Scores
+    form_class = OptimizeForm
     template_name = 'optimizer/dashboard.html'
-    success_url = reverse_lazy('dashboard')
+    success_url = reverse_lazy('portfolio-optimizer-dashboard')
 
-    def get_context_data(self, **kwargs):
-        context = {}
-        if len(kwargs) > 0:
-            context = super(DashboardView, self).get_context_data(**kwargs)
-        context['data_settings'] = DataSettings.objects.all()
+    def dispatch(self, request, *args, **kwargs):
+        self.scenario = get_scenario(request)
+        return super(DashboardView, self).dispatch(request, *args, **kwargs)
 
-        # Get scores + symbol
-        related_fields = ['security__symbol',
-                          # 'security__longname',
-                          'security__business_summary',
-                          'security__portfolio__shares',
-                          'security__portfolio__allocation']
+    def get_success_url(self):
+        if self.scenario is None:
+            return str(self.success_url)
+        return f'{self.success_url}?scenario={self.scenario.pk}'
 
-        scores_fields = [field.name for field in Scores._meta.get_fields()]
-        scores_fields += related_fields
+    def get_form_kwargs(self):
+        kwargs = super(DashboardView, self).get_form_kwargs()
+        kwargs['instance'] = self.scenario or DataSettings(user=scenario_owner(self.request))
+        return kwargs
 
-        # Only most recent
-        scores = Scores.objects.values(*scores_fields)
+    def post(self, request, *args, **kwargs):
+        from portfolio_optimizer_webapp import jobs
 
-        if scores.exists():
-            # context['plots'] = plots.create_plots()
-            context['plots']['spx'] = plots.compare_ytd()
+        if request.POST.get('action') == 'backtest':
+            # Backtest the saved settings over the default threshold x objective grid
+            data_settings = self.scenario or DataSettings()
+            jobs.enqueue('backtest', **jobs.settings_params(data_settings))
+            return HttpResponseRedirect(self.get_success_url())
+        return super(DashboardView, self).post(request, *args, **kwargs)
 
-            # Round decimals
-            field_dat = Scores._meta.get_fields() + Portfolio._meta.get_fields()
-            decimal_fields = [x.name for x in field_dat if x.get_internal_type() == 'DecimalField']
+    def form_valid(self, form):
+        # Optimization runs in the job worker, the page polls the job. Estimates are shared
+        # with every scenario using the same estimator
+        from portfolio_optimizer_webapp import jobs
 
-            # Formatting
-            df_scores = pd.DataFrame(scores)
-            df_scores = df_scores.loc[df_scores.groupby(["security"])["fiscal_year"].idxmax()]
+        self.scenario = form.save()
+        jobs.enqueue('optimize', **jobs.settings_params(self.scenario))
+        return super(DashboardView, self).form_valid(form)
 
-            df_scores = df_scores.astype({x: float for x in decimal_fields if x in df_scores.columns})
-            df_scores = df_scores.rename(columns={x: x.split('__')[-1] for x in related_fields})
-            df_scores = df_scores.sort_values(['allocation', 'symbol', 'date', 'pf_score'],
-                                              ascending=False).reset_index(drop=True)
+    def get_context_data(self, **kwargs):
+        from portfolio_optimizer_webapp import plots
 
-            
-            df_scores.allocation = round(100 * df_scores.allocation.astype(float), 2).astype(str) + "%"
-            df_scores = df_scores.round({x: 3 for x in decimal_fields})
-            df_scores.cash = '$' + (df_scores.cash / 1e6).astype(str) + 'm'
-            df_scores['date'] = [x.strftime("%Y-%m-%d") for x in df_scores['date']]
-            df_scores.index += 1
+        context = super(DashboardView, self).get_context_data(**kwargs)
+        context['scenario'] = self.scenario
+        context['scenarios'] = user_scenarios(self.request)
+        with span('jobs'):
+            context['jobs'] = active_jobs()
 
-            # parsing the DataFrame in json format.
-            json_records = df_scores.reset_index().to_json(orient='records')
-            context['score_table']  = list(json.loads(json_records))
+        # Rendered plot and table are cached per scenario until the next write to the underlying data
+        pk = getattr(self.scenario, 'pk', None)
+        with span('score_table'):
+            score_table = rendercache.cached(f'score_table:{pk}', self.build_score_table, self.scenario)
+        if score_table:
+            # context['plots'] = plots.create_plots()
+            with span('plot_spx'):
+                plot_spx = rendercache.cached(f'plot_spx:{pk}', plots.compare_ytd, self.scenario)
+            with span('plot_frontier'):
+                plot_frontier = rendercache.cached(f'plot_frontier:{pk}', plots.plot_frontier, self.scenario)
+            context['plots'] = {'spx': plot_spx, 'frontier': plot_frontier}
+            context['score_table'] = score_table
+            with span('screen'):
+                context['screen'] = self.screen_summary(self.scenario)
 
+        with span('backtest_table'):
+            context['backtest_table'] = self.build_backtest_table(self.scenario)
         return context
 
+    def build_backtest_table(self, scenario=None):
+        # Results of the scenario's latest finished backtest job
+        import pandas as pd
+
+        job = Job.objects.filter(kind='backtest', status='done', params__scenario=getattr(scenario, 'pk', None))\
+            .order_by('-finished').first()
+        if job is None:
+            return []
+
+        percent_fields = ['total_return', 'cagr', 'volatility', 'max_drawdown', 'turnover']
+        df = pd.DataFrame(job.result['table']).reindex(
+            columns=['threshold', 'objective', 'risk_aversion', 'sharpe', 'costs', *percent_fields])
+        for field in percent_fields:
+            df[field] = [None if x is None or pd.isna(x) else f'{100 * x:.1f}%' for x in df[field]]
+        df['sharpe'] = df.sharpe.astype(float).round(2)
+        df['costs'] = df.costs.astype(float).round(2)
+        return df.astype(object).where(df.notna(), None).to_dict('records')
+
+    def screen_summary(self, scenario=None):
+        # How many of the scored symbols the scenario's F-score threshold keeps
+        from portfolio_optimizer_webapp import screening
+
+        data_settings = scenario or DataSettings()
+        return {'threshold': data_settings.FScore_threshold,
+                'passing': len(screening.passing(data_settings.FScore_threshold)),
+                'total': len(screening.get_index().symbols)}
+
+    def build_score_table(self, scenario=None):
+        # Scores + symbol and the scenario's allocation, only the latest report per symbol leaves the database
+        from portfolio_optimizer_webapp import analytics
+        import pandas as pd
+
+        if analytics.get_backend() == 'polars':
+            with span('score_table.polars'):
+                return analytics.score_table(scenario)
+
+        score_fields = {'symbol_id': 'symbol',
+                        'fundamentals__as_of_date': 'date',
+                        'fundamentals__cash_and_cash_equivalents': 'cash',
+                        'symbol__business_summary': 'business_summary',
+                        'shares': 'shares',
+                        'allocation': 'allocation'}
+        score_fields.update({x: x for x in ['pf_score', 'pf_score_weighted', 'eps', 'roa', 'delta_cash', 'delta_roa',
+                                            'accruals', 'delta_long_lev_ratio', 'delta_current_lev_ratio',
+                                            'delta_shares', 'delta_gross_margin', 'delta_asset_turnover']})
+
+        with span('score_table.query') as record:
+            scores = with_holdings(latest_per_symbol(Scores.objects.all()), scenario).values(*score_fields)
+            df_scores = pd.DataFrame(scores, columns=list(score_fields)).rename(columns=score_fields)
+            frame_size(record, df_scores)
+
+        if df_scores.empty:
+            return []
+
+        # Formatting
+        # Symbols outside the portfolio have no allocation
+        df_scores.allocation = pd.to_numeric(df_scores.allocation).fillna(0)
+        df_scores = df_scores.sort_values(['allocation', 'symbol', 'date', 'pf_score'],
+                                          ascending=False).reset_index(drop=True)
+
+        df_scores.allocation = (100 * df_scores.allocation).map(analytics.ALLOCATION_FORMAT.format)
+        float_fields = df_scores.select_dtypes('float').columns.drop(['cash', 'shares'], errors='ignore')
+        df_scores = df_scores.round({x: 3 for x in float_fields})
+        df_scores.cash = (df_scores.cash / 1e6).map(analytics.CASH_FORMAT.format, na_action='ignore')
+        df_scores['date'] = [x.strftime("%Y-%m-%d") for x in df_scores['date']]
+        df_scores.index += 1
+
+        # Plain records for the template, NaN as None
+        df_scores = df_scores.reset_index()
+        return df_scores.astype(object).where(df_scores.notna(), None).to_dict('records')
+
 class MetaDataView(FormView):
-    model = Scores
+    model = SecurityList
+    form_class = AddDataForm
     template_name = 'optimizer/meta-data.html'
     success_url = reverse_lazy('portfolio-optimizer-meta-data')
 
+    def form_valid(self, form):
+        # New symbols are fetched and scored in the job worker
+        from portfolio_optimizer_webapp import jobs
+
+        jobs.enqueue('add_data', symbols=sorted(x.upper() for x in form.cleaned_data['symbols']))
+        return super(MetaDataView, self).form_valid(form)
+
     def get_context_data(self, **kwargs):
-        context = {}
-        if len(kwargs) > 0:
-            context = super(MetaDataView, self).get_context_data(**kwargs)
+        context = super(MetaDataView, self).get_context_data(**kwargs)
+        context['jobs'] = active_jobs()
 
         # Default data settings
         if not DataSettings.objects.exists():
@@ -103,7 +213,55 @@ class MetaDataView(FormView):
             data_settings.save()
 
         # Get list of snp data
-        context['ticker_list'] = SecurityList.objects.values('symbol', 'name', 'sector', 'last_updated', 'first_created')
+        context['ticker_list'] = SecurityList.objects.values('symbol', 'name', 'sector', 'last_updated')
         context['data_settings'] = DataSettings.objects.values('start_date').first()
 
         return context
+
+
+class JobStatusView(View):
+    # Async, so polling clients don't hold a worker thread under ASGI
+
+    async def get(self, request, pk):
+        try:
+            job = await Job.objects.aget(pk=pk)
+        except Job.DoesNotExist:
+            raise Http404('No such job')
+
+        return JsonResponse({
+            'id': job.pk,
+            'kind': job.kind,
+            'status': job.status,
+            'progress': job.progress,
+            'message': job.message,
+            'result': job.result,
+            'error': job.error.strip().splitlines()[-1] if job.error else '',
+            'created': job.created,
+            'finished': job.finished,
+        })
+
+
+class MetricsView(View):
+    # Prometheus scrape target for the instrumentation metrics of this process
+
+    def get(self, request):
+        if not instrumentation_enabled():
+            raise Http404('Instrumentation is disabled')
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@conditional
+class ChartDataView(View):
+    # Downsampled traces of a line chart for ?start=&end= at about ?points= per line (of ?scenario=),
+    # fetched on zoom
+
+    def get(self, request, name):
+        from portfolio_optimizer_webapp.downsample import MAX_POINTS, MIN_POINTS, POINTS
+        from portfolio_optimizer_webapp import plots
+
+        if name not in plots.CHARTS:
+            raise Http404('No such chart')
+        points = min(max(int_param(request, 'points', POINTS), MIN_POINTS), MAX_POINTS)
+        start, end = date_param(request, 'start'), date_param(request, 'end')
+        traces = plots.chart_data(name, start, end, points, scenario=get_scenario(request))
+        return JsonResponse({'traces': traces or []})
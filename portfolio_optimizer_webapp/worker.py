@@ -0,0 +1,18 @@
+# Entry points for process pool workers (run_jobs, backtest grids). Kept free of model
+# imports, since a spawned process unpickles these before Django is set up.
+
+
+def init_worker():
+    # Each pool process sets Django up once and is reused across jobs
+    import django
+    django.setup()
+
+
+def execute(pk):
+    from portfolio_optimizer_webapp.jobs import run_job
+    return run_job(pk)
+
+
+def run_backtest(params):
+    from portfolio_optimizer_webapp.backtest import run_params
+    return run_params(params)